@@ -0,0 +1,4 @@
+import dotenv
+
+# Load environment variables before any module reads its settings at import time
+dotenv.load_dotenv()
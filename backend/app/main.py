@@ -1,8 +1,31 @@
-from fastapi import FastAPI
+import asyncio
+import contextlib
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from .routers import csv
+from .services.dataset_store import maintain_shared_state
+from .services.offload import offloader
+from .services.shared_state import shared_state
+from .services.telemetry import HTTP_REQUEST_SECONDS, configure_logging, configure_tracing, registry, span
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # With a shared state directory several workers serve the API; keep this one's leases alive
+    maintenance = asyncio.create_task(maintain_shared_state()) if shared_state.enabled else None
+    yield
+    if maintenance is not None:
+        maintenance.cancel()
+    offloader.shutdown()
+
+
+app = FastAPI(title="Comment Picker API", description="API for CSV upload and pagination", lifespan=lifespan)
 
-app = FastAPI(title="Comment Picker API", description="API for CSV upload and pagination")
+configure_logging()
+configure_tracing()
 
 # Add CORS middleware
 app.add_middleware(
@@ -14,6 +37,27 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request by its route template (streamed bodies are timed until the response starts)"""
+    started = time.perf_counter()
+    status = 500
+    with span("http.request", method=request.method, path=request.url.path) as current:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, method=request.method, route=route_path, status=status
+            )
+            if current is not None:
+                current.set_attribute("http.route", route_path)
+                current.set_attribute("http.status_code", status)
+
+
 # Include routers
 app.include_router(csv.router)
 
@@ -21,3 +65,9 @@ app.include_router(csv.router)
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to the Comment Picker!"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
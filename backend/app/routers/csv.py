@@ -1,60 +1,320 @@
-from fastapi import APIRouter, UploadFile, File, Query, HTTPException
+from fastapi import APIRouter, UploadFile, File, Query, Header, Depends, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
-from typing import Dict, Any
-import io
-from ..services.csv_service import csv_service
+from typing import Dict, Any, Optional, List, Literal
+from ..services.csv_service import (
+    CSVService,
+    alert_rules,
+    clear_analysis_cache as clear_cache,
+    get_cascade_stats,
+    retrain_cascade,
+)
+from ..services.alerts import AlertRule
+from ..services.dataset_store import dataset_store, DEFAULT_DATASET_ID, DATASET_ID_PATTERN
+from ..services.jobs import job_manager
+from ..services.offload import offloader
 
 router = APIRouter(prefix="/csv", tags=["csv"])
 
+DatasetIdQuery = Query(
+    DEFAULT_DATASET_ID, pattern=DATASET_ID_PATTERN, description="Dataset (session) id returned by /csv/upload"
+)
+
+
+async def get_dataset(dataset_id: str = DatasetIdQuery) -> CSVService:
+    """Resolve the dataset a request operates on (on the event loop, like every other store access)"""
+    return await dataset_store.get(dataset_id)
+
+
+async def offloaded(dataset: CSVService, method, *args, **kwargs):
+    """Run a pandas-heavy read of a dataset in the offload pool, never during a change to its data"""
+    return await offloader.run(method, *args, lock=dataset.state_lock, **kwargs)
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    # Clients may keep responses but must revalidate them with If-None-Match
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Set caching headers; return a 304 response if the client's copy (If-None-Match) is current"""
+    headers = cache_headers(etag)
+    response.headers.update(headers)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+@router.post("/datasets", status_code=201)
+async def create_dataset() -> Dict[str, Any]:
+    """Reserve a new dataset id to upload into"""
+    return {"dataset_id": dataset_store.create()}
+
+
+@router.get("/datasets")
+async def list_datasets() -> List[Dict[str, Any]]:
+    """List datasets held by this server"""
+    return dataset_store.list()
+
+
+@router.delete("/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str) -> Dict[str, Any]:
+    """Delete a dataset and free its memory"""
+    await dataset_store.delete(dataset_id)
+    return {"dataset_id": dataset_id, "message": "Dataset deleted"}
+
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)) -> Dict[str, Any]:
+async def upload_file(file: UploadFile = File(...), dataset_id: str = DatasetIdQuery) -> Dict[str, Any]:
     """Upload a CSV or Excel file"""
-    return await csv_service.upload_csv(file)
+    dataset = await dataset_store.get_or_create(dataset_id)
+    result = await dataset.upload_csv(file)
+    dataset_store.update_size(dataset_id)
+    return {"dataset_id": dataset_id, **result}
 
 
 @router.get("/data")
 async def get_csv_data(
+    *,
+    request: Request,
     page: int = Query(1, ge=1, description="Page number (starting from 1)"),
-    page_size: int = Query(10, ge=1, le=100, description="Number of rows per page")
-) -> Dict[str, Any]:
+    page_size: int = Query(10, ge=1, le=1000, description="Number of rows per page"),
+    cursor: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    columns: Optional[List[str]] = Query(
+        None, description="Columns to return, in order (default: labels and comments)"
+    ),
+    sentiment: Optional[str] = Query(None, description="Only rows with this sentiment"),
+    category: Optional[str] = Query(None, description="Only rows with this category"),
+    importance: Optional[str] = Query(None, description="Only rows with this importance"),
+    commonality: Optional[str] = Query(None, description="Only rows with this commonality"),
+    dataset: CSVService = Depends(get_dataset),
+) -> Response:
     """Get paginated CSV data"""
-    return csv_service.get_paginated_data(page=page, page_size=page_size)
+    headers = cache_headers(dataset.etag)
+    if request.headers.get("if-none-match") == dataset.etag:
+        return Response(status_code=304, headers=headers)
+    filters = {'感情': sentiment, 'カテゴリ': category, '重要性': importance, '共通性': commonality}
+    page_response = await offloaded(
+        dataset, dataset.get_paginated_data,
+        page=page, page_size=page_size, cursor=cursor, columns=columns, filters=filters,
+    )
+    page_response.headers.update(headers)
+    return page_response
 
 
 @router.get("/info")
-async def get_csv_info() -> Dict[str, Any]:
+async def get_csv_info(dataset: CSVService = Depends(get_dataset)) -> Dict[str, Any]:
     """Get information about the uploaded CSV"""
-    return csv_service.get_csv_info()
+    return dataset.get_csv_info()
 
 
 @router.post("/analyze")
-async def analyze_csv() -> Dict[str, Any]:
+async def analyze_csv(
+    batch_size: Optional[int] = Query(
+        None, ge=1, le=50, description="Number of comments per LLM request (1 = one request per comment)"
+    ),
+    dataset_id: str = DatasetIdQuery,
+) -> Dict[str, Any]:
     """Analyze the uploaded CSV comments"""
-    return await csv_service.analyze_comments()
+    dataset = await dataset_store.get(dataset_id)
+    result = await dataset.analyze_comments(batch_size=batch_size)
+    dataset_store.update_size(dataset_id)
+    return result
+
+
+@router.post("/analyze/retry-errors")
+async def retry_failed_rows(
+    batch_size: Optional[int] = Query(
+        None, ge=1, le=50, description="Number of comments per LLM request (1 = one request per comment)"
+    ),
+    dataset: CSVService = Depends(get_dataset),
+) -> Dict[str, Any]:
+    """Re-analyze only the rows whose classification failed in the last run"""
+    return await dataset.analyze_comments(batch_size=batch_size, retry_errors=True)
+
+
+@router.post("/analyze/jobs", status_code=202)
+async def start_analysis_job(
+    batch_size: Optional[int] = Query(
+        None, ge=1, le=50, description="Number of comments per LLM request (1 = one request per comment)"
+    ),
+    retry_errors: bool = Query(False, description="Only re-analyze rows that failed in the last run"),
+    dataset: CSVService = Depends(get_dataset),
+) -> Dict[str, Any]:
+    """Start analyzing the uploaded CSV comments in the background"""
+    return dataset.start_analysis_job(batch_size=batch_size, retry_errors=retry_errors)
+
+
+@router.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(job_id: str) -> Dict[str, Any]:
+    """Get progress of a background analysis job"""
+    return job_manager.get(job_id).progress()
+
+
+@router.get("/analyze/jobs/{job_id}/events")
+async def stream_analysis_job(job_id: str, last_event_id: Optional[int] = Header(None)):
+    """Stream per-row results, dangerous comments and progress of an analysis job as Server-Sent Events
+
+    Only the latest row events are replayed, and none once the job has finished; read rows from /csv/data.
+    """
+    job = job_manager.get(job_id)
+    return StreamingResponse(
+        job.stream(last_event_id=last_event_id if last_event_id is not None else -1),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.delete("/cache")
+async def clear_analysis_cache() -> Dict[str, Any]:
+    """Invalidate cached comment classifications"""
+    return clear_cache()
+
+
+@router.get("/cascade")
+async def get_cascade() -> Dict[str, Any]:
+    """Cascade classifier state, live agreement with the LLM and training metrics"""
+    return get_cascade_stats()
+
+
+@router.post("/cascade/retrain")
+async def retrain_cascade_classifier(
+    limit: Optional[int] = Query(None, ge=1, description="Train on at most this many recent LLM labels"),
+) -> Dict[str, Any]:
+    """Retrain the cascade classifier on the LLM labels stored in the analysis cache"""
+    try:
+        # Training is CPU-bound numpy work, so it runs in the offload pool like the other heavy paths
+        return await offloader.run(retrain_cascade, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from None
 
 
 @router.get("/download")
-async def download_analyzed_csv():
-    """Download the analyzed CSV file"""
-    return csv_service.download_analyzed_csv()
+async def download_analyzed_csv(
+    format: Literal["csv", "parquet", "xlsx"] = Query(
+        "csv", description="Export file format (xlsx is assembled in full before it is sent; csv and parquet stream)"
+    ),
+    columns: Optional[List[str]] = Query(None, description="Columns to include, in order (default: all)"),
+    gzip: bool = Query(False, description="Gzip-compress the export"),
+    bom: bool = Query(False, description="Prefix CSV output with a UTF-8 BOM for Excel"),
+    dataset: CSVService = Depends(get_dataset),
+):
+    """Download the analyzed data"""
+    return dataset.download_analyzed_csv(export_format=format, columns=columns, compress=gzip, bom=bom)
 
 
 @router.get("/statistics")
-async def get_analysis_statistics() -> Dict[str, Any]:
+async def get_analysis_statistics(
+    request: Request, response: Response, dataset: CSVService = Depends(get_dataset)
+) -> Dict[str, Any]:
     """Get analysis statistics for visualization"""
-    return csv_service.get_analysis_statistics()
+    cached = not_modified(request, response, dataset.etag)
+    if cached is not None:
+        return cached
+    return await offloaded(dataset, dataset.get_analysis_statistics)
+
+
+@router.get("/alert-rules")
+async def list_alert_rules() -> List[Dict[str, Any]]:
+    """List alert rules"""
+    return [rule.model_dump(by_alias=True) for rule in alert_rules.list()]
+
+
+@router.post("/alert-rules", status_code=201)
+async def create_alert_rule(rule: AlertRule) -> Dict[str, Any]:
+    """Create an alert rule (an existing rule with the same id is replaced)"""
+    return alert_rules.put(rule).model_dump(by_alias=True)
+
+
+@router.put("/alert-rules/{rule_id}")
+async def update_alert_rule(rule_id: str, rule: AlertRule) -> Dict[str, Any]:
+    """Replace an alert rule"""
+    alert_rules.get(rule_id)
+    return alert_rules.put(rule.model_copy(update={"id": rule_id})).model_dump(by_alias=True)
+
+
+@router.delete("/alert-rules/{rule_id}")
+async def delete_alert_rule(rule_id: str) -> Dict[str, Any]:
+    """Delete an alert rule"""
+    alert_rules.delete(rule_id)
+    return {"message": f"Alert rule {rule_id} deleted"}
+
+
+@router.get("/alerts")
+async def get_alerts(
+    max_row_ids: int = Query(100, ge=0, le=10000, description="Maximum number of matching row ids per alert"),
+    include_all: bool = Query(False, description="Also return rules that did not fire"),
+    dataset: CSVService = Depends(get_dataset),
+) -> Dict[str, Any]:
+    """Evaluate the alert rules against the dataset and return the fired alerts"""
+    return await offloaded(dataset, dataset.evaluate_alerts, max_row_ids=max_row_ids, include_all=include_all)
 
 
 @router.get("/top-comments")
 async def get_top_comments(
-    max_count: int = Query(5, ge=1, le=10, description="Maximum number of top comments to return")
+    max_count: int = Query(5, ge=1, le=10, description="Maximum number of top comments to return"),
+    dataset: CSVService = Depends(get_dataset),
 ) -> Dict[str, Any]:
     """Get top comments based on importance and commonality score"""
-    return csv_service.get_top_comments(max_count=max_count)
+    return await offloaded(dataset, dataset.get_top_comments, max_count=max_count)
+
+
+@router.get("/top-comments/ranked")
+async def get_ranked_comments(
+    limit: int = Query(20, ge=1, le=200, description="Number of comments per page"),
+    cursor: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    category: Optional[str] = Query(None, description="Only comments of this category"),
+    sentiment: Optional[str] = Query(None, description="Only comments of this sentiment"),
+    dataset: CSVService = Depends(get_dataset),
+) -> Dict[str, Any]:
+    """Browse all comments ranked by importance and commonality score"""
+    return await offloaded(
+        dataset, dataset.get_ranked_comments, limit=limit, cursor=cursor, category=category, sentiment=sentiment
+    )
+
+
+@router.get("/clusters")
+async def get_clusters(
+    limit: int = Query(20, ge=1, le=500, description="Maximum number of clusters to return"),
+    min_size: int = Query(2, ge=1, description="Only clusters with at least this many rows"),
+    sample_size: int = Query(5, ge=0, le=50, description="Member ids listed per cluster"),
+    dataset: CSVService = Depends(get_dataset),
+) -> Dict[str, Any]:
+    """Largest clusters of similar comments (ids are ordered by size), from which commonality is derived"""
+    return await offloaded(dataset, dataset.get_clusters, limit=limit, min_size=min_size, sample_size=sample_size)
+
+
+@router.get("/clusters/{cluster_id}")
+async def get_cluster(
+    cluster_id: int,
+    page: int = Query(1, ge=1, description="Page number (starting from 1)"),
+    page_size: int = Query(100, ge=1, le=1000, description="Number of comments per page"),
+    dataset: CSVService = Depends(get_dataset),
+) -> Dict[str, Any]:
+    """Comments of one cluster"""
+    return await offloaded(dataset, dataset.get_cluster, cluster_id, page=page, page_size=page_size)
 
 
 @router.post("/generate-report")
-async def generate_comment_report() -> Dict[str, Any]:
-    """Generate a comprehensive report from top 50 comments using Nova Pro"""
-    return await csv_service.generate_comment_report()
+async def generate_comment_report(
+    mode: Literal["top", "map_reduce"] = Query(
+        "top", description="top: the 50 highest scoring comments; map_reduce: every comment, summarized in chunks"
+    ),
+    dataset: CSVService = Depends(get_dataset),
+) -> Dict[str, Any]:
+    """Generate a comprehensive report using Nova Pro"""
+    return await dataset.generate_comment_report(mode=mode)
+
+
+@router.get("/generate-report/stream")
+async def stream_comment_report(
+    mode: Literal["top", "map_reduce"] = Query(
+        "top", description="top: the 50 highest scoring comments; map_reduce: every comment, summarized in chunks"
+    ),
+    dataset: CSVService = Depends(get_dataset),
+):
+    """Stream the report as Server-Sent Events (section, delta, stage, done and error events)"""
+    return StreamingResponse(
+        dataset.stream_comment_report(mode=mode),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
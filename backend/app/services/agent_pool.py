@@ -0,0 +1,81 @@
+import os
+import threading
+from collections.abc import Callable, Hashable
+from typing import Any
+
+import anyio.to_thread
+import boto3
+from botocore.client import BaseClient
+from botocore.config import Config
+from pydantic_ai import Agent
+
+
+class AgentPool:
+    """Process-wide cache of pre-built agents sharing a single Bedrock runtime client
+
+    Agents are keyed by (model_id, output_type, settings) so every comment reuses the
+    same model, settings and boto3 client (and therefore the same keep-alive HTTP
+    connection pool) instead of rebuilding them per request. Backends that do not talk
+    to Bedrock pass `use_bedrock_client=False` and get no client.
+    """
+
+    def __init__(self, factory: Callable[..., Agent], max_connections: int, use_bedrock_client: bool = True):
+        self.factory = factory
+        self.max_connections = max_connections
+        self.use_bedrock_client = use_bedrock_client
+        self._agents: dict[tuple[Hashable, ...], Agent] = {}
+        self._client: BaseClient | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> BaseClient:
+        """Bedrock runtime client sized for the analysis concurrency"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    session = boto3.Session(region_name=os.getenv('AWS_REGION'))
+                    self._client = session.client(
+                        'bedrock-runtime',
+                        config=Config(
+                            max_pool_connections=self.max_connections,
+                            tcp_keepalive=True,
+                            read_timeout=float(os.getenv('AWS_READ_TIMEOUT', '300')),
+                            connect_timeout=float(os.getenv('AWS_CONNECT_TIMEOUT', '60')),
+                        ),
+                    )
+        return self._client
+
+    def get(self, model_id: str, output_type: Any | None = None, **settings: Any) -> Agent:
+        """Return the pooled agent for the given model, output type and settings"""
+        self._widen_thread_limiter()
+
+        key = (model_id, output_type, *sorted(settings.items()))
+        agent = self._agents.get(key)
+        if agent is None:
+            client = self.client if self.use_bedrock_client else None
+            with self._lock:
+                agent = self._agents.get(key)
+                if agent is None:
+                    agent = self.factory(
+                        model_id=model_id,
+                        output_type=output_type,
+                        bedrock_client=client,
+                        **settings,
+                    )
+                    self._agents[key] = agent
+        return agent
+
+    def clear(self) -> None:
+        """Drop all pooled agents and the shared client"""
+        with self._lock:
+            self._agents.clear()
+            self._client = None
+
+    def _widen_thread_limiter(self) -> None:
+        # boto3 calls run in anyio worker threads; the default limit of 40 threads
+        # would otherwise cap the analysis concurrency below the connection pool size
+        try:
+            limiter = anyio.to_thread.current_default_thread_limiter()
+        except RuntimeError:
+            return
+        limiter.total_tokens = max(limiter.total_tokens, self.max_connections)
@@ -0,0 +1,47 @@
+
+import numpy as np
+
+# Axes of the count cube, in order
+CUBE_COLUMNS = ['カテゴリ', '感情', '重要性', '共通性']
+
+
+class LabelCube:
+    """Row counts for every (category, sentiment, importance, commonality) combination
+
+    Built in one pass over the label codes and kept up to date incrementally as rows
+    are re-classified, so statistics never need to scan the DataFrame.
+    """
+
+    def __init__(self, categories: dict[str, list[str]]):
+        self.categories = {column: list(categories[column]) for column in CUBE_COLUMNS}
+        self.shape = tuple(len(self.categories[column]) for column in CUBE_COLUMNS)
+        self.counts = np.zeros(self.shape, dtype=np.int64)
+
+    @classmethod
+    def from_codes(cls, categories: dict[str, list[str]], codes: np.ndarray) -> "LabelCube":
+        """Build a cube from an (n_rows, 4) array of category codes ordered like CUBE_COLUMNS"""
+        cube = cls(categories)
+        cube.add(codes)
+        return cube
+
+    def _bincount(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.asarray(codes, dtype=np.int64).reshape(-1, len(CUBE_COLUMNS))
+        # Rows with a missing label (code -1) are not counted
+        codes = codes[(codes >= 0).all(axis=1)]
+        flat = np.ravel_multi_index(codes.T, self.shape)
+        return np.bincount(flat, minlength=self.counts.size).reshape(self.shape)
+
+    def add(self, codes: np.ndarray) -> None:
+        self.counts += self._bincount(codes)
+
+    def remove(self, codes: np.ndarray) -> None:
+        self.counts -= self._bincount(codes)
+
+    def counts_by(self, *columns: str) -> np.ndarray:
+        """Counts summed over every axis except `columns` (kept in the given order)"""
+        axes = [CUBE_COLUMNS.index(column) for column in columns]
+        other_axes = tuple(axis for axis in range(len(CUBE_COLUMNS)) if axis not in axes)
+        summed = self.counts.sum(axis=other_axes)
+        # sum() keeps the remaining axes in cube order; reorder them as requested
+        order = np.argsort(np.argsort(axes))
+        return np.transpose(summed, order) if summed.ndim > 1 else summed
@@ -0,0 +1,219 @@
+import builtins
+import os
+import threading
+import uuid
+from collections.abc import Sequence
+from typing import Any, Literal
+
+import numpy as np
+from fastapi import HTTPException
+from pydantic import BaseModel, ConfigDict, Field
+
+from .aggregates import CUBE_COLUMNS, LabelCube
+from .shared_state import SharedState
+
+# Rule targets and the label column each one reads
+ALERT_TARGETS = {
+    'sentiment': '感情',
+    'category': 'カテゴリ',
+    'importance': '重要性',
+    'commonality': '共通性',
+}
+
+# (target, column) pairs in label cube axis order
+CUBE_TARGETS = [({label: target for target, label in ALERT_TARGETS.items()}[column], column) for column in CUBE_COLUMNS]
+
+# Percentage rules fire during an analysis only once this many rows are classified, so that the share of
+# the first few rows does not raise alerts
+ALERT_MIN_ROWS = int(os.getenv('ALERT_MIN_ROWS', '100'))
+
+AlertTarget = Literal['sentiment', 'category', 'importance', 'commonality']
+
+
+class AlertRule(BaseModel):
+    """Alert condition, in the same shape as the frontend's AlertCondition"""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    name: str
+    type: Literal['count', 'percentage'] = 'percentage'
+    target: AlertTarget
+    target_value: str | None = Field(None, alias='targetValue')
+    operator: Literal['gte', 'lte', 'eq']
+    threshold: float
+    enabled: bool = True
+    # Further labels the rows must also have, e.g. {"importance": "高"} on a sentiment rule
+    filters: dict[AlertTarget, str] = Field(default_factory=dict)
+
+    def conditions(self) -> dict[str, str]:
+        """Label column -> required value for every constraint of the rule"""
+        conditions = {ALERT_TARGETS[target]: value for target, value in self.filters.items()}
+        if self.target_value is not None:
+            conditions[ALERT_TARGETS[self.target]] = self.target_value
+        return conditions
+
+
+class AlertRuleStore:
+    """Alert rules shared by all datasets, compiled into a rule x label-combination matrix
+
+    Rules are evaluated from the offload pool while the API changes them, so rule changes and
+    compiling (which swaps in the enabled rules and their matrix together) hold a lock.
+    """
+
+    def __init__(self, categories: dict[str, list[str]], shared: SharedState | None = None):
+        self.categories = categories
+        self.rules: dict[str, AlertRule] = {}
+        self.shared = shared if shared is not None and shared.enabled else None
+        # (enabled rules, their matrix), rebuilt on the next evaluation after any rule change
+        self._compiled: tuple[list[AlertRule], np.ndarray] | None = None
+        self._lock = threading.Lock()
+
+    def _sync(self) -> None:
+        """Adopt rules other workers created, changed or deleted"""
+        if self.shared is None:
+            return
+        rules = {rule_id: AlertRule.model_validate_json(rule) for rule_id, rule in self.shared.alert_rules()}
+        with self._lock:
+            if rules != self.rules:
+                self.rules = rules
+                self._compiled = None
+
+    def _validate(self, rule: AlertRule) -> None:
+        for column, value in rule.conditions().items():
+            if value not in self.categories[column]:
+                raise HTTPException(status_code=422, detail=f"Unknown {column} value: {value}")
+
+    def list(self) -> list[AlertRule]:
+        self._sync()
+        return list(self.rules.values())
+
+    def get(self, rule_id: str) -> AlertRule:
+        self._sync()
+        rule = self.rules.get(rule_id)
+        if rule is None:
+            raise HTTPException(status_code=404, detail=f"Alert rule {rule_id} not found")
+        return rule
+
+    def put(self, rule: AlertRule) -> AlertRule:
+        """Create or replace a rule"""
+        self._validate(rule)
+        if self.shared is not None:
+            self.shared.save_alert_rule(rule.id, rule.model_dump_json())
+        with self._lock:
+            self.rules[rule.id] = rule
+            self._compiled = None
+        return rule
+
+    def delete(self, rule_id: str) -> None:
+        self.get(rule_id)
+        if self.shared is not None:
+            self.shared.delete_alert_rule(rule_id)
+        with self._lock:
+            self.rules.pop(rule_id, None)
+            self._compiled = None
+
+    def compiled(self) -> tuple[builtins.list[AlertRule], np.ndarray]:
+        """Enabled rules and their (n_rules, n_cells) 0/1 matrix over the label cube cells"""
+        self._sync()
+        with self._lock:
+            if self._compiled is None:
+                enabled = [rule for rule in self.rules.values() if rule.enabled]
+                shape = tuple(len(self.categories[column]) for column in CUBE_COLUMNS)
+                matrix = np.ones((len(enabled), *shape), dtype=np.int64)
+                for r, rule in enumerate(enabled):
+                    for column, value in rule.conditions().items():
+                        axis = CUBE_COLUMNS.index(column)
+                        keep = np.zeros(shape[axis], dtype=np.int64)
+                        keep[self.categories[column].index(value)] = 1
+                        matrix[r] *= keep.reshape([-1 if a == axis else 1 for a in range(len(shape))])
+                self._compiled = (enabled, matrix.reshape(len(enabled), int(np.prod(shape))))
+            return self._compiled
+
+    def evaluate(
+        self,
+        cube: LabelCube,
+        cells: np.ndarray | None = None,
+        row_ids: Sequence[Any] | None = None,
+        max_row_ids: int = 100,
+        include_all: bool = False,
+    ) -> dict[str, Any]:
+        """Evaluate every enabled rule against a label cube in one matrix product
+
+        `cells` are the flat cube cell of each row (-1 for unlabeled rows); when given,
+        fired alerts list the ids of their matching rows.
+        """
+        rules, matrix = self.compiled()
+        counts = matrix @ cube.counts.ravel()
+        total = int(cube.counts.sum())
+        percentages = np.round(counts / total * 100, 1) if total else np.zeros(len(rules))
+
+        is_percentage = np.array([rule.type == 'percentage' for rule in rules], dtype=bool)
+        values = np.where(is_percentage, percentages, counts)
+        thresholds = np.array([rule.threshold for rule in rules], dtype=float)
+        operators = np.array([rule.operator for rule in rules])
+        triggered = np.select(
+            [operators == 'gte', operators == 'lte'],
+            [values >= thresholds, values <= thresholds],
+            default=values == thresholds,
+        ) if rules else np.zeros(0, dtype=bool)
+
+        alerts = []
+        for r, rule in enumerate(rules):
+            if not (triggered[r] or include_all):
+                continue
+            unit = '%' if rule.type == 'percentage' else '件'
+            value = float(values[r]) if rule.type == 'percentage' else int(values[r])
+            alert = {
+                "rule": rule.model_dump(by_alias=True),
+                "triggered": bool(triggered[r]),
+                "current_value": value,
+                "matched_rows": int(counts[r]),
+                "message": f"{rule.target_value or rule.target} が {value}{unit} (閾値: {rule.threshold:g}{unit})",
+            }
+            if triggered[r] and cells is not None:
+                labeled = cells >= 0
+                matches = np.flatnonzero(labeled & (matrix[r][np.where(labeled, cells, 0)] == 1))
+                positions = matches[:max_row_ids]
+                alert["row_ids"] = [str(row_ids[i]) for i in positions] if row_ids is not None else positions.tolist()
+            alerts.append(alert)
+
+        return {
+            "alerts": alerts,
+            "triggered_count": int(triggered.sum()),
+            "evaluated_rules": len(rules),
+            "analyzed_rows": total,
+        }
+
+
+class AlertMonitor:
+    """Tracks alerts while an analysis streams in, reporting each rule the first time it fires
+
+    Percentage rules are held back until `min_rows` rows are classified. A rule that fired
+    stays latched for the rest of the run, even if later rows bring it back under its threshold.
+    """
+
+    def __init__(self, store: AlertRuleStore, cube: LabelCube, min_rows: int = ALERT_MIN_ROWS):
+        self.store = store
+        self.cube = cube
+        self.min_rows = min_rows
+        self.firing: set = set()
+
+    def add_rows(self, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Count newly classified rows and return the alerts that fired because of them"""
+        codes = [
+            [self.cube.categories[column].index(row[target]) for target, column in CUBE_TARGETS]
+            for row in rows
+            if not row.get("is_error")
+        ]
+        if codes:
+            self.cube.add(np.array(codes))
+
+        result = self.store.evaluate(self.cube)
+        settled = result["analyzed_rows"] >= self.min_rows
+        fired = [
+            alert for alert in result["alerts"]
+            if alert["rule"]["id"] not in self.firing and (settled or alert["rule"]["type"] != "percentage")
+        ]
+        self.firing.update(alert["rule"]["id"] for alert in fired)
+        return fired
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from typing import Any
+
+
+class AnalysisCache:
+    """Persistent, size-bounded LRU cache of comment classifications
+
+    Entries are content-addressed by a hash of the combined comment JSON, the model id
+    and the prompt/schema version, so changing any of them naturally misses the cache.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @staticmethod
+    def make_key(comment: str, model_id: str, prompt_version: str) -> str:
+        """Build the cache key for a comment classified by the given model and prompt"""
+        payload = f"{model_id}\x1f{prompt_version}\x1f{comment}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS classifications ("
+                " key TEXT PRIMARY KEY,"
+                " result TEXT NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS classifications_last_used ON classifications (last_used)"
+            )
+            # Comment text, kept as training data for the local cascade classifier
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(classifications)")}
+            if "comment" not in columns:
+                self._conn.execute("ALTER TABLE classifications ADD COLUMN comment TEXT")
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, dict[str, Any]]:
+        """Look up several keys at once, refreshing their LRU position"""
+        keys = list(dict.fromkeys(keys))
+        found: dict[str, dict[str, Any]] = {}
+        with self._lock:
+            conn = self._connection()
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, result FROM classifications WHERE key IN ({placeholders})",  # noqa: S608
+                    chunk,
+                ).fetchall()
+                for key, result in rows:
+                    found[key] = json.loads(result)
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE classifications SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                conn.commit()
+        return found
+
+    def put_many(self, entries: dict[str, dict[str, Any]], comments: dict[str, str] | None = None) -> None:
+        """Store classifications and evict the least recently used entries over the size limit
+
+        `comments` maps keys to the classified comment text, stored for training.
+        """
+        if not entries:
+            return
+        comments = comments or {}
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO classifications (key, result, last_used, comment) VALUES (?, ?, ?, ?)",
+                [
+                    (key, json.dumps(result, ensure_ascii=False), now, comments.get(key))
+                    for key, result in entries.items()
+                ],
+            )
+            (count,) = conn.execute("SELECT COUNT(*) FROM classifications").fetchone()
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM classifications WHERE key IN ("
+                    " SELECT key FROM classifications ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            conn.commit()
+
+    def clear(self) -> int:
+        """Remove every cached classification and return how many were removed"""
+        with self._lock:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM classifications").rowcount
+            conn.commit()
+        return removed
+
+    def examples(self, limit: int | None = None) -> list[tuple[str, dict[str, Any]]]:
+        """(comment, labels) pairs of stored classifications, most recently used first"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT comment, result FROM classifications WHERE comment IS NOT NULL"
+                " ORDER BY last_used DESC LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [(comment, json.loads(result)) for comment, result in rows]
+
+    def size(self) -> int:
+        """Number of cached classifications"""
+        with self._lock:
+            (count,) = self._connection().execute("SELECT COUNT(*) FROM classifications").fetchone()
+        return count
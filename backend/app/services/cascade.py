@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import random
+import threading
+from typing import Any
+
+import numpy as np
+
+from .dedup import normalize_comment
+
+# Trained cascade model, written by the retrain command and reloaded when it changes
+CASCADE_MODEL_PATH = os.getenv('CASCADE_MODEL_PATH', 'data/cascade_model.npz')
+# Label rows locally when a trained model exists
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'true').lower() == 'true'
+# Minimum probability every label must reach for a row to be labeled locally
+CASCADE_CONFIDENCE = float(os.getenv('CASCADE_CONFIDENCE', '0.95'))
+# Share of locally labeled rows also sent to the LLM to measure agreement
+CASCADE_AUDIT_RATE = float(os.getenv('CASCADE_AUDIT_RATE', '0.05'))
+# Fewest LLM-labeled examples needed to train a model
+CASCADE_MIN_EXAMPLES = int(os.getenv('CASCADE_MIN_EXAMPLES', '500'))
+
+# Hashed character n-gram features
+FEATURE_DIM = 2 ** 18
+NGRAM_SIZES = (1, 2, 3)
+_HASH_BASE = 1_000_003
+_HASH_MOD = 2 ** 31 - 1
+_BOUNDARY = 2
+_EMPTY = "\x03"
+
+# Thresholds reported in the holdout metrics
+METRIC_THRESHOLDS = (0.8, 0.9, 0.95, 0.99)
+
+
+def comment_features(comment: str) -> np.ndarray:
+    """Unique hashed character 1-3 gram ids of a comment's normalized answers"""
+    try:
+        fields = json.loads(normalize_comment(comment))
+        text = "\x1e".join(fields.values()) if isinstance(fields, dict) else str(fields)
+    except ValueError:
+        text = normalize_comment(comment)
+    codes = np.frombuffer((text or _EMPTY).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    codes = np.concatenate([[_BOUNDARY], codes, [_BOUNDARY]])
+
+    features = []
+    for n in NGRAM_SIZES:
+        if len(codes) < n:
+            continue
+        hashed = np.full(len(codes) - n + 1, n, dtype=np.int64)
+        for k in range(n):
+            hashed = (hashed * _HASH_BASE + codes[k:len(codes) - n + 1 + k]) % _HASH_MOD
+        features.append(hashed % FEATURE_DIM)
+    return np.unique(np.concatenate(features))
+
+
+def _feature_matrix(comments: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Concatenated feature ids of all comments, and the offset where each comment's ids start"""
+    features = [comment_features(comment) for comment in comments]
+    lengths = np.array([len(f) for f in features], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.concatenate(features) if features else np.zeros(0, dtype=np.int64), offsets
+
+
+class CascadeClassifier:
+    """Multinomial naive Bayes over hashed character n-grams, one head per label
+
+    A linear model in log space: training is a single counting pass and prediction a
+    gather-and-sum over each comment's features, both CPU-only numpy.
+    """
+
+    def __init__(
+        self,
+        labels: dict[str, list[str]],
+        log_priors: dict[str, np.ndarray],
+        log_likelihoods: dict[str, np.ndarray],
+        metrics: dict[str, Any] | None = None,
+    ):
+        self.labels = labels
+        self.log_priors = log_priors
+        self.log_likelihoods = log_likelihoods
+        self.metrics = metrics or {}
+
+    @classmethod
+    def fit(
+        cls, comments: list[str], results: list[dict[str, Any]], labels: dict[str, list[str]], alpha: float = 1.0
+    ) -> "CascadeClassifier":
+        features, offsets = _feature_matrix(comments)
+        rows = np.repeat(np.arange(len(comments)), np.diff(np.append(offsets, len(features))))
+
+        log_priors, log_likelihoods = {}, {}
+        for field, classes in labels.items():
+            y = np.array([classes.index(result[field]) for result in results], dtype=np.int64)
+            counts = np.bincount(
+                y[rows] * FEATURE_DIM + features, minlength=len(classes) * FEATURE_DIM
+            ).reshape(len(classes), FEATURE_DIM).astype(np.float64)
+            class_counts = np.bincount(y, minlength=len(classes)).astype(np.float64)
+            log_priors[field] = np.log((class_counts + alpha) / (class_counts.sum() + alpha * len(classes)))
+            log_likelihoods[field] = np.log(
+                (counts + alpha) / (counts.sum(axis=1, keepdims=True) + alpha * FEATURE_DIM)
+            ).astype(np.float32)
+        return cls(labels, log_priors, log_likelihoods)
+
+    @classmethod
+    def train(
+        cls,
+        comments: list[str],
+        results: list[dict[str, Any]],
+        labels: dict[str, list[str]],
+        holdout: float = 0.2,
+        seed: int = 0,
+    ) -> "CascadeClassifier":
+        """Measure agreement with the LLM labels on a holdout split, then fit on every example"""
+        order = np.random.default_rng(seed).permutation(len(comments))
+        split = int(len(comments) * (1 - holdout))
+        train_rows, test_rows = order[:split], order[split:]
+
+        metrics: dict[str, Any] = {"examples": len(comments), "holdout_examples": len(test_rows)}
+        if len(test_rows):
+            model = cls.fit([comments[i] for i in train_rows], [results[i] for i in train_rows], labels)
+            metrics.update(model.agreement([comments[i] for i in test_rows], [results[i] for i in test_rows]))
+
+        model = cls.fit(comments, results, labels)
+        model.metrics = metrics
+        return model
+
+    def predict(self, comments: list[str]) -> tuple[list[dict[str, str]], np.ndarray]:
+        """Labels of each comment and the lowest of their label probabilities"""
+        if not comments:
+            return [], np.zeros(0)
+        features, offsets = _feature_matrix(comments)
+
+        predictions = [{} for _ in comments]
+        confidence = np.ones(len(comments))
+        for field, classes in self.labels.items():
+            scores = np.add.reduceat(self.log_likelihoods[field][:, features], offsets, axis=1)
+            scores = scores + self.log_priors[field][:, None]
+            scores -= scores.max(axis=0, keepdims=True)
+            probabilities = np.exp(scores)
+            probabilities /= probabilities.sum(axis=0, keepdims=True)
+            best = probabilities.argmax(axis=0)
+            confidence = np.minimum(confidence, probabilities.max(axis=0))
+            for prediction, label in zip(predictions, best):
+                prediction[field] = classes[label]
+        return predictions, confidence
+
+    def agreement(self, comments: list[str], results: list[dict[str, Any]]) -> dict[str, Any]:
+        """Agreement with reference (LLM) labels, overall and at each confidence threshold"""
+        predictions, confidence = self.predict(comments)
+        matches = {
+            field: np.array([p[field] == r[field] for p, r in zip(predictions, results)])
+            for field in self.labels
+        }
+        all_match = np.logical_and.reduce(list(matches.values()))
+        by_threshold = {}
+        for threshold in METRIC_THRESHOLDS:
+            covered = confidence >= threshold
+            by_threshold[str(threshold)] = {
+                "coverage": round(float(covered.mean()), 4),
+                "agreement": round(float(all_match[covered].mean()), 4) if covered.any() else None,
+            }
+        return {
+            "label_accuracy": {field: round(float(match.mean()), 4) for field, match in matches.items()},
+            "joint_accuracy": round(float(all_match.mean()), 4),
+            "thresholds": by_threshold,
+        }
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        for field in self.labels:
+            arrays[f"prior__{field}"] = self.log_priors[field]
+            arrays[f"likelihood__{field}"] = self.log_likelihoods[field]
+        meta = json.dumps({"labels": self.labels, "metrics": self.metrics}, ensure_ascii=False)
+        # Write then rename, so a running server never loads a half-written model
+        temp_path = f"{path}.tmp.npz"
+        np.savez_compressed(temp_path, meta=np.array(meta), **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CascadeClassifier":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            labels = meta["labels"]
+            return cls(
+                labels,
+                {field: data[f"prior__{field}"] for field in labels},
+                {field: data[f"likelihood__{field}"] for field in labels},
+                meta["metrics"],
+            )
+
+
+class Cascade:
+    """Local first stage of the analysis: labels confident rows, routes the rest to the LLM"""
+
+    def __init__(self, path: str, threshold: float, audit_rate: float, enabled: bool = True):
+        self.path = path
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.enabled = enabled
+        self._model: CascadeClassifier | None = None
+        self._model_mtime: float | None = None
+        self._lock = threading.Lock()
+        self.local_rows = 0
+        self.audited_rows = 0
+        self.audit_agreements = 0
+
+    @property
+    def model(self) -> CascadeClassifier | None:
+        """The trained model, reloaded when the file on disk has been retrained"""
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self._model, self._model_mtime = None, None
+                return None
+            if mtime != self._model_mtime:
+                self._model = CascadeClassifier.load(self.path)
+                self._model_mtime = mtime
+            return self._model
+
+    def split(
+        self, comments: dict[int, str]
+    ) -> tuple[dict[int, dict[str, str]], dict[int, dict[str, str]], dict[int, str]]:
+        """Split comments into (labeled locally, audited, left for the LLM)
+
+        Audited rows were confident too, but are also sent to the LLM so that live
+        agreement can be measured; their predictions are returned for `record_audit`.
+        """
+        model = self.model if self.enabled else None
+        if model is None or not comments:
+            return {}, {}, dict(comments)
+
+        ids = list(comments)
+        predictions, confidence = model.predict([comments[i] for i in ids])
+        local, audited, remaining = {}, {}, {}
+        for i, prediction, score in zip(ids, predictions, confidence):
+            if score < self.threshold:
+                remaining[i] = comments[i]
+            elif random.random() < self.audit_rate:  # noqa: S311
+                audited[i] = prediction
+                remaining[i] = comments[i]
+            else:
+                local[i] = prediction
+        # Runs in the offload pool, possibly for several datasets at once
+        with self._lock:
+            self.local_rows += len(local)
+        return local, audited, remaining
+
+    def record_audit(self, prediction: dict[str, str], result: dict[str, Any]) -> None:
+        """Compare a local prediction with the LLM's labels for the same comment"""
+        self.audited_rows += 1
+        self.audit_agreements += all(result.get(field) == value for field, value in prediction.items())
+
+    def retrain(self, examples: list[tuple[str, dict[str, Any]]], labels: dict[str, list[str]]) -> dict[str, Any]:
+        """Train on (comment, LLM labels) pairs and replace the saved model"""
+        usable = [
+            (comment, result) for comment, result in examples
+            if all(result.get(field) in classes for field, classes in labels.items())
+        ]
+        if len(usable) < CASCADE_MIN_EXAMPLES:
+            raise ValueError(f"Need at least {CASCADE_MIN_EXAMPLES} labeled comments to train, found {len(usable)}")
+        model = CascadeClassifier.train([c for c, _ in usable], [r for _, r in usable], labels)
+        model.save(self.path)
+        return model.metrics
+
+    def stats(self) -> dict[str, Any]:
+        model = self.model
+        return {
+            "enabled": self.enabled,
+            "trained": model is not None,
+            "threshold": self.threshold,
+            "audit_rate": self.audit_rate,
+            "local_rows": self.local_rows,
+            "audited_rows": self.audited_rows,
+            "audit_agreement": round(self.audit_agreements / self.audited_rows, 4) if self.audited_rows else None,
+            "training_metrics": model.metrics if model is not None else None,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local cascade classifier for comment analysis")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    retrain = subcommands.add_parser("retrain", help="Train on the LLM labels stored in the analysis cache")
+    retrain.add_argument("--limit", type=int, default=None, help="Use at most this many recent examples")
+    subcommands.add_parser("metrics", help="Show the holdout metrics of the saved model")
+    args = parser.parse_args()
+
+    # csv_service imports this module, so it is only loaded once the command line is parsed
+    from .csv_service import cascade, retrain_cascade  # noqa: PLC0415
+
+    if args.command == "retrain":
+        try:
+            metrics = retrain_cascade(limit=args.limit)["metrics"]
+        except ValueError as e:
+            raise SystemExit(f"error: {e}") from None
+    else:
+        model = cascade.model
+        metrics = model.metrics if model is not None else {"error": f"No model at {cascade.path}"}
+    print(json.dumps(metrics, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+
+class AnalysisCheckpoint:
+    """Per-row analysis results persisted while a run is in progress
+
+    Rows are stored under a fingerprint of the dataset, so an interrupted run can be
+    resumed after a restart by uploading the same file and analyzing it again. Checkpoints
+    not updated for `ttl_seconds`, and all but the `max_datasets` most recent, are pruned.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_datasets: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_datasets = max_datasets
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @staticmethod
+    def fingerprint(comments: list[str], model_id: str, prompt_version: str) -> str:
+        """Identify a dataset by its comments and the model/prompt used to classify them"""
+        digest = hashlib.sha256(f"{model_id}\x1f{prompt_version}".encode())
+        for comment in comments:
+            digest.update(b"\x1e")
+            digest.update(comment.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                " dataset TEXT NOT NULL,"
+                " row INTEGER NOT NULL,"
+                " result TEXT NOT NULL,"
+                " is_error INTEGER NOT NULL,"
+                " PRIMARY KEY (dataset, row))"
+            )
+            # When each row was last saved, for pruning abandoned checkpoints
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(checkpoints)")}
+            if "updated_at" not in columns:
+                self._conn.execute("ALTER TABLE checkpoints ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        return self._conn
+
+    def load(self, dataset: str) -> dict[int, dict[str, Any]]:
+        """Successfully classified rows recorded for a dataset"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT row, result FROM checkpoints WHERE dataset = ? AND is_error = 0", (dataset,)
+            ).fetchall()
+        return {row: json.loads(result) for row, result in rows}
+
+    def save(self, dataset: str, results: dict[int, dict[str, Any]]) -> None:
+        """Record the latest result of each row"""
+        if not results:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints (dataset, row, result, is_error, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [
+                    (dataset, row, json.dumps(result, ensure_ascii=False), int(result.get("is_error", False)), now)
+                    for row, result in results.items()
+                ],
+            )
+            conn.commit()
+
+    def clear(self, dataset: str) -> None:
+        """Forget a dataset's checkpoint once its analysis has fully succeeded"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM checkpoints WHERE dataset = ?", (dataset,))
+            conn.commit()
+
+    def prune(self) -> int:
+        """Drop expired checkpoints and all but the most recently updated datasets; returns the rows removed"""
+        with self._lock:
+            conn = self._connection()
+            datasets = conn.execute(
+                "SELECT dataset, MAX(updated_at) AS updated FROM checkpoints GROUP BY dataset ORDER BY updated DESC"
+            ).fetchall()
+            cutoff = time.time() - self.ttl_seconds
+            stale = [
+                (dataset,) for rank, (dataset, updated) in enumerate(datasets)
+                if rank >= self.max_datasets or (self.ttl_seconds > 0 and updated < cutoff)
+            ]
+            removed = conn.executemany("DELETE FROM checkpoints WHERE dataset = ?", stale).rowcount
+            conn.commit()
+        return removed
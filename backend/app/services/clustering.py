@@ -0,0 +1,243 @@
+import os
+import re
+import unicodedata
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from .dedup import NO_COMMENT_ANSWERS
+
+# Minimum estimated Jaccard similarity of two comments' character trigrams to put them in one cluster
+CLUSTER_SIMILARITY = float(os.getenv('CLUSTER_SIMILARITY', '0.5'))
+# Commonality is 高 for clusters holding at least this share of the answered rows, 中 from the second share
+COMMONALITY_HIGH_SHARE = float(os.getenv('COMMONALITY_HIGH_SHARE', '0.02'))
+COMMONALITY_MEDIUM_SHARE = float(os.getenv('COMMONALITY_MEDIUM_SHARE', '0.005'))
+# ...and at least this many rows, so that small surveys do not rate every comment as common
+COMMONALITY_HIGH_MIN_ROWS = 5
+COMMONALITY_MEDIUM_MIN_ROWS = 2
+
+SHINGLE_SIZE = 3
+# MinHash signature length, split into LSH bands of BAND_ROWS values; pairs agreeing on a whole band
+# become candidates, which catches most pairs above a similarity of about (1 / bands) ** (1 / BAND_ROWS) = 0.5
+NUM_HASHES = 64
+BAND_ROWS = 4
+MINHASH_CHUNK = 1 << 16
+# Candidate pairs whose signatures are compared at once (bounds the temporary NUM_HASHES x pairs array)
+VERIFY_CHUNK = 100_000
+
+# Each answer is wrapped in these so short answers still have a trigram and answers never run together
+_START, _END = 0x02, 0x03
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+_rng = np.random.default_rng(0x5EED)
+# Odd multipliers make (a * x + b) mod 2**32 a permutation of the 32-bit shingle hashes
+_HASH_A = (_rng.integers(0, 2 ** 31, NUM_HASHES, dtype=np.uint64) * 2 + 1).astype(np.uint32)
+_HASH_B = _rng.integers(0, 2 ** 32, NUM_HASHES, dtype=np.uint64).astype(np.uint32)
+_BAND_WEIGHTS = _rng.integers(1, 2 ** 63, BAND_ROWS, dtype=np.uint64) | np.uint64(1)
+
+
+def normalize_answer(text: Any) -> str:
+    """Like dedup.normalize_text, but faster: NFKC runs only on the (few) answers not already normalized"""
+    if not isinstance(text, str):
+        text = '' if pd.isna(text) else str(text)
+    text = _NON_WORD.sub('', text)
+    if not unicodedata.is_normalized('NFKC', text):
+        text = unicodedata.normalize('NFKC', text)
+    text = text.lower()
+    return '' if text in NO_COMMENT_ANSWERS else text
+
+
+def answer_texts(data: pd.DataFrame, comment_columns: list[str]) -> list[str]:
+    """Each row's normalized answers joined; rows without any answer (or only "no comment") get ''"""
+    if not comment_columns:
+        return [''] * len(data)
+    columns = [[normalize_answer(value) for value in data[column].tolist()] for column in comment_columns]
+    separator = chr(_END) + chr(_START)
+    return [separator.join(answer for answer in answers if answer) for answers in zip(*columns)]
+
+
+def _shingle_hashes(texts: Sequence[str]):
+    """32-bit hashes of every character trigram of each text, and where each text's hashes start"""
+    padded = "".join(chr(_START) + text + chr(_END) for text in texts)
+    codes = np.frombuffer(padded.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    lengths = np.fromiter((len(text) + 2 for text in texts), dtype=np.int64, count=len(texts))
+    owner = np.repeat(np.arange(len(texts)), lengths)
+
+    windows = len(codes) - SHINGLE_SIZE + 1
+    hashes = np.zeros(windows, dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        hashes = hashes * np.uint64(0x100000001B3) + codes[offset:offset + windows]
+    # Keep windows inside one text; every padded text has at least one
+    inside = owner[:windows] == owner[SHINGLE_SIZE - 1:]
+    hashes, owner = hashes[inside], owner[:windows][inside]
+    # Fold to 32 bits with a multiplicative mix so nearby trigram codes spread out
+    hashes = ((hashes * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)).astype(np.uint32)
+    starts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+    return hashes, starts
+
+
+def minhash_signatures(texts: Sequence[str]) -> np.ndarray:
+    """(len(texts), NUM_HASHES) MinHash signatures of the texts' character trigram sets"""
+    signatures = np.empty((len(texts), NUM_HASHES), dtype=np.uint32)
+    if not texts:
+        return signatures
+    # Texts are processed in runs of about MINHASH_CHUNK characters, which bounds memory and keeps
+    # the hashes in the CPU cache across all the permutations
+    ends = np.cumsum([len(text) + 2 for text in texts])
+    cuts = np.searchsorted(ends, np.arange(MINHASH_CHUNK, ends[-1], MINHASH_CHUNK)) + 1
+    cuts = np.unique(np.r_[0, cuts, len(texts)])
+    for first, last in zip(cuts[:-1].tolist(), cuts[1:].tolist()):
+        hashes, starts = _shingle_hashes(texts[first:last])
+        permuted = np.empty_like(hashes)
+        for k in range(NUM_HASHES):
+            np.multiply(hashes, _HASH_A[k], out=permuted)
+            permuted += _HASH_B[k]
+            signatures[first:last, k] = np.minimum.reduceat(permuted, starts)
+    return signatures
+
+
+def _candidate_pairs(signatures: np.ndarray) -> np.ndarray:
+    """(pairs, 2) rows sharing an LSH bucket: each row paired with the first row of its bucket"""
+    count = len(signatures)
+    if count == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    positions = np.arange(count)
+    leader = np.empty(count, dtype=np.int64)
+    keys = []
+    for band in range(NUM_HASHES // BAND_ROWS):
+        values = signatures[:, band * BAND_ROWS:(band + 1) * BAND_ROWS].astype(np.uint64)
+        buckets = (values * _BAND_WEIGHTS).sum(axis=1)
+        # A stable sort puts each bucket's first row at the start of its run; spreading the start
+        # positions over the runs gives every row its bucket's leader (np.unique is far slower here)
+        order = np.argsort(buckets, kind="stable")
+        sorted_buckets = buckets[order]
+        run_start = np.ones(count, dtype=bool)
+        run_start[1:] = sorted_buckets[1:] != sorted_buckets[:-1]
+        leader[order] = order[np.maximum.accumulate(np.where(run_start, positions, 0))]
+        rows = np.flatnonzero(leader != positions)
+        keys.append(rows * count + leader[rows])
+    # A pair found by several bands is kept once (sorting beats np.unique on large integer arrays)
+    keys = np.sort(np.concatenate(keys))
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    keys = keys[first]
+    return np.column_stack([keys // count, keys % count])
+
+
+def _similar_pairs(signatures: np.ndarray, pairs: np.ndarray, threshold: float) -> np.ndarray:
+    keep = np.zeros(len(pairs), dtype=bool)
+    for start in range(0, len(pairs), VERIFY_CHUNK):
+        chunk = pairs[start:start + VERIFY_CHUNK]
+        agreement = (signatures[chunk[:, 0]] == signatures[chunk[:, 1]]).mean(axis=1)
+        keep[start:start + VERIFY_CHUNK] = agreement >= threshold
+    return pairs[keep]
+
+
+def _assign_centres(count: int, pairs: np.ndarray) -> np.ndarray:
+    """Centre of each item: items become centres in index order and take their unassigned neighbours
+
+    Unlike connected components, every member is similar to its centre itself, so long chains of
+    slightly different comments do not merge into one cluster. `pairs` hold (item, earlier neighbour).
+    """
+    centre = [-1] * count
+    order = np.argsort(pairs[:, 1], kind="stable")
+    members, leaders = pairs[order, 0], pairs[order, 1]
+    bounds = np.searchsorted(leaders, np.arange(count + 1)).tolist()
+    members = members.tolist()
+    for item in range(count):
+        if centre[item] >= 0:
+            continue
+        centre[item] = item
+        for member in members[bounds[item]:bounds[item + 1]]:
+            if centre[member] < 0:
+                centre[member] = item
+    return np.array(centre, dtype=np.int64)
+
+
+def commonality_levels(sizes: np.ndarray, answered_rows: int) -> np.ndarray:
+    """高/中/低 of clusters by their number of rows"""
+    high = max(COMMONALITY_HIGH_MIN_ROWS, COMMONALITY_HIGH_SHARE * answered_rows)
+    medium = max(COMMONALITY_MEDIUM_MIN_ROWS, COMMONALITY_MEDIUM_SHARE * answered_rows)
+    return np.select([sizes >= high, sizes >= medium], ['高', '中'], default='低').astype(object)
+
+
+class CommentClusters:
+    """Near-duplicate clusters of a dataset's comments, numbered by size (0 is the largest)
+
+    Rows without any answer belong to no cluster (id -1).
+    """
+
+    def __init__(self, labels: np.ndarray, representatives: np.ndarray):
+        self.labels = labels
+        self.sizes = np.bincount(labels[labels >= 0], minlength=len(representatives))
+        self.representatives = representatives
+        self.answered_rows = int((labels >= 0).sum())
+        self.levels = commonality_levels(self.sizes, self.answered_rows)
+        # Row positions of each cluster's members, contiguous and in row order
+        self._order = np.argsort(labels, kind="stable")
+        self._starts = np.searchsorted(labels[self._order], np.arange(len(representatives) + 1))
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def commonality(self) -> np.ndarray:
+        """Commonality label of every row (低 for rows without an answer)"""
+        levels = np.append(self.levels, '低').astype(object)
+        return levels[self.labels]
+
+    def members(self, cluster_id: int) -> np.ndarray:
+        return self._order[self._starts[cluster_id]:self._starts[cluster_id + 1]]
+
+    def summary(self, cluster_id: int) -> dict[str, Any]:
+        size = int(self.sizes[cluster_id])
+        return {
+            "cluster_id": cluster_id,
+            "size": size,
+            "share": round(size / self.answered_rows, 4) if self.answered_rows else 0.0,
+            "commonality": self.levels[cluster_id],
+            "representative_row": int(self.representatives[cluster_id]),
+        }
+
+
+def cluster_comments(texts: Sequence[str], threshold: float | None = None) -> CommentClusters:
+    """Group rows whose normalized answers (see `answer_texts`) are near-duplicates
+
+    The most repeated answers become cluster centres (and representatives) first.
+    """
+    threshold = CLUSTER_SIMILARITY if threshold is None else threshold
+    codes, distinct = pd.factorize(pd.Series(list(texts), dtype=object))
+    codes = np.asarray(codes, dtype=np.int64)
+    text_rows = np.bincount(codes, minlength=len(distinct))
+    first_row = np.full(len(distinct), len(codes), dtype=np.int64)
+    np.minimum.at(first_row, codes, np.arange(len(codes)))
+    # Distinct non-empty texts by number of rows, then by first appearance
+    answered = np.array([bool(text) for text in distinct], dtype=bool)
+    order = np.flatnonzero(answered)
+    order = order[np.lexsort((first_row[order], -text_rows[order]))]
+    text_index = np.full(len(distinct), -1, dtype=np.int64)
+    text_index[order] = np.arange(len(order))
+
+    # LSH pairs each text with the first text of its bucket, which is the earlier (more repeated) one
+    signatures = minhash_signatures([distinct[i] for i in order])
+    pairs = _similar_pairs(signatures, _candidate_pairs(signatures), threshold)
+    centres = _assign_centres(len(order), pairs)
+
+    # Number clusters by their row count, largest first; centres are their own centre
+    centre_ids = np.flatnonzero(centres == np.arange(len(centres)))
+    cluster_of_centre = np.empty(len(centres), dtype=np.int64)
+    cluster_of_centre[centre_ids] = np.arange(len(centre_ids))
+    text_cluster = cluster_of_centre[centres]
+    sizes = np.bincount(text_cluster, weights=text_rows[order], minlength=len(centre_ids)).astype(np.int64)
+    by_size = np.argsort(-sizes, kind="stable")
+    rank = np.empty_like(by_size)
+    rank[by_size] = np.arange(len(by_size))
+
+    row_texts = text_index[codes]
+    labels = np.full(len(codes), -1, dtype=np.int64)
+    labels[row_texts >= 0] = rank[text_cluster[row_texts[row_texts >= 0]]]
+    representatives = np.empty(len(centre_ids), dtype=np.int64)
+    representatives[rank] = first_row[order[centre_ids]]
+    return CommentClusters(labels, representatives)
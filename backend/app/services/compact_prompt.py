@@ -0,0 +1,99 @@
+import json
+import re
+from collections import Counter
+from typing import Literal
+
+from pydantic import BaseModel
+
+from .dedup import normalize_text
+
+# Single-letter codes the compact format uses for each label, and the label they stand for
+LABEL_CODES = {
+    'sentiment': {'P': 'ポジティブ', 'U': '中立', 'N': 'ネガティブ'},
+    'category': {'C': '講義内容', 'M': '講義資料', 'O': '運営', 'X': 'その他'},
+    'importance': {'H': '高', 'M': '中', 'L': '低'},
+}
+
+COMPACT_SYSTEM_PROMPT = """講義フィードバックのコメントを分類する。コードで答える。
+s 感情: P=ポジティブ U=中立 N=ネガティブ
+c カテゴリ: C=講義内容 M=講義資料 O=運営 X=その他
+i 重要度: H=高 M=中 L=低"""
+
+# Shown for rows whose answers are all empty or "特になし"
+NO_ANSWER = "(回答なし)"
+
+_REQUIRED_MARKER = re.compile(r"[（(]\s*(必須|任意)\s*[)）]")
+
+
+class CompactEvalOutput(BaseModel):
+    s: Literal['P', 'U', 'N']
+    c: Literal['C', 'M', 'O', 'X']
+    i: Literal['H', 'M', 'L']
+
+
+class CompactBatchItem(CompactEvalOutput):
+    id: int
+
+
+class CompactBatchOutput(BaseModel):
+    r: list[CompactBatchItem]
+
+
+def expand_labels(output: CompactEvalOutput) -> dict[str, str]:
+    """Label values (as in EvalOutput) of a compact output"""
+    return {
+        'sentiment': LABEL_CODES['sentiment'][output.s],
+        'category': LABEL_CODES['category'][output.c],
+        'importance': LABEL_CODES['importance'][output.i],
+    }
+
+
+def short_header(column: str) -> str:
+    """Question header without its 必須/任意 marker"""
+    return _REQUIRED_MARKER.sub("", str(column)).strip()
+
+
+def answer_fields(comment: str) -> dict[str, str]:
+    """Question -> answer of a row's combined comment JSON, without empty or "特になし" answers"""
+    try:
+        fields = json.loads(comment)
+    except (TypeError, ValueError):
+        fields = None
+    if not isinstance(fields, dict):
+        return {"": str(comment)} if normalize_text(comment) else {}
+    headers = {column: short_header(column) for column in fields}
+    # Questions that differ only by their marker keep the full header so neither answer is lost
+    uses = Counter(headers.values())
+    return {
+        headers[column] if uses[headers[column]] == 1 else str(column): " ".join(str(value).split())
+        for column, value in fields.items()
+        if normalize_text(value)
+    }
+
+
+def compact_batch_prompt(comments: dict[int, str]) -> str:
+    """Batch request with each question header sent once as an alias (Q1, Q2, ...)"""
+    rows = {row_id: answer_fields(comment) for row_id, comment in comments.items()}
+    aliases: dict[str, str] = {}
+    for fields in rows.values():
+        for header in fields:
+            if header and header not in aliases:
+                aliases[header] = f"Q{len(aliases) + 1}"
+
+    lines = []
+    if aliases:
+        lines.append(" ".join(f"{alias}={header}" for header, alias in aliases.items()))
+    lines.append("全行をidごとに分類:")
+    for row_id, fields in rows.items():
+        answers = " | ".join(
+            f"{aliases[header]}:{answer}" if header else answer for header, answer in fields.items()
+        )
+        lines.append(f"[id: {row_id}] {answers or NO_ANSWER}")
+    return "\n".join(lines)
+
+
+def compact_prompt(comment: str) -> str:
+    """Single-comment request"""
+    fields = answer_fields(comment)
+    answers = "\n".join(f"{header}: {answer}" if header else answer for header, answer in fields.items())
+    return answers or NO_ANSWER
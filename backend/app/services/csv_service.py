@@ -1,21 +1,93 @@
 import pandas as pd
-import io
-import random
+import numpy as np
 import os
 import asyncio
 import json
-from typing import List, Dict, Any, Optional
+import hashlib
+import functools
+import threading
+import uuid
+import time
+import datetime as dt
+import logging
+from urllib.parse import quote
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator
 from enum import Enum
 from fastapi import UploadFile, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent
 from pydantic_ai.models.bedrock import BedrockConverseModel, BedrockModelSettings
-import dotenv
+from pydantic_ai.providers.bedrock import BedrockProvider
+from botocore.client import BaseClient
+from .agent_pool import AgentPool
+from .analysis_cache import AnalysisCache
+from .dedup import group_duplicate_comments
+from .clustering import CommentClusters, answer_texts, cluster_comments
+from .rate_limiter import RequestScheduler, run_bounded
+from .jobs import format_sse, job_manager
+from .shared_state import shared_state
+from .offload import offloader
+from .checkpoint import AnalysisCheckpoint
+from .ingest import check_upload_size, is_comment_column
+from .aggregates import CUBE_COLUMNS, LabelCube
+from .ranking import RankingIndex, decode_cursor, encode_cursor
+from .export import EXPORT_FORMATS, iter_export, select_export_columns
+from .alerts import ALERT_MIN_ROWS, AlertMonitor, AlertRuleStore
+from .llm_backends import LLM_BACKEND, fake_llm
+from .compact_prompt import (
+    COMPACT_SYSTEM_PROMPT,
+    CompactBatchItem,
+    CompactBatchOutput,
+    CompactEvalOutput,
+    compact_batch_prompt,
+    compact_prompt,
+    expand_labels,
+)
+from .telemetry import ANALYSIS_ROWS, ERRORS, record_llm_usage, registry, traced
+from .cascade import CASCADE_AUDIT_RATE, CASCADE_CONFIDENCE, CASCADE_ENABLED, CASCADE_MODEL_PATH, Cascade
+from .report import (
+    REPORT_CHUNK_TOKENS,
+    REPORT_PROMPT_VERSION,
+    SECTION_MARKERS,
+    SectionStream,
+    top_report_prompt,
+    REPORT_MAP_CONCURRENCY,
+    REPORT_MAP_MODEL_ID,
+    REPORT_REDUCE_MODEL_ID,
+    REPORT_REDUCE_TOKENS,
+    chunk_comments,
+    map_prompt,
+    merge_prompt,
+    pack_summaries,
+    parse_report_sections,
+    reduce_prompt,
+)
 
+logger = logging.getLogger(__name__)
 
-# Load environment variables
-dotenv.load_dotenv()
+# Number of comments packed into a single classification request (1 = one request per comment)
+ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', '20'))
+# Maximum number of concurrent LLM requests, also used to size the Bedrock connection pool
+ANALYSIS_CONCURRENCY = int(os.getenv('ANALYSIS_CONCURRENCY', '64'))
+# Bedrock quotas enforced client-side (0 disables the corresponding limit)
+LLM_REQUESTS_PER_SECOND = float(os.getenv('LLM_REQUESTS_PER_SECOND', '10'))
+LLM_TOKENS_PER_MINUTE = float(os.getenv('LLM_TOKENS_PER_MINUTE', '400000'))
+# On-disk cache of classifications so re-analysing the same comments is free
+ANALYSIS_CACHE_PATH = os.getenv('ANALYSIS_CACHE_PATH', 'data/analysis_cache.sqlite3')
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '200000'))
+# Per-row results of in-progress runs, used to resume them and to retry only failed rows
+ANALYSIS_CHECKPOINT_PATH = os.getenv('ANALYSIS_CHECKPOINT_PATH', 'data/analysis_checkpoints.sqlite3')
+ANALYSIS_CHECKPOINT_TTL_SECONDS = float(os.getenv('ANALYSIS_CHECKPOINT_TTL_SECONDS', '604800'))
+ANALYSIS_CHECKPOINT_MAX_DATASETS = int(os.getenv('ANALYSIS_CHECKPOINT_MAX_DATASETS', '20'))
+# Rows completed since the last checkpoint write are saved together at most this often (0 saves every batch)
+ANALYSIS_CHECKPOINT_INTERVAL_SECONDS = float(os.getenv('ANALYSIS_CHECKPOINT_INTERVAL_SECONDS', '1'))
+
+# Classification request format: "full" (original prompt and schema) or "compact" (question aliases, letter
+# codes); switch to compact once benchmarks/prompt_ab.py shows acceptable per-label agreement on your data
+ANALYSIS_PROMPT_FORMAT = os.getenv('ANALYSIS_PROMPT_FORMAT', 'full')
+
+ANALYSIS_MODEL_ID = "amazon.nova-lite-v1:0"
 
 
 class SentimentEnum(str, Enum):
@@ -47,7 +119,90 @@ class EvalOutput(BaseModel):
     sentiment: SentimentEnum = Field(description="コメントに対する感情の分類")
     category: CategoryEnum = Field(description="コメントに対するカテゴリの分類")
     importance: ImportanceEnum = Field(description="コメントに対する重要度の分類")
-    commonality: CommonalityEnum = Field(description="コメントに対する共通性の分類")
+
+
+# DataFrame label columns and the EvalOutput field each one holds
+LABEL_FIELDS = {
+    '感情': 'sentiment',
+    'カテゴリ': 'category',
+    '重要性': 'importance',
+    '共通性': 'commonality',
+}
+LABEL_COLUMNS = list(LABEL_FIELDS)
+# Fields the classifier assigns; commonality is derived from the size of each comment's cluster
+CLASSIFIED_FIELDS = ['sentiment', 'category', 'importance']
+LABEL_CATEGORIES = {
+    '感情': [e.value for e in SentimentEnum],
+    'カテゴリ': [e.value for e in CategoryEnum],
+    '重要性': [e.value for e in ImportanceEnum],
+    '共通性': [e.value for e in CommonalityEnum],
+}
+
+# Numeric weights of importance/commonality labels used to rank comments
+LEVEL_SCORES = {'高': 3, '中': 2, '低': 1}
+
+
+def combine_comments(data: pd.DataFrame, comment_columns: List[str]) -> pd.Series:
+    """Serialize the non-empty comment columns of every row into one JSON string"""
+    rows = data[comment_columns].to_numpy(dtype=object)
+    texts = [
+        json.dumps(
+            {column: value for column, value in zip(comment_columns, row) if not pd.isna(value)},
+            ensure_ascii=False,
+            default=str,
+        )
+        for row in rows
+    ]
+    return pd.Series(texts, index=data.index, dtype=object)
+
+
+def level_scores(labels: pd.Series) -> np.ndarray:
+    """Map a categorical 高/中/低 column to its scores through the category codes (missing -> 0)"""
+    scores_by_code = np.array([LEVEL_SCORES[c] for c in labels.cat.categories] + [0], dtype=np.int8)
+    return scores_by_code[labels.cat.codes.to_numpy()]
+
+
+class BatchEvalItem(EvalOutput):
+    row_id: int = Field(description="分類したコメントのID")
+
+
+class BatchEvalOutput(BaseModel):
+    results: List[BatchEvalItem] = Field(description="入力された全コメントの分類結果")
+
+
+SYSTEM_PROMPT = """
+        あなたは講義に関するフィードバックを分析するAIアシスタントです。
+        以下のルールに従って、コメントを分類してください。
+        1. コメントの感情を分類してください。
+        2. コメントのカテゴリを分類してください。
+        3. コメントの重要度を分類してください。
+        
+        各分類は以下の選択肢から選んでください。
+        
+        感情: ポジティブ, 中立, ネガティブ
+        カテゴリ: 講義内容, 講義資料, 運営, その他
+        重要度: 高, 中, 低
+        """
+
+# System prompt and output types of each classification request format
+PROMPT_FORMATS = {
+    'full': {'system_prompt': SYSTEM_PROMPT, 'output': EvalOutput, 'batch_output': BatchEvalOutput},
+    'compact': {
+        'system_prompt': COMPACT_SYSTEM_PROMPT, 'output': CompactEvalOutput, 'batch_output': CompactBatchOutput
+    },
+}
+if ANALYSIS_PROMPT_FORMAT not in PROMPT_FORMATS:
+    raise ValueError(f"Unknown ANALYSIS_PROMPT_FORMAT: {ANALYSIS_PROMPT_FORMAT} (expected 'compact' or 'full')")
+
+
+def prompt_version(prompt_format: str) -> str:
+    """Changes whenever a format's prompt or output schema changes, invalidating cached classifications"""
+    prompt = PROMPT_FORMATS[prompt_format]
+    schema = json.dumps(prompt['output'].model_json_schema(), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256((prompt['system_prompt'] + schema).encode('utf-8')).hexdigest()[:12]
+
+
+PROMPT_VERSION = prompt_version(ANALYSIS_PROMPT_FORMAT)
 
 
 def generate_agent(
@@ -57,9 +212,14 @@ def generate_agent(
     temperature: float = 0.2,
     max_tokens: int = 20000,
     timeout: int = 60,
+    bedrock_client: Optional[BaseClient] = None,
+    system_prompt: str = SYSTEM_PROMPT,
 ) -> Agent:
     """Generate a Bedrock agent with specified settings"""
-    model = BedrockConverseModel(model_name=model_id)
+    if bedrock_client is not None:
+        model = BedrockConverseModel(model_name=model_id, provider=BedrockProvider(bedrock_client=bedrock_client))
+    else:
+        model = BedrockConverseModel(model_name=model_id)
 
     model_settings = BedrockModelSettings(
         temperature=temperature,
@@ -72,26 +232,101 @@ def generate_agent(
         retries=retries,
         output_type=output_type or str,
         model_settings=model_settings,
-        system_prompt="""
-        あなたは講義に関するフィードバックを分析するAIアシスタントです。
-        以下のルールに従って、コメントを分類してください。
-        1. コメントの感情を分類してください。
-        2. コメントのカテゴリを分類してください。
-        3. コメントの重要度を分類してください。
-        4. コメントの共通性を分類してください。
-        
-        各分類は以下の選択肢から選んでください。
-        
-        感情: ポジティブ, 中立, ネガティブ
-        カテゴリ: 講義内容, 講義資料, 運営, その他
-        重要度: 高, 中, 低
-        共通性: 高, 中, 低
-        """
+        system_prompt=system_prompt,
     )
 
     return agent
 
 
+def select_agent_factory(backend: str) -> Callable[..., Agent]:
+    """Agent factory for the configured LLM backend"""
+    if backend == 'bedrock':
+        return generate_agent
+    if backend == 'fake':
+        return fake_llm.agent_factory(SYSTEM_PROMPT)
+    raise ValueError(f"Unknown LLM_BACKEND: {backend} (expected 'bedrock' or 'fake')")
+
+
+# Shared agents for the analysis and report pipelines
+agent_pool = AgentPool(
+    select_agent_factory(LLM_BACKEND),
+    max_connections=ANALYSIS_CONCURRENCY,
+    use_bedrock_client=LLM_BACKEND == 'bedrock',
+)
+
+analysis_cache = AnalysisCache(ANALYSIS_CACHE_PATH, max_entries=ANALYSIS_CACHE_MAX_ENTRIES)
+
+analysis_checkpoint = AnalysisCheckpoint(
+    ANALYSIS_CHECKPOINT_PATH,
+    ttl_seconds=ANALYSIS_CHECKPOINT_TTL_SECONDS,
+    max_datasets=ANALYSIS_CHECKPOINT_MAX_DATASETS,
+)
+
+# Shared rate limiter for every Bedrock request; concurrency starts low and adapts to throttling
+llm_scheduler = RequestScheduler(
+    requests_per_second=LLM_REQUESTS_PER_SECOND,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+    initial_concurrency=max(1, ANALYSIS_CONCURRENCY // 4),
+    max_concurrency=ANALYSIS_CONCURRENCY,
+)
+
+registry.callback("llm_in_flight_requests", "LLM requests in flight", lambda: llm_scheduler.concurrency.in_flight)
+registry.callback(
+    "llm_concurrency_limit", "Adaptive LLM concurrency limit", lambda: int(llm_scheduler.concurrency.limit)
+)
+registry.callback("llm_queued_requests", "LLM requests waiting for the rate limiter", lambda: llm_scheduler.waiting)
+registry.callback(
+    "llm_throttled_requests_total", "LLM requests rejected as throttled",
+    lambda: llm_scheduler.throttle_count, kind="counter",
+)
+registry.callback(
+    "llm_retries_total", "LLM requests retried after throttling", lambda: llm_scheduler.retry_count, kind="counter"
+)
+
+# Local classifier that labels confident rows before they reach the LLM
+cascade = Cascade(CASCADE_MODEL_PATH, CASCADE_CONFIDENCE, CASCADE_AUDIT_RATE, enabled=CASCADE_ENABLED)
+
+# Alert rules evaluated against every dataset
+alert_rules = AlertRuleStore(LABEL_CATEGORIES, shared=shared_state)
+
+
+def estimate_tokens(prompt: str, system_prompt: str = SYSTEM_PROMPT) -> int:
+    """Rough input token estimate for rate limiting (about one token per Japanese character)"""
+    return len(system_prompt) + len(prompt)
+
+
+def batch_prompt(comments: Dict[int, str], prompt_format: str) -> str:
+    """User prompt classifying several comments, each tagged with its row id"""
+    if prompt_format == 'compact':
+        return compact_batch_prompt(comments)
+    prompt = "以下の各コメントを分類し、全てのコメントについて id を row_id として結果を返してください。\n"
+    prompt += "\n".join(f"[id: {row_id}] {comment}" for row_id, comment in comments.items())
+    return prompt
+
+
+def output_labels(output: BaseModel) -> Dict[str, str]:
+    """Label values of a classification output in either format"""
+    if isinstance(output, CompactEvalOutput):
+        return expand_labels(output)
+    return {field: getattr(output, field).value for field in CLASSIFIED_FIELDS}
+
+
+def estimate_classification_tokens(comments: List[str], batch_size: int, prompt_format: str) -> int:
+    """Estimated input tokens (system prompt, output schema and comments) of classifying `comments`"""
+    prompt = PROMPT_FORMATS[prompt_format]
+    if batch_size > 1:
+        output_type = prompt['batch_output']
+        prompts = [
+            batch_prompt(dict(enumerate(comments[start:start + batch_size], start)), prompt_format)
+            for start in range(0, len(comments), batch_size)
+        ]
+    else:
+        output_type = prompt['output']
+        prompts = [compact_prompt(comment) if prompt_format == 'compact' else comment for comment in comments]
+    overhead = len(prompt['system_prompt']) + len(json.dumps(output_type.model_json_schema(), ensure_ascii=False))
+    return sum(overhead + len(text) for text in prompts)
+
+
 def calculate_cost(
     model_name: str,
     input_tokens: int,
@@ -133,64 +368,448 @@ def calculate_cost(
     return input_cost, output_cost, think_cost
 
 
-async def analyze_comment_with_llm(comment: str) -> Dict[str, Any]:
+def usage_cost(model_id: str, usage: Any) -> float:
+    """Cost of a request from its token usage, also counted in the LLM metrics"""
+    input_tokens = usage.request_tokens or 0
+    output_tokens = usage.response_tokens or 0
+    think_tokens = (usage.total_tokens or 0) - input_tokens - output_tokens
+
+    input_cost, output_cost, think_cost = calculate_cost(
+        model_name=model_id,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        think_tokens=think_tokens,
+    )
+    total_cost = input_cost + output_cost + think_cost
+    record_llm_usage(model_id, input_tokens, output_tokens + think_tokens, total_cost)
+    return total_cost
+
+
+async def analyze_comment_with_llm(comment: str, prompt_format: str = ANALYSIS_PROMPT_FORMAT) -> Dict[str, Any]:
     """Analyze a single comment using Bedrock Nova-lite LLM"""
     try:
-        await asyncio.sleep(0.5)  # Rate limiting
-        
-        model_id = "amazon.nova-lite-v1:0"
-        agent = generate_agent(
+        model_id = ANALYSIS_MODEL_ID
+        system_prompt = PROMPT_FORMATS[prompt_format]['system_prompt']
+        agent = agent_pool.get(
             model_id=model_id,
-            output_type=EvalOutput,
+            output_type=PROMPT_FORMATS[prompt_format]['output'],
             retries=3,
             temperature=0.2,
             max_tokens=2000,
             timeout=60,
+            system_prompt=system_prompt,
         )
 
-        response = await agent.run([comment])
-        output = response.output
-
-        # Calculate cost
-        input_tokens = response.usage().request_tokens
-        output_tokens = response.usage().response_tokens
-        total_tokens = response.usage().total_tokens
-        think_tokens = total_tokens - input_tokens - output_tokens
-
-        input_cost, output_cost, think_cost = calculate_cost(
-            model_name=model_id,
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            think_tokens=think_tokens,
+        prompt = compact_prompt(comment) if prompt_format == 'compact' else comment
+        response = await llm_scheduler.run(
+            lambda: agent.run([prompt]), estimated_tokens=estimate_tokens(prompt, system_prompt), model=model_id
         )
-        total_cost = input_cost + output_cost + think_cost
+
+        total_cost = usage_cost(model_id, response.usage())
 
         return {
-            "sentiment": output.sentiment.value,
-            "category": output.category.value,
-            "importance": output.importance.value,
-            "commonality": output.commonality.value,
+            **output_labels(response.output),
             "total_cost": total_cost,
             "is_error": False,
         }
     except Exception as e:
-        print(f"Error analyzing comment: {e}")
+        logger.warning("Error analyzing comment: %s", e)
+        ERRORS.inc(component="llm_comment")
         return {
             "sentiment": None,
             "category": None,
             "importance": None,
-            "commonality": None,
             "total_cost": 0.0,
             "is_error": True,
         }
 
 
+async def analyze_comment_batch_with_llm(
+    comments: Dict[int, str], prompt_format: str = ANALYSIS_PROMPT_FORMAT
+) -> Dict[int, Dict[str, Any]]:
+    """Analyze several comments in a single Bedrock Nova-lite request
+
+    Returns results keyed by row id. Ids that are missing from the model output
+    (or all ids, if the request fails) are left out so the caller can retry them.
+    """
+    try:
+        model_id = ANALYSIS_MODEL_ID
+        system_prompt = PROMPT_FORMATS[prompt_format]['system_prompt']
+        agent = agent_pool.get(
+            model_id=model_id,
+            output_type=PROMPT_FORMATS[prompt_format]['batch_output'],
+            retries=3,
+            temperature=0.2,
+            max_tokens=5000,
+            timeout=120,
+            system_prompt=system_prompt,
+        )
+
+        prompt = batch_prompt(comments, prompt_format)
+
+        response = await llm_scheduler.run(
+            lambda: agent.run([prompt]), estimated_tokens=estimate_tokens(prompt, system_prompt), model=model_id
+        )
+        output = response.output
+
+        total_cost = usage_cost(model_id, response.usage())
+
+        results = {}
+        items = output.r if isinstance(output, CompactBatchOutput) else output.results
+        for item in items:
+            row_id = item.id if isinstance(item, CompactBatchItem) else item.row_id
+            if row_id in comments and row_id not in results:
+                results[row_id] = {**output_labels(item), "is_error": False}
+
+        # Spread the request cost over the rows it classified
+        for result in results.values():
+            result["total_cost"] = total_cost / len(results)
+    except Exception as e:  # noqa: BLE001
+        # Whatever went wrong, the caller retries the rows
+        logger.warning("Error analyzing comment batch of %d: %s", len(comments), e)
+        ERRORS.inc(component="llm_batch")
+        return {}
+    else:
+        return results
+
+
+async def analyze_comments_in_batch(
+    comments: Dict[int, str], prompt_format: str = ANALYSIS_PROMPT_FORMAT
+) -> Dict[int, Dict[str, Any]]:
+    """Analyze a batch of comments, re-splitting it until every row id has a result"""
+    if len(comments) == 1:
+        row_id, comment = next(iter(comments.items()))
+        return {row_id: await analyze_comment_with_llm(comment, prompt_format)}
+
+    results = await analyze_comment_batch_with_llm(comments, prompt_format)
+
+    missing = {row_id: comment for row_id, comment in comments.items() if row_id not in results}
+    if missing:
+        # Retry failed or partially answered batches as two smaller halves
+        missing_ids = list(missing)
+        middle = (len(missing_ids) + 1) // 2
+        halves = [missing_ids[:middle], missing_ids[middle:]]
+        retried = await asyncio.gather(*[
+            analyze_comments_in_batch({row_id: missing[row_id] for row_id in half}, prompt_format)
+            for half in halves if half
+        ])
+        for partial in retried:
+            results.update(partial)
+
+    return results
+
+
+def get_cascade_stats() -> Dict[str, Any]:
+    """State, live audit agreement and training metrics of the cascade classifier"""
+    return cascade.stats()
+
+
+def retrain_cascade(limit: Optional[int] = None) -> Dict[str, Any]:
+    """Retrain the cascade classifier on the LLM labels accumulated in the analysis cache
+
+    Raises ValueError when there are too few labeled comments to train on.
+    """
+    labels = {field: LABEL_CATEGORIES[column] for column, field in LABEL_FIELDS.items() if field in CLASSIFIED_FIELDS}
+    metrics = cascade.retrain(analysis_cache.examples(limit=limit), labels)
+    return {"message": "Cascade classifier retrained", "metrics": metrics}
+
+
+def clear_analysis_cache() -> Dict[str, Any]:
+    """Invalidate all cached classifications"""
+    removed = analysis_cache.clear()
+    return {
+        "message": "Analysis cache cleared",
+        "removed_entries": removed,
+        "prompt_version": PROMPT_VERSION
+    }
+
+
+def group_target_rows(comments: List[str], target_rows: List[int]) -> List[List[int]]:
+    """Groups of the target rows whose comments are identical after normalization, first row first"""
+    return [
+        [target_rows[j] for j in members]
+        for members in group_duplicate_comments([comments[i] for i in target_rows])
+    ]
+
+
+def cached_classifications(comments: Dict[int, str]) -> tuple:
+    """Cache key of each row's comment, and the cached labels found for those keys"""
+    cache_keys = {
+        i: AnalysisCache.make_key(comment, ANALYSIS_MODEL_ID, PROMPT_VERSION) for i, comment in comments.items()
+    }
+    return cache_keys, analysis_cache.get_many(cache_keys.values())
+
+
+FALLBACK_LABELS = {"sentiment": "中立", "category": "その他", "importance": "中"}
+
+
+def with_fallback_labels(results: List[Any]) -> List[Dict[str, Any]]:
+    """Final per-row results: rows that failed (an exception or is_error) get FALLBACK_LABELS and is_error"""
+    processed = []
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            logger.error("Error processing comment %d: %s", i, result, exc_info=result)
+            ERRORS.inc(component="analysis_row")
+        if not isinstance(result, dict) or result.get("is_error", False):
+            result = {**FALLBACK_LABELS, "total_cost": 0.0, "is_error": True}
+        processed.append(result)
+    return processed
+
+
+class AnalysisRun:
+    """Per-row results of one analyze_comments run
+
+    Each group of duplicate rows is classified once, through its first row (the representative);
+    `complete` fans the representative's result out to the group, checkpoints it and reports progress.
+    Checkpoint rows are written in the offload pool, batched over ANALYSIS_CHECKPOINT_INTERVAL_SECONDS;
+    `save_checkpoint` writes the remainder.
+    """
+
+    def __init__(
+        self,
+        service: 'CSVService',
+        comments: List[str],
+        dataset_key: str,
+        on_progress: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ):
+        self.service = service
+        self.comments = comments
+        self.dataset_key = dataset_key
+        self.on_progress = on_progress
+        self.results: List[Any] = [None] * len(comments)
+        # Members (row positions) of each duplicate group by its representative
+        self.members_of: Dict[int, List[int]] = {}
+        self.commonality = service.clusters.commonality()
+        # Completed rows not yet written to the checkpoint, and the write in progress
+        self._unsaved: Dict[int, Dict[str, Any]] = {}
+        self._saving: Optional[asyncio.Task] = None
+        self._last_saved = time.monotonic()
+
+    def rows_of(self, representatives) -> int:
+        """Number of rows in the groups of these representatives"""
+        return sum(len(self.members_of[i]) for i in representatives)
+
+    def complete(self, representative_results: Dict[int, Any]) -> None:
+        # Fan each representative's labels back out to the other members of its group
+        finished = []
+        for i, result in representative_results.items():
+            for member in self.members_of[i]:
+                if member != i and isinstance(result, dict):
+                    self.results[member] = {**result, "total_cost": 0.0}
+                else:
+                    self.results[member] = result
+                finished.append(member)
+
+        self._unsaved.update({
+            i: self.results[i] if isinstance(self.results[i], dict) else {"is_error": True} for i in finished
+        })
+        if self._saving is None and time.monotonic() - self._last_saved >= ANALYSIS_CHECKPOINT_INTERVAL_SECONDS:
+            self._saving = asyncio.create_task(self._write_checkpoint())
+
+        if self.on_progress is not None:
+            rows = []
+            for i in finished:
+                result = self.results[i] if isinstance(self.results[i], dict) else {"is_error": True}
+                rows.append({
+                    "row": i,
+                    "id": str(self.service.csv_data.index[i]),
+                    "comment": self.comments[i],
+                    "sentiment": result.get("sentiment"),
+                    "category": result.get("category"),
+                    "importance": result.get("importance"),
+                    "commonality": self.commonality[i],
+                    "cluster_id": int(self.service.clusters.labels[i]),
+                    "total_cost": result.get("total_cost", 0.0),
+                    "is_error": result.get("is_error", False),
+                })
+            self.on_progress(rows)
+
+    async def save_checkpoint(self) -> None:
+        """Write every completed row not checkpointed yet"""
+        if self._saving is not None:
+            await self._saving
+        await self._write_checkpoint()
+
+    async def _write_checkpoint(self) -> None:
+        rows, self._unsaved = self._unsaved, {}
+        self._last_saved = time.monotonic()
+        try:
+            await offloader.run(analysis_checkpoint.save, self.dataset_key, rows)
+        except Exception as e:  # noqa: BLE001
+            # Kept for the next write; newer results of the same rows win
+            self._unsaved = {**rows, **self._unsaved}
+            logger.warning("Error saving analysis checkpoint: %s", e)
+            ERRORS.inc(component="checkpoint")
+        finally:
+            self._saving = None
+
+
+def exclusive(method):
+    """Run a dataset-mutating coroutine while holding the dataset's lock, rejecting concurrent calls"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.lock.locked():
+            raise HTTPException(
+                status_code=409, detail="Dataset is busy (upload or analysis in progress). Please try again later."
+            )
+        async with self.lock:
+            if not shared_state.enabled:
+                return await method(self, *args, **kwargs)
+            # Other workers serving the same dataset must not mutate it at the same time
+            if not shared_state.acquire(self.dataset_id):
+                raise HTTPException(
+                    status_code=409, detail="Dataset is busy (upload or analysis in progress). Please try again later."
+                )
+            try:
+                await self.refresh()
+                before = (self.upload_id, self.version)
+                result = await method(self, *args, **kwargs)
+                if (self.upload_id, self.version) != before:
+                    await offloader.run(shared_state.save_dataset, self.dataset_id, self, lock=self.state_lock)
+                return result
+            finally:
+                shared_state.release(self.dataset_id)
+    return wrapper
+
+
 class CSVService:
     def __init__(self):
         self.csv_data: pd.DataFrame = pd.DataFrame()
         self.filename: str = ""
         self.analyzed: bool = False
+        self.analysis_job_id: Optional[str] = None
+        self.error_rows: List[int] = []
+        self.lock = asyncio.Lock()
+        # Held while the data or labels change and by reads running in the offload pool
+        self.state_lock = threading.Lock()
+        # Key of the dataset in the dataset store and the shared state
+        self.dataset_id: str = ""
+        # Derived once per upload/analysis so read endpoints work on compact vectors
+        self.comment_columns: List[str] = []
+        self.comment_texts: pd.Series = pd.Series(dtype=object)
+        self.clusters: Optional[CommentClusters] = None
+        self.scores: pd.Series = pd.Series(dtype=np.int8)
+        self.label_cube: Optional[LabelCube] = None
+        self.ranking: Optional[RankingIndex] = None
+        # Bumped on every change to the data or labels; used for ETags and cache keys
+        self.upload_id: str = ""
+        self.version: int = 0
+        self._statistics: Optional[Dict[str, Any]] = None
+        # Generated reports by (mode, version, report prompt version)
+        self._reports: Dict[tuple, Dict[str, Any]] = {}
+        # Row positions matching each label filter seen since the last change
+        self._filtered_rows: Dict[tuple, np.ndarray] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Locks cannot be pickled when a dataset is spilled to disk
+        state = self.__dict__.copy()
+        del state['lock']
+        del state['state_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.lock = asyncio.Lock()
+        self.state_lock = threading.Lock()
+
+    async def refresh(self) -> None:
+        """Pick up changes other workers saved to the shared state since this copy was loaded"""
+        if not shared_state.enabled:
+            return
+        current = (self.upload_id, self.version)
+        # A cheap version lookup first; the snapshot is only unpickled (off the loop) when it changed
+        if shared_state.dataset_version(self.dataset_id) in (None, current):
+            return
+        saved = await offloader.run(shared_state.load_dataset, self.dataset_id, unless=current)
+        # Skipped if this copy changed while the snapshot was loading
+        if saved is not None and (self.upload_id, self.version) == current:
+            with self.state_lock:
+                self.__dict__.update(
+                    {key: value for key, value in saved.__dict__.items() if key not in ('lock', 'state_lock')}
+                )
+
+    def set_data(self, data: pd.DataFrame, filename: str) -> None:
+        """Replace the dataset and precompute each row's combined comment JSON"""
+        self.csv_data = data
+        self.filename = filename
+        self.analyzed = False
+        self.analysis_job_id = None
+        self.error_rows = []
+        self.comment_columns = [col for col in data.columns if is_comment_column(col)]
+        self.comment_texts = combine_comments(data, self.comment_columns)
+        self.clusters = cluster_comments(answer_texts(data, self.comment_columns))
+        self.scores = pd.Series(dtype=np.int8)
+        self.label_cube = None
+        self.ranking = None
+        self.upload_id = uuid.uuid4().hex
+        self._bump_version()
+
+    def _bump_version(self) -> None:
+        self.version += 1
+        self._statistics = None
+        self._filtered_rows = {}
+        self._reports = {}
+
+    @property
+    def etag(self) -> str:
+        """Entity tag identifying the current state of the dataset"""
+        return f'"{self.upload_id}-{self.version}"'
+
+    def _label_codes(self) -> np.ndarray:
+        """(n_rows, 4) array of label category codes ordered like the aggregate cube"""
+        return np.column_stack([self.csv_data[column].cat.codes.to_numpy() for column in CUBE_COLUMNS])
+
+    def set_labels(self, results: List[Dict[str, Any]]) -> None:
+        """Store the label columns as categoricals (int8 codes) and precompute the ranking score
+
+        The aggregate cube is updated with only the rows whose labels changed.
+        """
+        old_codes = self._label_codes() if self.label_cube is not None else None
+
+        for column, field in LABEL_FIELDS.items():
+            values = self.clusters.commonality() if field == 'commonality' else [r[field] for r in results]
+            self.csv_data[column] = pd.Categorical(values, categories=LABEL_CATEGORIES[column])
+        self.scores = pd.Series(
+            level_scores(self.csv_data['重要性']) * level_scores(self.csv_data['共通性']),
+            index=self.csv_data.index,
+            dtype=np.int8,
+        )
+
+        self.ranking = RankingIndex(
+            scores=self.scores.to_numpy(),
+            category_codes=self.csv_data['カテゴリ'].cat.codes.to_numpy(),
+            sentiment_codes=self.csv_data['感情'].cat.codes.to_numpy(),
+            categories=LABEL_CATEGORIES['カテゴリ'],
+            sentiments=LABEL_CATEGORIES['感情'],
+        )
+
+        new_codes = self._label_codes()
+        if old_codes is not None and old_codes.shape == new_codes.shape:
+            changed = (old_codes != new_codes).any(axis=1)
+            self.label_cube.remove(old_codes[changed])
+            self.label_cube.add(new_codes[changed])
+        else:
+            self.label_cube = LabelCube.from_codes(LABEL_CATEGORIES, new_codes)
+        self._bump_version()
+
+    def _comment_entry(self, position: int) -> Dict[str, Any]:
+        """Labels, comment text and score of the row at a position"""
+        return {
+            "id": str(self.csv_data.index[position]),
+            "comment": self.comment_texts.iat[position],
+            "category": self.csv_data['カテゴリ'].iat[position],
+            "sentiment": self.csv_data['感情'].iat[position],
+            "importance": self.csv_data['重要性'].iat[position],
+            "commonality": self.csv_data['共通性'].iat[position],
+            "cluster_id": int(self.clusters.labels[position]),
+            "score": int(self.scores.iat[position])
+        }
+
+    def memory_usage(self) -> int:
+        """Approximate memory used by the dataset, in bytes"""
+        return int(self.csv_data.memory_usage(deep=True).sum() + self.comment_texts.memory_usage(deep=True))
     
+    @exclusive
     async def upload_csv(self, file: UploadFile) -> Dict[str, Any]:
         """Upload and parse Excel/CSV file"""
         if file.filename is None:
@@ -199,79 +818,107 @@ class CSVService:
         if not (file.filename.endswith('.csv') or file.filename.endswith('.xlsx')):
             raise HTTPException(status_code=400, detail="File must be a CSV or Excel file")
         
+        # Starlette spools uploads to a temporary file; parse it from there instead of reading it into memory
+        check_upload_size(file.file)
+
         try:
-            # Read the file content
-            content = await file.read()
-            
-            # Parse file using pandas
-            if file.filename.endswith('.xlsx'):
-                # Parse Excel file
-                self.csv_data = pd.read_excel(io.BytesIO(content))
-            else:
-                # Parse CSV file
-                csv_string = content.decode('utf-8')
-                self.csv_data = pd.read_csv(io.StringIO(csv_string))
-            
-            self.filename = file.filename
-            self.analyzed = False
-            
-            # Filter to show only comment columns
-            comment_columns = [col for col in self.csv_data.columns if "必須" in col or "任意" in col]
+            # Parsing and preprocessing run off the event loop so other requests are not stalled
+            data = await offloader.read_upload(file.file, file.filename)
+            await offloader.run(self.set_data, data, file.filename, lock=self.state_lock)
             
             return {
                 "filename": self.filename,
                 "total_rows": len(self.csv_data),
                 "columns": list(self.csv_data.columns),
-                "comment_columns": comment_columns,
+                "comment_columns": self.comment_columns,
                 "message": f"{'Excel' if file.filename.endswith('.xlsx') else 'CSV'} uploaded successfully"
             }
         
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
     
-    def get_paginated_data(self, page: int = 1, page_size: int = 10) -> Dict[str, Any]:
-        """Get paginated data showing only comment columns"""
+    def _rows_matching(self, filters: Dict[str, str]) -> Optional[np.ndarray]:
+        """Positions of rows whose labels equal every filter value (None when unfiltered)"""
+        if not filters:
+            return None
+
+        if not self.analyzed:
+            raise HTTPException(status_code=400, detail="File has not been analyzed yet. Please analyze first.")
+
+        key = tuple(sorted(filters.items()))
+        if key not in self._filtered_rows:
+            mask = np.ones(len(self.csv_data), dtype=bool)
+            for column, value in filters.items():
+                if value not in LABEL_CATEGORIES[column]:
+                    raise HTTPException(status_code=400, detail=f"Unknown {LABEL_FIELDS[column]} filter: {value}")
+                mask &= self.csv_data[column].cat.codes.to_numpy() == LABEL_CATEGORIES[column].index(value)
+            self._filtered_rows[key] = np.flatnonzero(mask)
+        return self._filtered_rows[key]
+
+    def get_paginated_data(
+        self,
+        page: int = 1,
+        page_size: int = 10,
+        cursor: Optional[str] = None,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """Get paginated data showing only comment columns (plus labels once analyzed)
+
+        Pages are addressed by page number or by the cursor returned with the previous
+        page. Only the rows of the page are projected and serialized.
+        """
         if self.csv_data.empty:
             raise HTTPException(status_code=404, detail="No data available. Please upload a file first.")
         
-        # Get comment columns
-        comment_columns = [col for col in self.csv_data.columns if "必須" in col or "任意" in col]
-        
         # Include analysis columns if analyzed - put them at the beginning
         display_columns = []
         if self.analyzed:
-            display_columns.extend(['感情', 'カテゴリ', '重要性', '共通性'])
-        display_columns.extend(comment_columns)
+            display_columns.extend(LABEL_COLUMNS)
+        display_columns.extend(self.comment_columns)
+        if columns:
+            display_columns = select_export_columns(self.csv_data, columns)
+
+        rows = self._rows_matching({column: value for column, value in (filters or {}).items() if value})
         
         # Calculate pagination
-        total_rows = len(self.csv_data)
+        total_rows = len(self.csv_data) if rows is None else len(rows)
         total_pages = (total_rows + page_size - 1) // page_size
         
-        if page < 1 or page > total_pages:
-            raise HTTPException(status_code=400, detail=f"Page must be between 1 and {total_pages}")
-        
-        # Get the data for the current page, only display columns
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        page_data = self.csv_data[display_columns].iloc[start_idx:end_idx]
+        if cursor:
+            start_idx = decode_cursor(cursor, self.version)
+            page = start_idx // page_size + 1
+        else:
+            if page < 1 or page > max(total_pages, 1):
+                raise HTTPException(status_code=400, detail=f"Page must be between 1 and {total_pages}")
+            start_idx = (page - 1) * page_size
+        end_idx = min(start_idx + page_size, total_rows)
         
-        # Convert to list of dictionaries for JSON serialization
-        data = page_data.to_dict('records')
+        # Slice the rows first, then project the columns of just this page
+        column_positions = [self.csv_data.columns.get_loc(column) for column in display_columns]
+        row_positions = np.arange(start_idx, end_idx) if rows is None else rows[start_idx:end_idx]
+        page_data = self.csv_data.iloc[row_positions, column_positions]
         
-        return {
+        metadata = {
             "filename": self.filename,
-            "data": data,
             "pagination": {
                 "current_page": page,
                 "page_size": page_size,
                 "total_rows": total_rows,
                 "total_pages": total_pages,
-                "has_next": page < total_pages,
-                "has_previous": page > 1
+                "has_next": end_idx < total_rows,
+                "has_previous": start_idx > 0,
+                "next_cursor": encode_cursor(self.version, end_idx) if end_idx < total_rows else None
             },
             "columns": display_columns,
-            "comment_columns": comment_columns
+            "comment_columns": self.comment_columns
         }
+        # pandas serializes the page directly to JSON, skipping the per-cell dict conversion
+        records = page_data.to_json(orient='records', force_ascii=False, date_format='iso')
+        body = json.dumps(metadata, ensure_ascii=False, default=str)[:-1] + ', "data": ' + records + '}'
+        return Response(content=body.encode('utf-8'), media_type="application/json")
     
     def get_csv_info(self) -> Dict[str, Any]:
         """Get basic information about the uploaded CSV"""
@@ -290,110 +937,140 @@ class CSVService:
             "analyzed": self.analyzed
         }
     
-    async def analyze_comments(self) -> Dict[str, Any]:
-        """Analyze comments using Bedrock Nova-lite LLM"""
+    @exclusive
+    @traced('analysis')
+    async def analyze_comments(
+        self,
+        batch_size: Optional[int] = None,
+        on_progress: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        retry_errors: bool = False,
+    ) -> Dict[str, Any]:
+        """Analyze comments using Bedrock Nova-lite LLM
+
+        `on_progress` is called with the rows classified so far each time a request completes.
+        With `retry_errors`, only the rows whose classification failed in the last run are re-analyzed.
+        """
         if self.csv_data.empty:
             raise HTTPException(status_code=404, detail="No CSV data available. Please upload a file first.")
         
-        if self.analyzed:
+        if retry_errors and not self.analyzed:
+            raise HTTPException(status_code=400, detail="File has not been analyzed yet. Please analyze first.")
+
+        if self.analyzed and not retry_errors:
             return {
                 "message": "File has already been analyzed",
                 "total_rows": len(self.csv_data),
                 "analyzed": True
             }
         
+        batch_size = batch_size or ANALYSIS_BATCH_SIZE
+
+        if not self.comment_columns:
+            raise HTTPException(
+                status_code=400, detail="No comment columns found. Expected columns with '必須' or '任意'"
+            )
+
         try:
-            # Find comment columns - Excel has 6 comment columns
-            comment_columns = [col for col in self.csv_data.columns if "必須" in col or "任意" in col]
-            
-            if not comment_columns:
-                raise HTTPException(status_code=400, detail="No comment columns found. Expected columns with '必須' or '任意'")
-            
-            # Combine all comment columns into JSON format for each row
-            comments = self.csv_data[comment_columns].apply(
-                lambda row: json.dumps(row.dropna().to_dict(), ensure_ascii=False), axis=1
-            ).tolist()
-            
-            # Create tasks for LLM analysis
-            tasks = [analyze_comment_with_llm(comment) for comment in comments]
-            
-            # Process with semaphore for rate limiting
-            semaphore = asyncio.Semaphore(500)  # Limit concurrent requests
-            
-            async def process_with_semaphore(task):
-                async with semaphore:
-                    return await task
-            
-            # Execute all tasks
-            results = await asyncio.gather(*[process_with_semaphore(task) for task in tasks], return_exceptions=True)
-            
-            # Process results
-            processed_results = []
-            error_count = 0
-            total_cost = 0.0
+            # Combined JSON of all comment columns for each row, computed at upload
+            comments = self.comment_texts.tolist()
+            # Hashing every comment takes a while on large datasets, so it runs off the event loop
+            dataset_key = await offloader.run(
+                AnalysisCheckpoint.fingerprint, comments, ANALYSIS_MODEL_ID, PROMPT_VERSION
+            )
+            # Checkpoints of runs that failed and were never retried would otherwise pile up
+            await offloader.run(analysis_checkpoint.prune)
+            run = AnalysisRun(self, comments, dataset_key, on_progress)
+
+            resumed_rows = self._resume(run, retry_errors)
+            target_rows = [i for i, result in enumerate(run.results) if result is None]
+
+            # Classify each group of identical (after normalization) comments only once; normalizing
+            # tens of thousands of comments takes seconds, so it runs off the event loop
+            duplicate_groups = await offloader.run(group_target_rows, comments, target_rows)
+            run.members_of = {members[0]: members for members in duplicate_groups}
+
+            cache_keys, cached_results, pending = await self._lookup_cache(run, list(run.members_of))
+
+            # Rows the local cascade classifier is confident about skip the LLM; featurizing the
+            # comments is a Python loop, so it runs off the event loop
+            local_labels, audited, pending = await offloader.run(cascade.split, pending)
+            run.complete({i: {**labels, "total_cost": 0.0, "is_error": False} for i, labels in local_labels.items()})
+
+            scheduler_stats = llm_scheduler.stats()
+            try:
+                prompt_tokens = await self._classify_with_llm(run, pending, batch_size)
+            finally:
+                # Everything classified so far stays resumable, also when the run is cancelled
+                await run.save_checkpoint()
+
+            # Remember successful classifications for future runs (and as cascade training data)
+            succeeded = [
+                i for i in pending if isinstance(run.results[i], dict) and not run.results[i].get("is_error", False)
+            ]
+            await offloader.run(
+                analysis_cache.put_many,
+                {cache_keys[i]: {field: run.results[i][field] for field in CLASSIFIED_FIELDS} for i in succeeded},
+                comments={cache_keys[i]: comments[i] for i in succeeded},
+            )
+            for i, prediction in audited.items():
+                if i in succeeded:
+                    cascade.record_audit(prediction, run.results[i])
             
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    print(f"Error processing comment {i}: {result}")
-                    processed_results.append({
-                        "sentiment": "中立",  # Default fallback
-                        "category": "その他",
-                        "importance": "中",
-                        "commonality": "中",
-                        "total_cost": 0.0,
-                        "is_error": True,
-                    })
-                    error_count += 1
-                else:
-                    if result.get("is_error", False):
-                        # Use fallback values for errors
-                        processed_results.append({
-                            "sentiment": "中立",
-                            "category": "その他", 
-                            "importance": "中",
-                            "commonality": "中",
-                            "total_cost": 0.0,
-                            "is_error": True,
-                        })
-                        error_count += 1
-                    else:
-                        processed_results.append(result)
-                        total_cost += result.get("total_cost", 0.0)
+            processed_results = with_fallback_labels(run.results)
+            error_count = sum(result['is_error'] for result in processed_results)
+            total_cost = sum(result.get("total_cost", 0.0) for result in processed_results)
             
             # Add analysis columns to DataFrame
-            self.csv_data['感情'] = [r['sentiment'] for r in processed_results]
-            self.csv_data['カテゴリ'] = [r['category'] for r in processed_results]
-            self.csv_data['重要性'] = [r['importance'] for r in processed_results]
-            self.csv_data['共通性'] = [r['commonality'] for r in processed_results]
+            await offloader.run(self.set_labels, processed_results, lock=self.state_lock)
             
             self.analyzed = True
+            self.error_rows = [i for i, r in enumerate(processed_results) if r['is_error']]
+            if not self.error_rows:
+                await offloader.run(analysis_checkpoint.clear, dataset_key)
             
-            # Check for dangerous comments (ネガティブ + 重要性高)
-            dangerous_comments = self.csv_data[
-                (self.csv_data['感情'] == 'ネガティブ') & 
-                (self.csv_data['重要性'] == '高')
-            ]
-            
-            dangerous_list = []
-            if not dangerous_comments.empty:
-                for _, row in dangerous_comments.iterrows():
-                    # Use index as ID and combine comment columns
-                    comment_id = row.name
-                    comment_dict = row[comment_columns].dropna().to_dict()
-                    comment_text = json.dumps(comment_dict, ensure_ascii=False)
-                    dangerous_list.append({
-                        "id": str(comment_id),
-                        "comment": comment_text
-                    })
-            
+            for source, rows in {
+                "checkpoint": resumed_rows,
+                "cache": run.rows_of(cached_results),
+                "cascade": run.rows_of(local_labels),
+                "llm": run.rows_of(succeeded),
+                "error": error_count,
+            }.items():
+                ANALYSIS_ROWS.inc(rows, source=source)
+
             return {
                 "message": "Analysis completed successfully",
                 "total_rows": len(self.csv_data),
                 "analyzed": True,
-                "new_columns": ['感情', 'カテゴリ', '重要性', '共通性'],
-                "dangerous_comments": dangerous_list,
+                "batch_size": batch_size,
+                "analyzed_rows": len(target_rows),
+                "resumed_rows": resumed_rows,
+                "deduplication": {
+                    "unique_comments": len(duplicate_groups),
+                    "duplicate_rows": len(target_rows) - len(duplicate_groups),
+                    "dedup_ratio": f"{1 - len(duplicate_groups) / len(target_rows):.2%}" if target_rows else "0%",
+                },
+                "cache": {
+                    "hits": len(cached_results),
+                    "misses": len(duplicate_groups) - len(cached_results),
+                    "prompt_version": PROMPT_VERSION,
+                },
+                "cascade": {
+                    "local_rows": run.rows_of(local_labels),
+                    "audited_rows": len(audited),
+                    "threshold": cascade.threshold,
+                    "audit_agreement": cascade.stats()["audit_agreement"],
+                },
+                "prompt": prompt_tokens,
+                "rate_limiter": {
+                    "concurrency_limit": llm_scheduler.stats()["concurrency_limit"],
+                    "throttled_requests": llm_scheduler.throttle_count - scheduler_stats["throttle_count"],
+                    "retried_requests": llm_scheduler.retry_count - scheduler_stats["retry_count"],
+                },
+                "new_columns": LABEL_COLUMNS,
+                "dangerous_comments": self._dangerous_comments(),
                 "error_rate": f"{error_count / len(self.csv_data):.2%}" if len(self.csv_data) > 0 else "0%",
-                "comment_columns": comment_columns,
+                "error_count": error_count,
+                "comment_columns": self.comment_columns,
                 "total_cost": round(total_cost, 4),
                 "cost_display": f"${total_cost:.4f}"
             }
@@ -401,36 +1078,172 @@ class CSVService:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error during analysis: {str(e)}")
     
-    def download_analyzed_csv(self) -> StreamingResponse:
-        """Download the analyzed CSV file"""
+    def _resume(self, run: 'AnalysisRun', retry_errors: bool) -> int:
+        """Fill in the results a run does not need to recompute; returns the rows resumed from a checkpoint"""
+        if retry_errors:
+            # Keep the labels of rows that succeeded and only re-run the failed ones
+            error_rows = set(self.error_rows)
+            for i in range(len(run.results)):
+                if i not in error_rows:
+                    run.results[i] = {
+                        "sentiment": self.csv_data['感情'].iat[i],
+                        "category": self.csv_data['カテゴリ'].iat[i],
+                        "importance": self.csv_data['重要性'].iat[i],
+                        "total_cost": 0.0,
+                        "is_error": False,
+                    }
+            return 0
+        # Resume from rows checkpointed by an earlier, interrupted run of the same dataset
+        for i, result in analysis_checkpoint.load(run.dataset_key).items():
+            if i < len(run.results):
+                run.results[i] = {**result, "total_cost": 0.0}
+        return sum(result is not None for result in run.results)
+
+    async def _lookup_cache(self, run: 'AnalysisRun', representatives: List[int]) -> tuple:
+        """Complete the groups classified in earlier runs; returns (cache keys, cached results, pending comments)"""
+        # Hashing every comment and the SQLite lookup run off the event loop
+        cache_keys, cached = await offloader.run(cached_classifications, {i: run.comments[i] for i in representatives})
+        cached_results = {}
+        pending = {}
+        for i in representatives:
+            if cache_keys[i] in cached:
+                cached_results[i] = {**cached[cache_keys[i]], "total_cost": 0.0, "is_error": False}
+            else:
+                pending[i] = run.comments[i]
+        run.complete(cached_results)
+        return cache_keys, cached_results, pending
+
+    async def _classify_with_llm(self, run: 'AnalysisRun', pending: Dict[int, str], batch_size: int) -> Dict[str, Any]:
+        """Send the pending comments to the LLM (in batches when batch_size > 1); returns the prompt token estimates"""
+        # Failures become the rows' results; with_fallback_labels logs them and labels the rows as errors
+        async def classify_batch(batch: Dict[int, str]) -> None:
+            try:
+                batch_results = await analyze_comments_in_batch(batch)
+            except Exception as e:  # noqa: BLE001
+                batch_results = dict.fromkeys(batch, e)
+            run.complete(batch_results)
+
+        async def classify_comment(i: int) -> None:
+            try:
+                result = await analyze_comment_with_llm(pending[i])
+            except Exception as e:  # noqa: BLE001
+                result = e
+            run.complete({i: result})
+
+        pending_ids = list(pending)
+        pending_comments = [pending[i] for i in pending_ids]
+        prompt_tokens = {
+            "format": ANALYSIS_PROMPT_FORMAT,
+            "estimated_input_tokens": estimate_classification_tokens(
+                pending_comments, batch_size, ANALYSIS_PROMPT_FORMAT
+            ),
+            "estimated_input_tokens_full": estimate_classification_tokens(pending_comments, batch_size, 'full'),
+        }
+        if batch_size > 1:
+            # Pack several comments into each request, keyed by their position in the DataFrame
+            batches = [
+                {i: pending[i] for i in pending_ids[start:start + batch_size]}
+                for start in range(0, len(pending_ids), batch_size)
+            ]
+            # Feed batches through a bounded work queue; the scheduler limits the actual requests
+            await run_bounded(batches, classify_batch, num_workers=ANALYSIS_CONCURRENCY)
+        else:
+            await run_bounded(pending_ids, classify_comment, num_workers=ANALYSIS_CONCURRENCY)
+        return prompt_tokens
+
+    def _dangerous_comments(self) -> List[Dict[str, str]]:
+        """Negative comments of high importance, with the row index as id"""
+        dangerous_mask = (self.csv_data['感情'] == 'ネガティブ') & (self.csv_data['重要性'] == '高')
+        return [
+            {"id": str(comment_id), "comment": comment_text}
+            for comment_id, comment_text in self.comment_texts[dangerous_mask].items()
+        ]
+
+    def start_analysis_job(
+        self, batch_size: Optional[int] = None, retry_errors: bool = False, job_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Start analyzing comments in the background and return the job's progress
+
+        `job_id` continues a job whose worker stopped, resuming from its checkpointed rows.
+        """
+        if self.csv_data.empty:
+            raise HTTPException(status_code=404, detail="No CSV data available. Please upload a file first.")
+
+        # Only one analysis per dataset at a time, also across workers
+        if job_id is None:
+            active_job_id = shared_state.active_job(self.dataset_id) if shared_state.enabled else self.analysis_job_id
+            running_job = job_manager.find(active_job_id) if active_job_id is not None else None
+            if running_job is not None and not running_job.finished:
+                return running_job.progress()
+
+        if self.lock.locked() or (shared_state.enabled and shared_state.held_elsewhere(self.dataset_id)):
+            raise HTTPException(
+                status_code=409, detail="Dataset is busy (upload or analysis in progress). Please try again later."
+            )
+
+        job = job_manager.create(
+            total_rows=len(self.error_rows) if retry_errors else len(self.csv_data),
+            dataset_id=self.dataset_id,
+            params={"batch_size": batch_size, "retry_errors": retry_errors},
+            job_id=job_id,
+        )
+
+        # Alerts are evaluated on the rows classified so far and streamed as soon as they fire
+        cube = LabelCube(LABEL_CATEGORIES)
+        if retry_errors:
+            kept = np.ones(len(self.csv_data), dtype=bool)
+            kept[self.error_rows] = False
+            cube.add(self._label_codes()[kept])
+        # Small datasets still get their percentage alerts once every row is classified
+        monitor = AlertMonitor(alert_rules, cube, min_rows=min(ALERT_MIN_ROWS, len(self.csv_data)))
+
+        def on_progress(rows: List[Dict[str, Any]]) -> None:
+            job.record_rows(rows)
+            for alert in monitor.add_rows(rows):
+                job.publish("alert", alert)
+
+        job.start(lambda: self.analyze_comments(
+            batch_size=batch_size, on_progress=on_progress, retry_errors=retry_errors
+        ))
+        self.analysis_job_id = job.id
+        return job.progress()
+
+    def download_analyzed_csv(
+        self,
+        export_format: str = 'csv',
+        columns: Optional[List[str]] = None,
+        compress: bool = False,
+        bom: bool = False,
+    ) -> StreamingResponse:
+        """Stream the analyzed data as CSV, Parquet or XLSX"""
         if self.csv_data.empty:
             raise HTTPException(status_code=404, detail="No CSV data available. Please upload a CSV file first.")
         
         if not self.analyzed:
             raise HTTPException(status_code=400, detail="CSV has not been analyzed yet. Please analyze the CSV first.")
         
-        try:
-            # Convert DataFrame to CSV string
-            csv_buffer = io.StringIO()
-            self.csv_data.to_csv(csv_buffer, index=False, encoding='utf-8')
-            csv_content = csv_buffer.getvalue()
-            
-            # Create a BytesIO object for the response
-            csv_bytes = io.BytesIO(csv_content.encode('utf-8'))
-            
-            # Generate filename with timestamp
-            import datetime
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"analyzed_{self.filename.replace('.csv', '')}_{timestamp}.csv"
-            
-            return StreamingResponse(
-                io.BytesIO(csv_content.encode('utf-8')),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error generating CSV download: {str(e)}")
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported export format: {export_format}")
+
+        selected = select_export_columns(self.csv_data, columns)
+        # Rows are converted chunk by chunk in the offload pool while the response is being sent
+        content = offloader.iterate(
+            iter_export(self.csv_data, selected, export_format=export_format, compress=compress, bom=bom),
+            lock=self.state_lock,
+        )
+
+        media_type, extension = EXPORT_FORMATS[export_format]
+        timestamp = dt.datetime.now().astimezone().strftime("%Y%m%d_%H%M%S")
+        filename = f"analyzed_{os.path.splitext(self.filename or 'data')[0]}_{timestamp}.{extension}"
+        if compress:
+            filename += ".gz"
+            media_type = "application/gzip"
+
+        return StreamingResponse(
+            content,
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+        )
     
     def get_analysis_statistics(self) -> Dict[str, Any]:
         """Get analysis statistics for visualization"""
@@ -440,22 +1253,34 @@ class CSVService:
         if not self.analyzed:
             raise HTTPException(status_code=400, detail="CSV has not been analyzed yet. Please analyze the CSV first.")
         
+        if self._statistics is not None:
+            return self._statistics
+
         try:
-            # Category statistics
-            category_counts = self.csv_data['カテゴリ'].value_counts().to_dict()
+            # All counts come from the precomputed category x sentiment x importance x commonality cube
             total_comments = len(self.csv_data)
+            categories = LABEL_CATEGORIES['カテゴリ']
+            sentiments = LABEL_CATEGORIES['感情']
+            category_sentiment_counts = self.label_cube.counts_by('カテゴリ', '感情')
+            category_totals = category_sentiment_counts.sum(axis=1)
+            sentiment_counts = dict(zip(sentiments, category_sentiment_counts.sum(axis=0).tolist()))
+
+            # Categories that occur, most frequent first
+            present_categories = [
+                i for i in np.argsort(-category_totals, kind='stable') if category_totals[i] > 0
+            ]
             
+            # Category statistics
             category_stats = []
-            for category, count in category_counts.items():
-                percentage = round((count / total_comments) * 100, 1)
+            for i in present_categories:
+                count = int(category_totals[i])
                 category_stats.append({
-                    "category": category,
-                    "count": int(count),
-                    "percentage": percentage
+                    "category": categories[i],
+                    "count": count,
+                    "percentage": round((count / total_comments) * 100, 1)
                 })
             
             # Sentiment statistics overall
-            sentiment_counts = self.csv_data['感情'].value_counts().to_dict()
             overall_sentiment = {
                 "positive": sentiment_counts.get('ポジティブ', 0),
                 "neutral": sentiment_counts.get('中立', 0),
@@ -467,36 +1292,57 @@ class CSVService:
             
             # Sentiment statistics by category
             category_sentiment_stats = []
-            for category in category_counts.keys():
-                category_data = self.csv_data[self.csv_data['カテゴリ'] == category]
-                category_sentiment_counts = category_data['感情'].value_counts().to_dict()
-                category_total = len(category_data)
+            for i in present_categories:
+                counts = dict(zip(sentiments, category_sentiment_counts[i].tolist()))
+                category_total = int(category_totals[i])
                 
-                positive_count = category_sentiment_counts.get('ポジティブ', 0)
-                neutral_count = category_sentiment_counts.get('中立', 0)
-                negative_count = category_sentiment_counts.get('ネガティブ', 0)
+                positive_count = counts['ポジティブ']
+                neutral_count = counts['中立']
+                negative_count = counts['ネガティブ']
                 
                 category_sentiment_stats.append({
-                    "category": category,
-                    "positive": int(positive_count),
-                    "neutral": int(neutral_count),
-                    "negative": int(negative_count),
+                    "category": categories[i],
+                    "positive": positive_count,
+                    "neutral": neutral_count,
+                    "negative": negative_count,
                     "positive_percentage": round((positive_count / category_total) * 100, 1) if category_total > 0 else 0,
                     "neutral_percentage": round((neutral_count / category_total) * 100, 1) if category_total > 0 else 0,
                     "negative_percentage": round((negative_count / category_total) * 100, 1) if category_total > 0 else 0,
                     "total": category_total
                 })
             
-            return {
+            self._statistics = {
                 "total_comments": total_comments,
                 "category_statistics": category_stats,
                 "overall_sentiment": overall_sentiment,
                 "category_sentiment_statistics": category_sentiment_stats
             }
-            
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error generating statistics: {str(e)}")
+        return self._statistics
     
+    def evaluate_alerts(self, max_row_ids: int = 100, include_all: bool = False) -> Dict[str, Any]:
+        """Evaluate all enabled alert rules against the dataset's labels"""
+        if self.csv_data.empty:
+            raise HTTPException(status_code=404, detail="No CSV data available. Please upload a CSV file first.")
+
+        if not self.analyzed:
+            raise HTTPException(status_code=400, detail="CSV has not been analyzed yet. Please analyze the CSV first.")
+
+        # Flat cube cell of every row, so fired rules can list their matching rows
+        codes = self._label_codes()
+        labeled = (codes >= 0).all(axis=1)
+        cells = np.full(len(codes), -1, dtype=np.int64)
+        cells[labeled] = np.ravel_multi_index(codes[labeled].T, self.label_cube.shape)
+
+        return alert_rules.evaluate(
+            self.label_cube,
+            cells=cells,
+            row_ids=self.csv_data.index,
+            max_row_ids=max_row_ids,
+            include_all=include_all,
+        )
+
     def get_top_comments(self, max_count: int = 5) -> Dict[str, Any]:
         """Get top comments based on commonality and importance score"""
         if self.csv_data.empty:
@@ -507,64 +1353,18 @@ class CSVService:
         
         try:
             # Find comment columns
-            comment_columns = [col for col in self.csv_data.columns if "必須" in col or "任意" in col]
-            
-            if not comment_columns:
+            if not self.comment_columns:
                 raise HTTPException(status_code=400, detail="No comment columns found. Expected columns with '必須' or '任意'")
             
-            # Convert importance and commonality to numeric scores
-            importance_map = {'高': 3, '中': 2, '低': 1}
-            commonality_map = {'高': 3, '中': 2, '低': 1}
-            
-            # Calculate score for each comment
-            df_with_score = self.csv_data.copy()
-            df_with_score['importance_score'] = df_with_score['重要性'].map(importance_map)
-            df_with_score['commonality_score'] = df_with_score['共通性'].map(commonality_map)
-            df_with_score['total_score'] = df_with_score['importance_score'] * df_with_score['commonality_score']
-            
-            # Get overall top comments
-            overall_top = df_with_score.nlargest(max_count, 'total_score')
-            overall_comments = []
-            for _, row in overall_top.iterrows():
-                # Use index as ID and combine comment columns
-                comment_id = row.name
-                comment_dict = row[comment_columns].dropna().to_dict()
-                comment_text = json.dumps(comment_dict, ensure_ascii=False)
-                overall_comments.append({
-                    "id": str(comment_id),
-                    "comment": comment_text,
-                    "category": row['カテゴリ'],
-                    "sentiment": row['感情'],
-                    "importance": row['重要性'],
-                    "commonality": row['共通性'],
-                    "score": int(row['total_score'])
-                })
+            # Rows are pre-sorted by importance x commonality score when labels are set
+            overall_comments = [self._comment_entry(position) for position in self.ranking.top(max_count)]
             
             # Get top comments by category
             category_top_comments = {}
-            categories = df_with_score['カテゴリ'].unique()
-            
-            for category in categories:
-                category_data = df_with_score[df_with_score['カテゴリ'] == category]
-                category_top = category_data.nlargest(max_count, 'total_score')
-                
-                category_comments = []
-                for _, row in category_top.iterrows():
-                    # Use index as ID and combine comment columns
-                    comment_id = row.name
-                    comment_dict = row[comment_columns].dropna().to_dict()
-                    comment_text = json.dumps(comment_dict, ensure_ascii=False)
-                    category_comments.append({
-                        "id": str(comment_id),
-                        "comment": comment_text,
-                        "category": row['カテゴリ'],
-                        "sentiment": row['感情'],
-                        "importance": row['重要性'],
-                        "commonality": row['共通性'],
-                        "score": int(row['total_score'])
-                    })
-                
-                category_top_comments[category] = category_comments
+            for category in self.ranking.categories_in_order:
+                category_top_comments[category] = [
+                    self._comment_entry(position) for position in self.ranking.top(max_count, category=category)
+                ]
             
             return {
                 "max_count": max_count,
@@ -576,143 +1376,294 @@ class CSVService:
             raise HTTPException(status_code=500, detail=f"Error generating top comments: {str(e)}")
 
 
-    async def generate_comment_report(self) -> Dict[str, Any]:
-        """Generate a comprehensive report from top 50 comments using Nova Pro"""
+    def get_ranked_comments(
+        self,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        category: Optional[str] = None,
+        sentiment: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Page through all comments ranked by score, optionally filtered by category and sentiment"""
+        if self.csv_data.empty:
+            raise HTTPException(status_code=404, detail="No data available. Please upload a file first.")
+
+        if not self.analyzed:
+            raise HTTPException(status_code=400, detail="File has not been analyzed yet. Please analyze first.")
+
+        ranked = self.ranking.ranked(category=category, sentiment=sentiment)
+        offset = decode_cursor(cursor, self.version) if cursor else 0
+        positions = ranked[offset:offset + limit]
+
+        comments = []
+        for rank, position in enumerate(positions, start=offset + 1):
+            comments.append({"rank": rank, **self._comment_entry(position)})
+
+        next_offset = offset + len(positions)
+        return {
+            "comments": comments,
+            "total": len(ranked),
+            "next_cursor": encode_cursor(self.version, next_offset) if next_offset < len(ranked) else None,
+            "category": category,
+            "sentiment": sentiment
+        }
+
+    def _check_clusters(self) -> None:
+        if self.csv_data.empty:
+            raise HTTPException(status_code=404, detail="No data available. Please upload a file first.")
+
+        if not self.comment_columns:
+            raise HTTPException(
+                status_code=400, detail="No comment columns found. Expected columns with '必須' or '任意'"
+            )
+
+    def _cluster_entry(self, cluster_id: int, sample_size: int) -> Dict[str, Any]:
+        summary = self.clusters.summary(cluster_id)
+        representative = summary.pop("representative_row")
+        members = self.clusters.members(cluster_id)[:sample_size]
+        return {
+            **summary,
+            "representative_id": str(self.csv_data.index[representative]),
+            "representative_comment": self.comment_texts.iat[representative],
+            "sample_ids": [str(self.csv_data.index[position]) for position in members],
+        }
+
+    def get_clusters(self, limit: int = 20, min_size: int = 2, sample_size: int = 5) -> Dict[str, Any]:
+        """Largest clusters of similar comments, with a representative comment each"""
+        self._check_clusters()
+
+        # Clusters are numbered by size, so the first ones are the largest
+        count = int((self.clusters.sizes >= min_size).sum())
+        return {
+            "clusters": [self._cluster_entry(cluster_id, sample_size) for cluster_id in range(min(limit, count))],
+            "total_clusters": len(self.clusters),
+            "matching_clusters": count,
+            "answered_rows": self.clusters.answered_rows,
+            "unclustered_rows": len(self.csv_data) - self.clusters.answered_rows,
+        }
+
+    def get_cluster(self, cluster_id: int, page: int = 1, page_size: int = 100) -> Dict[str, Any]:
+        """A cluster's members (with their labels once analyzed), in row order"""
+        self._check_clusters()
+
+        if not 0 <= cluster_id < len(self.clusters):
+            raise HTTPException(status_code=404, detail=f"Cluster {cluster_id} not found")
+
+        members = self.clusters.members(cluster_id)
+        positions = members[(page - 1) * page_size:page * page_size]
+        if self.analyzed:
+            comments = [self._comment_entry(position) for position in positions]
+        else:
+            comments = [
+                {"id": str(self.csv_data.index[position]), "comment": self.comment_texts.iat[position]}
+                for position in positions
+            ]
+        return {
+            **self._cluster_entry(cluster_id, sample_size=0),
+            "comments": comments,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": (len(members) + page_size - 1) // page_size,
+        }
+
+    def _report_agent(self, model_id: str, max_tokens: int) -> Agent:
+        return agent_pool.get(
+            model_id=model_id,
+            output_type=str,
+            retries=3,
+            temperature=0.3,
+            max_tokens=max_tokens,
+            timeout=120,
+        )
+
+    async def _run_report_agent(self, model_id: str, prompt: str, max_tokens: int) -> tuple[str, float]:
+        """Run a free-text report request and return its output and cost"""
+        agent = self._report_agent(model_id, max_tokens)
+        response = await llm_scheduler.run(
+            lambda: agent.run([prompt]), estimated_tokens=estimate_tokens(prompt), model=model_id
+        )
+        return response.output, usage_cost(model_id, response.usage())
+
+    def _check_report_ready(self) -> None:
         if self.csv_data.empty:
             raise HTTPException(status_code=404, detail="No data available. Please upload a file first.")
         
         if not self.analyzed:
             raise HTTPException(status_code=400, detail="File has not been analyzed yet. Please analyze first.")
         
-        try:
-            # Find comment columns
-            comment_columns = [col for col in self.csv_data.columns if "必須" in col or "任意" in col]
-            
-            if not comment_columns:
-                raise HTTPException(status_code=400, detail="No comment columns found.")
-            
-            # Get top 50 comments based on importance and commonality score
-            importance_map = {'高': 3, '中': 2, '低': 1}
-            commonality_map = {'高': 3, '中': 2, '低': 1}
-            
-            df_with_score = self.csv_data.copy()
-            df_with_score['importance_score'] = df_with_score['重要性'].map(importance_map)
-            df_with_score['commonality_score'] = df_with_score['共通性'].map(commonality_map)
-            df_with_score['total_score'] = df_with_score['importance_score'] * df_with_score['commonality_score']
-            
-            # Get top 50 comments
-            top_50 = df_with_score.nlargest(50, 'total_score')
-            
-            # Prepare comments for analysis
-            comments_for_analysis = []
-            for _, row in top_50.iterrows():
-                comment_dict = row[comment_columns].dropna().to_dict()
-                comment_text = json.dumps(comment_dict, ensure_ascii=False)
-                comments_for_analysis.append({
-                    "comment": comment_text,
-                    "sentiment": row['感情'],
-                    "category": row['カテゴリ'],
-                    "importance": row['重要性'],
-                    "commonality": row['共通性']
-                })
-            
-            # Separate positive and negative comments
-            positive_comments = [c for c in comments_for_analysis if c['sentiment'] == 'ポジティブ']
-            negative_comments = [c for c in comments_for_analysis if c['sentiment'] == 'ネガティブ']
-            
-            # Create prompt for Nova Pro
-            prompt = f"""
-以下は講義に関するフィードバックコメントのトップ50件です。これらのコメントを分析して、包括的なレポートを作成してください。
+        if not self.comment_columns:
+            raise HTTPException(status_code=400, detail="No comment columns found.")
 
-ポジティブなコメント（{len(positive_comments)}件）:
-{chr(10).join([f"- {c['comment']}" for c in positive_comments[:25]])}
+    def _report_cache_key(self, mode: str) -> tuple:
+        return (mode, self.version, REPORT_PROMPT_VERSION)
 
-ネガティブなコメント（{len(negative_comments)}件）:
-{chr(10).join([f"- {c['comment']}" for c in negative_comments[:25]])}
+    async def _report_prompt(self, mode: str) -> tuple[str, Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        """Final Nova Pro prompt, report metadata and the cost of any preliminary stages"""
+        if mode == "map_reduce":
+            return await self._map_reduce_report_prompt()
 
-以下の形式でレポートを作成してください：
+        # Get top 50 comments based on the precomputed importance and commonality score
+        comments_for_analysis = [self._comment_entry(position) for position in self.ranking.top(50)]
 
-1. ポジティブな意見のまとめ：
-受講者から評価されている点を具体的にまとめてください。共通するテーマや特に評価の高い要素を抽出し、講義の強みを明確にしてください。
+        # Separate positive and negative comments
+        positive_comments = [c['comment'] for c in comments_for_analysis if c['sentiment'] == 'ポジティブ']
+        negative_comments = [c['comment'] for c in comments_for_analysis if c['sentiment'] == 'ネガティブ']
 
-2. ネガティブな意見のまとめ：
-受講者が改善を求めている点を具体的にまとめてください。共通する課題や問題点を抽出し、優先度の高い改善項目を明確にしてください。
+        metadata = {
+            "total_comments_analyzed": len(comments_for_analysis),
+            "positive_count": len(positive_comments),
+            "negative_count": len(negative_comments),
+            "model_used": "Amazon Nova Pro"
+        }
+        return top_report_prompt(positive_comments, negative_comments), metadata, {}
 
-3. 総合的な洞察：
-ポジティブとネガティブな意見を総合して、講義全体の評価と今後の改善方向性について洞察を提供してください。具体的な改善提案も含めてください。
+    async def _map_reduce_report_prompt(self) -> tuple[str, Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        """Summarize all comments in parallel chunks (map), merging summaries until they fit one prompt"""
+        order = self.ranking.ranked()
+        entries = [
+            {"comment": comment, "category": category, "sentiment": sentiment}
+            for comment, category, sentiment in zip(
+                self.comment_texts.to_numpy()[order],
+                self.csv_data['カテゴリ'].to_numpy()[order],
+                self.csv_data['感情'].to_numpy()[order],
+            )
+        ]
+        chunks = chunk_comments(entries, budget=REPORT_CHUNK_TOKENS)
+        if not chunks:
+            raise HTTPException(status_code=400, detail="No comments to report on.")
 
-各セクションは段落形式で、読みやすく構造化してください。
-"""
+        stages: Dict[str, Dict[str, Any]] = {}
 
-            # Use Nova Pro for report generation
-            model_id = "amazon.nova-pro-v1:0"
-            agent = generate_agent(
-                model_id=model_id,
-                output_type=str,
-                retries=3,
-                temperature=0.3,
-                max_tokens=4000,
-                timeout=120,
+        async def summarize(stage: str, prompts: List[str]) -> List[Optional[str]]:
+            """Run one parallel Nova-lite stage, recording its requests and cost (None for failed requests)"""
+            outcomes = await run_bounded(
+                prompts,
+                lambda prompt: self._run_report_agent(REPORT_MAP_MODEL_ID, prompt, max_tokens=1000),
+                num_workers=REPORT_MAP_CONCURRENCY,
+            )
+            succeeded = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+            record = stages.setdefault(
+                stage, {"model": REPORT_MAP_MODEL_ID, "requests": 0, "failed_requests": 0, "cost": 0.0}
             )
+            record["requests"] += len(prompts)
+            record["failed_requests"] += len(prompts) - len(succeeded)
+            record["cost"] += sum(cost for _, cost in succeeded)
+            if not succeeded:
+                raise HTTPException(status_code=502, detail=f"All {stage} requests failed")
+            return [None if isinstance(outcome, Exception) else outcome[0] for outcome in outcomes]
 
-            response = await agent.run([prompt])
-            report_text = response.output
+        # Map: summarize every chunk of one category and sentiment
+        summaries = [
+            f"【{chunk['category']} / {chunk['sentiment']}】\n{summary}"
+            for chunk, summary in zip(chunks, await summarize("map", [map_prompt(chunk) for chunk in chunks]))
+            if summary is not None
+        ]
 
-            # Calculate cost
-            input_tokens = response.usage().request_tokens
-            output_tokens = response.usage().response_tokens
-            total_tokens = response.usage().total_tokens
-            think_tokens = total_tokens - input_tokens - output_tokens
+        # Merge summaries until they fit in a single reduce request
+        while sum(len(summary) for summary in summaries) > REPORT_REDUCE_TOKENS and len(summaries) > 1:
+            batches = pack_summaries(summaries, REPORT_REDUCE_TOKENS // 2)
+            if len(batches) == len(summaries):
+                break
+            merged = await summarize("merge", [merge_prompt(batch) for batch in batches])
+            summaries = [summary for summary in merged if summary is not None]
 
-            input_cost, output_cost, think_cost = calculate_cost(
-                model_name=model_id,
-                input_tokens=input_tokens,
-                output_tokens=output_tokens,
-                think_tokens=think_tokens,
-            )
-            total_cost = input_cost + output_cost + think_cost
+        sentiments = self.csv_data['感情'].value_counts()
+        sentiment_counts = {sentiment: int(sentiments.get(sentiment, 0)) for sentiment in LABEL_CATEGORIES['感情']}
+        metadata = {
+            "total_comments_analyzed": len(entries),
+            "positive_count": sentiment_counts.get('ポジティブ', 0),
+            "negative_count": sentiment_counts.get('ネガティブ', 0),
+            "chunks": len(chunks),
+            "model_used": "Amazon Nova Lite (map) + Amazon Nova Pro (reduce)"
+        }
+        return reduce_prompt(summaries, len(entries), sentiment_counts), metadata, stages
 
-            # Parse the report into sections
-            sections = report_text.split('\n\n')
-            
-            positive_summary = ""
-            negative_summary = ""
-            overall_insights = ""
-            
-            current_section = ""
-            for section in sections:
-                if "ポジティブな意見" in section or "1." in section:
-                    current_section = "positive"
-                    positive_summary += section.replace("1. ポジティブな意見のまとめ：", "").strip() + "\n\n"
-                elif "ネガティブな意見" in section or "2." in section:
-                    current_section = "negative"
-                    negative_summary += section.replace("2. ネガティブな意見のまとめ：", "").strip() + "\n\n"
-                elif "総合的な洞察" in section or "3." in section:
-                    current_section = "insights"
-                    overall_insights += section.replace("3. 総合的な洞察：", "").strip() + "\n\n"
-                else:
-                    if current_section == "positive":
-                        positive_summary += section + "\n\n"
-                    elif current_section == "negative":
-                        negative_summary += section + "\n\n"
-                    elif current_section == "insights":
-                        overall_insights += section + "\n\n"
+    def _report_result(
+        self, report_text: str, metadata: Dict[str, Any], stages: Dict[str, Dict[str, Any]], reduce_cost: float
+    ) -> Dict[str, Any]:
+        stages = {
+            **stages,
+            "reduce": {"model": REPORT_REDUCE_MODEL_ID, "requests": 1, "failed_requests": 0, "cost": reduce_cost},
+        }
+        total_cost = sum(stage["cost"] for stage in stages.values())
+        return {
+            **parse_report_sections(report_text),
+            **metadata,
+            "stages": {name: {**stage, "cost": round(stage["cost"], 4)} for name, stage in stages.items()},
+            "total_cost": round(total_cost, 4),
+            "cost_display": f"${total_cost:.4f}",
+            "prompt_version": REPORT_PROMPT_VERSION
+        }
 
-            return {
-                "positive_summary": positive_summary.strip(),
-                "negative_summary": negative_summary.strip(),
-                "overall_insights": overall_insights.strip(),
-                "total_comments_analyzed": len(comments_for_analysis),
-                "positive_count": len(positive_comments),
-                "negative_count": len(negative_comments),
-                "total_cost": round(total_cost, 4),
-                "cost_display": f"${total_cost:.4f}",
-                "model_used": "Amazon Nova Pro"
-            }
+    @traced('report')
+    async def generate_comment_report(self, mode: str = "top") -> Dict[str, Any]:
+        """Generate a comprehensive report using Nova Pro
+
+        mode="top" reports on the top 50 comments by score; mode="map_reduce" summarizes
+        every comment in parallel chunks with Nova-lite and reduces the summaries with Nova Pro.
+        Reports are cached until the dataset or the report prompts change.
+        """
+        self._check_report_ready()
+
+        key = self._report_cache_key(mode)
+        if key in self._reports:
+            return {**self._reports[key], "cached": True}
+
+        try:
+            prompt, metadata, stages = await self._report_prompt(mode)
             
+            # Use Nova Pro for report generation
+            report_text, reduce_cost = await self._run_report_agent(REPORT_REDUCE_MODEL_ID, prompt, max_tokens=4000)
+        except HTTPException:
+            raise
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error generating report: {e!s}")
+
+        result = self._report_result(report_text, metadata, stages, reduce_cost)
+        self._reports[key] = result
+        return {**result, "cached": False}
+
+    def stream_comment_report(self, mode: str = "top") -> AsyncIterator[str]:
+        """Report as Server-Sent Events: section markers and text deltas as Nova Pro writes them, then the result"""
+        self._check_report_ready()
+        return self._stream_report(mode)
+
+    async def _stream_report(self, mode: str) -> AsyncIterator[str]:
+        key = self._report_cache_key(mode)
+        if key in self._reports:
+            cached = self._reports[key]
+            for section in SECTION_MARKERS.values():
+                yield format_sse("section", {"section": section})
+                yield format_sse("delta", {"section": section, "text": cached[section]})
+            yield format_sse("done", {**cached, "cached": True})
+            return
+
+        try:
+            if mode == "map_reduce":
+                yield format_sse("stage", {"stage": "map"})
+            prompt, metadata, stages = await self._report_prompt(mode)
+            yield format_sse("stage", {"stage": "reduce"})
+
+            agent = self._report_agent(REPORT_REDUCE_MODEL_ID, max_tokens=4000)
+            sections = SectionStream()
+            report_parts = []
+            async with llm_scheduler.slot(
+                estimated_tokens=estimate_tokens(prompt), model=REPORT_REDUCE_MODEL_ID
+            ) as settle:
+                async with agent.run_stream([prompt]) as response:
+                    async for delta in response.stream_text(delta=True):
+                        report_parts.append(delta)
+                        for event in sections.feed(delta):
+                            yield format_sse(event["event"], event["data"])
+                    settle(response)
+                    reduce_cost = usage_cost(REPORT_REDUCE_MODEL_ID, response.usage())
+            for event in sections.flush():
+                yield format_sse(event["event"], event["data"])
 
+            result = self._report_result("".join(report_parts), metadata, stages, reduce_cost)
+            self._reports[key] = result
+            yield format_sse("done", {**result, "cached": False})
 
-# Global instance to store CSV data in memory
-csv_service = CSVService()
+        except HTTPException as e:
+            yield format_sse("error", {"detail": e.detail})
+        except Exception as e:  # noqa: BLE001
+            yield format_sse("error", {"detail": f"Error generating report: {e!s}"})
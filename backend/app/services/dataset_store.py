@@ -0,0 +1,236 @@
+import asyncio
+import contextlib
+import logging
+import os
+import pickle
+import re
+import time
+import uuid
+from collections import OrderedDict
+from http import HTTPStatus
+from typing import Any
+
+from fastapi import HTTPException
+
+from .csv_service import CSVService
+from .jobs import job_manager
+from .offload import offloader
+from .shared_state import SHARED_LEASE_SECONDS, shared_state
+from .telemetry import ERRORS
+
+# Total memory the in-memory datasets may use before idle ones are evicted
+DATASET_MEMORY_BUDGET_MB = int(os.getenv('DATASET_MEMORY_BUDGET_MB', '1024'))
+# Datasets untouched for this long are evicted even under budget (0 disables)
+DATASET_IDLE_SECONDS = int(os.getenv('DATASET_IDLE_SECONDS', '86400'))
+# Evicted datasets are pickled here and reloaded on next access ('' drops them instead)
+DATASET_SPILL_DIR = os.getenv('DATASET_SPILL_DIR', 'data/datasets')
+
+DEFAULT_DATASET_ID = "default"
+DATASET_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetStore:
+    """Uploaded datasets keyed by dataset (session) id, with LRU eviction under a memory budget
+
+    Only used from the event loop, so its bookkeeping needs no lock; loading a spilled or
+    changed dataset from disk runs in the offload pool.
+    """
+
+    def __init__(self, memory_budget_bytes: int, idle_seconds: int, spill_dir: str):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = spill_dir
+        self._datasets: OrderedDict[str, CSVService] = OrderedDict()
+        self._last_used: dict[str, float] = {}
+        self._sizes: dict[str, int] = {}
+
+    def _spill_path(self, dataset_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{dataset_id}.pkl")
+
+    def _validate(self, dataset_id: str) -> None:
+        if not re.match(DATASET_ID_PATTERN, dataset_id):
+            raise HTTPException(status_code=400, detail="Invalid dataset id")
+
+    def _touch(self, dataset_id: str) -> None:
+        self._datasets.move_to_end(dataset_id)
+        self._last_used[dataset_id] = time.time()
+
+    def _new(self, dataset_id: str) -> CSVService:
+        service = CSVService()
+        service.dataset_id = dataset_id
+        if shared_state.enabled:
+            shared_state.save_dataset(dataset_id, service)
+        self._datasets[dataset_id] = service
+        self._touch(dataset_id)
+        return service
+
+    def create(self) -> str:
+        """Reserve a new, empty dataset and return its id"""
+        dataset_id = uuid.uuid4().hex
+        self._new(dataset_id)
+        return dataset_id
+
+    async def get(self, dataset_id: str) -> CSVService:
+        """Dataset by id, reloading it from disk if it was spilled or changed by another worker"""
+        self._validate(dataset_id)
+        service = self._datasets.get(dataset_id)
+        if service is not None and shared_state.enabled and shared_state.dataset_version(dataset_id) is None:
+            # Deleted by another worker
+            self._forget(dataset_id)
+            service = None
+        if service is None:
+            service = await offloader.run(self._load_spilled, dataset_id)
+            if dataset_id in self._datasets:
+                # Loaded by a concurrent request meanwhile
+                service = self._datasets[dataset_id]
+            elif service is None:
+                if dataset_id != DEFAULT_DATASET_ID:
+                    raise HTTPException(status_code=404, detail=f"Dataset {dataset_id} not found")
+                # Clients that do not manage dataset ids share the default dataset
+                return self._new(dataset_id)
+            else:
+                service.dataset_id = dataset_id
+                self._datasets[dataset_id] = service
+                self._sizes[dataset_id] = service.memory_usage()
+        elif not service.lock.locked():
+            version = (service.upload_id, service.version)
+            await service.refresh()
+            if (service.upload_id, service.version) != version:
+                self._sizes[dataset_id] = service.memory_usage()
+        self._touch(dataset_id)
+        return service
+
+    async def get_or_create(self, dataset_id: str) -> CSVService:
+        """Dataset by id, creating an empty one under that id if needed"""
+        self._validate(dataset_id)
+        try:
+            return await self.get(dataset_id)
+        except HTTPException as e:
+            if e.status_code != HTTPStatus.NOT_FOUND:
+                raise
+        return self._new(dataset_id)
+
+    async def delete(self, dataset_id: str) -> None:
+        service = await self.get(dataset_id)
+        if service.lock.locked():
+            raise HTTPException(status_code=409, detail="Dataset is busy. Please try again later.")
+        if shared_state.enabled:
+            if not shared_state.acquire(dataset_id):
+                raise HTTPException(status_code=409, detail="Dataset is busy. Please try again later.")
+            shared_state.delete_dataset(dataset_id)
+            shared_state.release(dataset_id)
+        self._forget(dataset_id)
+        if self.spill_dir:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._spill_path(dataset_id))
+
+    def _forget(self, dataset_id: str) -> None:
+        self._datasets.pop(dataset_id, None)
+        self._last_used.pop(dataset_id, None)
+        self._sizes.pop(dataset_id, None)
+
+    def list(self) -> list[dict[str, Any]]:
+        """Summary of the in-memory and spilled (or, with a shared state, all workers') datasets"""
+        if shared_state.enabled:
+            return [
+                {
+                    **entry,
+                    "in_memory": entry["dataset_id"] in self._datasets,
+                    "memory_bytes": self._sizes.get(entry["dataset_id"], 0),
+                    "last_used": self._last_used.get(entry["dataset_id"]),
+                }
+                for entry in shared_state.list_datasets()
+            ]
+        datasets = [
+            {
+                "dataset_id": dataset_id,
+                "filename": service.filename,
+                "total_rows": len(service.csv_data),
+                "analyzed": service.analyzed,
+                "in_memory": True,
+                "memory_bytes": self._sizes.get(dataset_id, 0),
+                "last_used": self._last_used.get(dataset_id),
+            }
+            for dataset_id, service in self._datasets.items()
+        ]
+        if self.spill_dir and os.path.isdir(self.spill_dir):
+            for name in sorted(os.listdir(self.spill_dir)):
+                dataset_id, ext = os.path.splitext(name)
+                if ext == ".pkl" and dataset_id not in self._datasets:
+                    datasets.append({"dataset_id": dataset_id, "in_memory": False})
+        return datasets
+
+    def update_size(self, dataset_id: str) -> None:
+        """Re-measure a dataset after it changed and evict others if over budget"""
+        service = self._datasets.get(dataset_id)
+        if service is not None:
+            self._sizes[dataset_id] = service.memory_usage()
+        self.enforce_budget(keep=dataset_id)
+
+    def enforce_budget(self, keep: str = "") -> None:
+        """Evict idle datasets, least recently used first, until the memory budget is met"""
+        now = time.time()
+        for dataset_id in list(self._datasets):
+            if dataset_id == keep or self._datasets[dataset_id].lock.locked():
+                continue
+            expired = self.idle_seconds > 0 and now - self._last_used.get(dataset_id, now) > self.idle_seconds
+            over_budget = sum(self._sizes.values()) > self.memory_budget_bytes
+            if expired or over_budget:
+                self._evict(dataset_id)
+
+    def _evict(self, dataset_id: str) -> None:
+        service = self._datasets.pop(dataset_id)
+        self._sizes.pop(dataset_id, None)
+        self._last_used.pop(dataset_id, None)
+        # With a shared state the dataset is reloaded from its saved snapshot instead
+        if self.spill_dir and not shared_state.enabled and not service.csv_data.empty:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(dataset_id), "wb") as f:
+                pickle.dump(service, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _load_spilled(self, dataset_id: str):
+        if shared_state.enabled:
+            return shared_state.load_dataset(dataset_id)
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(dataset_id)
+        try:
+            # Only files written by _evict live here
+            with open(path, "rb") as f:
+                service = pickle.load(f)  # noqa: S301
+            os.remove(path)
+        except FileNotFoundError:
+            # Never spilled, or taken by a concurrent load
+            return None
+        return service
+
+
+dataset_store = DatasetStore(
+    memory_budget_bytes=DATASET_MEMORY_BUDGET_MB * 1024 * 1024,
+    idle_seconds=DATASET_IDLE_SECONDS,
+    spill_dir=DATASET_SPILL_DIR,
+)
+
+
+async def maintain_shared_state() -> None:
+    """Keep this worker's leases alive and resume analysis jobs of workers that stopped renewing theirs"""
+    while True:
+        try:
+            shared_state.renew()
+            for job in shared_state.claim_orphaned_jobs():
+                logger.info(
+                    "Resuming analysis job %s of dataset %s from worker %s",
+                    job["job_id"], job["dataset_id"], job["owner"],
+                )
+                try:
+                    service = await dataset_store.get(job["dataset_id"])
+                    service.start_analysis_job(**job["params"], job_id=job["job_id"])
+                except HTTPException as e:
+                    failed = job_manager.create(total_rows=0, job_id=job["job_id"])
+                    failed.fail(str(e.detail))
+        except Exception:
+            logger.exception("Error maintaining shared state")
+            ERRORS.inc(component="shared_state")
+        await asyncio.sleep(SHARED_LEASE_SECONDS / 3)
@@ -0,0 +1,54 @@
+import json
+import re
+import unicodedata
+
+# Answers that carry no content, compared after normalization
+NO_COMMENT_ANSWERS = {
+    'なし', '無し', 'ナシ', '特になし', '特に無し', 'とくになし', '特にない', '特に無い',
+    'ない', '無い', '特にありません', 'ありません', 'なにもない', '何もない', 'ないです', '特にないです',
+    'none', 'nothing', 'na', 'no', 'nil',
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize an answer so trivially different variants compare equal
+
+    Applies NFKC (full-width/half-width folding), lower-cases, and removes whitespace,
+    punctuation and symbols. Answers that mean "no comment" normalize to an empty string.
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    text = _WHITESPACE.sub('', text)
+    text = ''.join(ch for ch in text if not unicodedata.category(ch).startswith(('P', 'S')))
+    return '' if text in NO_COMMENT_ANSWERS else text
+
+
+def normalize_comment(comment: str) -> str:
+    """Normalize the combined comment JSON of a row into a deduplication key"""
+    try:
+        fields = json.loads(comment)
+    except (TypeError, ValueError):
+        return normalize_text(comment)
+
+    if not isinstance(fields, dict):
+        return normalize_text(comment)
+
+    normalized = {}
+    for column, value in fields.items():
+        text = normalize_text(value)
+        if text:
+            normalized[column] = text
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+
+
+def group_duplicate_comments(comments: list[str]) -> list[list[int]]:
+    """Group row positions whose comments normalize to the same key
+
+    Groups are returned in order of first appearance; the first member of each group
+    is its representative.
+    """
+    groups: dict[str, list[int]] = {}
+    for i, comment in enumerate(comments):
+        groups.setdefault(normalize_comment(comment), []).append(i)
+    return list(groups.values())
@@ -0,0 +1,159 @@
+import codecs
+import os
+import tempfile
+import zlib
+from collections.abc import Iterator
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi import HTTPException
+from openpyxl import Workbook
+
+# Rows converted per chunk while streaming an export
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '10000'))
+# XLSX files are assembled in a temp file that stays in memory up to this size
+EXPORT_SPOOL_BYTES = 16 * 1024 * 1024
+FILE_READ_BYTES = 1024 * 1024
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+
+def select_export_columns(data: pd.DataFrame, columns: list[str] | None) -> list[Any]:
+    """Columns to export, in the requested order (all columns when none are given)"""
+    if not columns:
+        return list(data.columns)
+    by_name = {str(column): column for column in data.columns}
+    unknown = [column for column in columns if column not in by_name]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+    return [by_name[column] for column in dict.fromkeys(columns)]
+
+
+def _chunks(data: pd.DataFrame, columns: list[Any]) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(data), EXPORT_CHUNK_ROWS):
+        yield data.iloc[start:start + EXPORT_CHUNK_ROWS][columns]
+
+
+def iter_csv(data: pd.DataFrame, columns: list[Any], bom: bool = False) -> Iterator[bytes]:
+    """Encoded CSV, one chunk of rows at a time"""
+    if bom:
+        yield codecs.BOM_UTF8
+    yield pd.DataFrame(columns=columns).to_csv(index=False).encode('utf-8')
+    for chunk in _chunks(data, columns):
+        yield chunk.to_csv(index=False, header=False).encode('utf-8')
+
+
+def gzip_stream(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Gzip-compress a byte stream incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _StreamSink:
+    """Write-only file object whose contents are drained by the streaming generator"""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_parquet(data: pd.DataFrame, columns: list[Any]) -> Iterator[bytes]:
+    """Parquet file written and streamed one row group per chunk"""
+    sink = _StreamSink()
+    # Taken from the column dtypes, not the values, so every chunk (including the first) matches it
+    schema = pa.Schema.from_pandas(_parquet_frame(data.iloc[:0][columns]), preserve_index=False)
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in _chunks(data, columns):
+            writer.write_table(pa.Table.from_pandas(_parquet_frame(chunk), schema=schema, preserve_index=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _parquet_frame(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Chunk with string column names (required by Parquet) and object columns as nullable strings
+
+    Without the cast, object columns of an empty frame get pyarrow's `null` type, and mixed
+    values (numbers in a free-text column of an XLSX upload) cannot be converted.
+    """
+    chunk = chunk.rename(columns=str)
+    objects = [column for column, dtype in chunk.dtypes.items() if pd.api.types.is_object_dtype(dtype)]
+    if objects:
+        chunk = chunk.astype(dict.fromkeys(objects, "string"))
+    return chunk
+
+
+def iter_xlsx(data: pd.DataFrame, columns: list[Any]) -> Iterator[bytes]:
+    """XLSX written row by row with openpyxl's write-only mode, then streamed from a temp file
+
+    Unlike CSV and Parquet this is not streamed while it is built: the whole workbook is written to
+    a spooled temp file (in memory up to EXPORT_SPOOL_BYTES) before the first byte is sent.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([str(column) for column in columns])
+    for chunk in _chunks(data, columns):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(list(row))
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as buffer:
+        workbook.save(buffer)
+        buffer.seek(0)
+        while True:
+            block = buffer.read(FILE_READ_BYTES)
+            if not block:
+                break
+            yield block
+
+
+def iter_export(
+    data: pd.DataFrame,
+    columns: list[Any],
+    export_format: str = 'csv',
+    compress: bool = False,
+    bom: bool = False,
+) -> Iterator[bytes]:
+    """Byte stream of `data` in the requested format"""
+    if export_format == 'csv':
+        stream = iter_csv(data, columns, bom=bom)
+    elif export_format == 'parquet':
+        stream = iter_parquet(data, columns)
+    elif export_format == 'xlsx':
+        stream = iter_xlsx(data, columns)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {export_format}")
+    return gzip_stream(stream) if compress else stream
@@ -0,0 +1,153 @@
+import codecs
+import os
+from typing import Any, BinaryIO
+
+import pandas as pd
+from fastapi import HTTPException
+from openpyxl import load_workbook
+
+# Largest accepted upload, in bytes
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(300 * 1024 * 1024)))
+# Load only the comment columns (plus an id column) instead of the whole export
+UPLOAD_COMMENT_COLUMNS_ONLY = os.getenv('UPLOAD_COMMENT_COLUMNS_ONLY', 'true').lower() == 'true'
+
+CSV_CHUNK_ROWS = 50_000
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+# Header names treated as a respondent/row id, compared case-insensitively
+ID_COLUMN_NAMES = {'id', 'no', 'no.', '番号', '回答id', '回答番号', '回答者id', 'response id', 'respondent id'}
+
+
+def is_comment_column(column: Any) -> bool:
+    """Free-text question columns are marked as required (必須) or optional (任意)"""
+    return "必須" in str(column) or "任意" in str(column)
+
+
+def is_id_column(column: Any) -> bool:
+    return str(column).strip().lower() in ID_COLUMN_NAMES
+
+
+def select_columns(columns: list[Any]) -> list[Any]:
+    """Columns to keep from an upload: comment columns plus id, or everything"""
+    if not UPLOAD_COMMENT_COLUMNS_ONLY or not any(is_comment_column(col) for col in columns):
+        return list(columns)
+    return [col for col in columns if is_comment_column(col) or is_id_column(col)]
+
+
+def upload_size(file: BinaryIO) -> int:
+    """Size of a seekable upload without reading it into memory"""
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+def check_upload_size(file: BinaryIO) -> None:
+    size = upload_size(file)
+    if size > UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File is too large ({size / 1024 / 1024:.1f} MB). "
+                   f"Maximum size is {UPLOAD_MAX_BYTES / 1024 / 1024:.0f} MB",
+        )
+
+
+def candidate_encodings(sample: bytes) -> list[str]:
+    """Encodings to try for a CSV, most likely first judging by its first bytes (UTF-8 with/without BOM, CP932)"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return ['utf-8-sig']
+    valid, invalid = [], []
+    for encoding in ('utf-8', 'cp932'):
+        try:
+            # The sample may end in the middle of a multi-byte character
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            valid.append(encoding)
+        except UnicodeDecodeError:
+            invalid.append(encoding)
+    # Bytes past the sample may still rule out the guess, so the other encoding is kept as a fallback
+    return valid + invalid
+
+
+def _read_csv(file: BinaryIO, encoding: str) -> pd.DataFrame:
+    file.seek(0)
+    header = pd.read_csv(file, nrows=0, encoding=encoding).columns
+    usecols = select_columns(list(header))
+
+    file.seek(0)
+    chunks = pd.read_csv(file, usecols=usecols, encoding=encoding, chunksize=CSV_CHUNK_ROWS)
+    data = pd.concat(chunks, ignore_index=True)
+    return data[[col for col in usecols if col in data.columns]]
+
+
+def read_csv_stream(file: BinaryIO) -> pd.DataFrame:
+    """Parse a CSV upload incrementally, keeping only the needed columns
+
+    The whole file must decode in one of the candidate encodings; nothing is silently replaced.
+    """
+    file.seek(0)
+    encodings = candidate_encodings(file.read(ENCODING_SAMPLE_BYTES))
+    for encoding in encodings:
+        try:
+            return _read_csv(file, encoding)
+        except UnicodeDecodeError:
+            continue
+    # Not an HTTPException: this may run in a worker process, and the upload handler reports it as a 400
+    raise ValueError(f"Could not decode the CSV file as {' or '.join(encodings)}. Please save it as UTF-8")
+
+
+def unique_columns(header: list[Any]) -> list[Any]:
+    """Rename repeated header names like pandas does ("ご意見", "ご意見.1", ...)"""
+    seen = set(header)
+    counts: dict[Any, int] = {}
+    names = []
+    for name in header:
+        if name in counts:
+            while True:
+                counts[name] += 1
+                renamed = f"{name}.{counts[name]}"
+                if renamed not in seen:
+                    break
+            seen.add(renamed)
+            names.append(renamed)
+        else:
+            counts[name] = 0
+            names.append(name)
+    return names
+
+
+def read_xlsx_stream(file: BinaryIO) -> pd.DataFrame:
+    """Parse the first sheet of an XLSX upload with openpyxl's read-only streaming reader"""
+    file.seek(0)
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+
+        header = unique_columns([f"Unnamed: {i}" if name is None else name for i, name in enumerate(header)])
+        selected = set(select_columns(header))
+        keep = [i for i, name in enumerate(header) if name in selected]
+
+        columns: dict[Any, list[Any]] = {header[i]: [] for i in keep}
+        for row in rows:
+            if not any(value is not None for value in row):
+                continue
+            for i in keep:
+                columns[header[i]].append(row[i] if i < len(row) else None)
+    finally:
+        workbook.close()
+
+    return pd.DataFrame(columns)
+
+
+def read_upload(file: BinaryIO, filename: str) -> pd.DataFrame:
+    """Parse a CSV or XLSX upload by its file extension"""
+    return read_xlsx_stream(file) if filename.endswith('.xlsx') else read_csv_stream(file)
+
+
+def read_upload_path(path: str, filename: str) -> pd.DataFrame:
+    """Parse an upload saved at `path` (used by worker processes, which cannot share the spooled file)"""
+    with open(path, "rb") as f:
+        return read_upload(f, filename)
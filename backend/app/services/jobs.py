@@ -0,0 +1,278 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from fastapi import HTTPException
+
+from .shared_state import shared_state
+
+# How often a worker streaming another worker's job polls the shared state for new events
+JOB_POLL_SECONDS = 0.5
+# Finished jobs (and their events) are forgotten this many seconds after they end
+JOB_TTL_SECONDS = float(os.getenv('JOB_TTL_SECONDS', '3600'))
+# Row events a running job keeps for clients that reconnect; older ones, and all of them once the job
+# has finished, are dropped from the replay log (the labels are read from the dataset instead)
+JOB_ROW_EVENTS_KEPT = int(os.getenv('JOB_ROW_EVENTS_KEPT', '1000'))
+# With a shared state, progress is written at most this often; the final event is written at once
+JOB_SAVE_SECONDS = float(os.getenv('JOB_SAVE_SECONDS', '1'))
+
+
+def format_sse(event: str, data: dict[str, Any], event_id: int | None = None) -> str:
+    """Encode one Server-Sent Event"""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class AnalysisJob:
+    """A background analysis run with progress counters and a replayable event log
+
+    Events are numbered in publication order; the log keeps every progress, dangerous, alert and
+    final event but only the latest JOB_ROW_EVENTS_KEPT row events, so replays may skip rows.
+    """
+
+    def __init__(self, total_rows: int, job_id: str | None = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.status = "queued"
+        self.total_rows = total_rows
+        self.done_rows = 0
+        self.failed_rows = 0
+        self.total_cost = 0.0
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.result: dict[str, Any] | None = None
+        self.error: str | None = None
+        # {"seq", "event", "data"} in seq order
+        self.events: list[dict[str, Any]] = []
+        self.next_seq = 0
+        self._row_events = 0
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # With a shared state, events published since the last save
+        self.shared = False
+        self._unsaved: list[dict[str, Any]] = []
+        self._last_saved = 0.0
+        self._save_handle: asyncio.TimerHandle | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def start(self, run: Callable[[], Awaitable[dict[str, Any]]]) -> None:
+        """Run the analysis coroutine in the background"""
+        self._task = asyncio.create_task(self._run(run))
+
+    async def _run(self, run: Callable[[], Awaitable[dict[str, Any]]]) -> None:
+        self.status = "running"
+        self.started_at = time.time()
+        self.publish("progress", self.progress())
+        try:
+            self.result = await run()
+            self.status = "completed"
+            self.finished_at = time.time()
+            self.publish("completed", {**self.progress(), "result": self.result})
+            self._drop_row_events()
+        except HTTPException as e:
+            self.fail(str(e.detail))
+        except Exception as e:  # noqa: BLE001
+            self.fail(str(e))
+
+    def fail(self, error: str) -> None:
+        self.status = "failed"
+        self.error = error
+        self.finished_at = time.time()
+        self.publish("failed", self.progress())
+        self._drop_row_events()
+
+    def record_rows(self, rows: list[dict[str, Any]]) -> None:
+        """Record rows that have just been classified and stream them to subscribers"""
+        for row in rows:
+            if row["is_error"]:
+                self.failed_rows += 1
+            else:
+                self.done_rows += 1
+            self.total_cost += row.get("total_cost", 0.0)
+            self.publish("row", row)
+            if row["sentiment"] == "ネガティブ" and row["importance"] == "高":
+                self.publish("dangerous", {"id": row["id"], "comment": row["comment"]})
+        self.publish("progress", self.progress())
+        # Trimmed in steps so the log is not rebuilt on every batch
+        if self._row_events > 2 * JOB_ROW_EVENTS_KEPT:
+            self._compact(JOB_ROW_EVENTS_KEPT)
+
+    def publish(self, event_type: str, data: dict[str, Any]) -> None:
+        event = {"seq": self.next_seq, "event": event_type, "data": data}
+        self.next_seq += 1
+        self.events.append(event)
+        if event_type == "row":
+            self._row_events += 1
+        if self.shared:
+            self._unsaved.append(event)
+            # Row events are always followed by a progress event, which saves them in one go
+            if event_type in ("completed", "failed"):
+                self.save()
+            elif event_type not in ("row", "dangerous"):
+                self._save_soon()
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _compact(self, keep_rows: int) -> None:
+        """Drop all but the latest `keep_rows` row events from the replay log"""
+        drop = self._row_events - keep_rows
+        if drop <= 0:
+            return
+        kept = []
+        for event in self.events:
+            if event["event"] == "row" and drop > 0:
+                drop -= 1
+                before = event["seq"] + 1
+                continue
+            kept.append(event)
+        self.events = kept
+        self._row_events = keep_rows
+        if self.shared:
+            # The dropped events may still be waiting for a throttled save
+            if self._unsaved:
+                self.save()
+            shared_state.delete_job_events(self.id, "row", before=before)
+
+    def _drop_row_events(self) -> None:
+        self._compact(0)
+
+    def _save_soon(self) -> None:
+        """Save now, or once JOB_SAVE_SECONDS have passed since the last save"""
+        if self._save_handle is not None:
+            return
+        delay = self._last_saved + JOB_SAVE_SECONDS - time.monotonic()
+        if delay <= 0:
+            self.save()
+        else:
+            self._save_handle = asyncio.get_running_loop().call_later(delay, self.save)
+
+    def save(self) -> None:
+        """Write the progress and new events to the shared state for the other workers"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        shared_state.save_job(self.id, self.progress(), self._unsaved)
+        self._unsaved = []
+        self._last_saved = time.monotonic()
+
+    def progress(self) -> dict[str, Any]:
+        """Current counters of the job"""
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        processed = self.done_rows + self.failed_rows
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total_rows": self.total_rows,
+            "done_rows": self.done_rows,
+            "failed_rows": self.failed_rows,
+            "remaining_rows": max(self.total_rows - processed, 0),
+            "total_cost": round(self.total_cost, 4),
+            "cost_display": f"${self.total_cost:.4f}",
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "error": self.error,
+        }
+
+    async def stream(self, last_event_id: int = -1) -> AsyncIterator[str]:
+        """Yield the job's events as Server-Sent Events, starting after `last_event_id`"""
+        while True:
+            changed = self._changed
+            start = bisect.bisect_right(self.events, last_event_id, key=lambda event: event['seq'])
+            for event in self.events[start:]:
+                yield format_sse(event['event'], event['data'], event_id=event['seq'])
+                last_event_id = event['seq']
+            if self.finished:
+                return
+            await changed.wait()
+
+
+class RemoteJob:
+    """A job run by another worker, read from the shared state"""
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+
+    @property
+    def finished(self) -> bool:
+        return self.progress()["status"] in ("completed", "failed")
+
+    def progress(self) -> dict[str, Any]:
+        """Counters as of the owning worker's last progress event"""
+        record = shared_state.job(self.id)
+        return record["progress"] if record else {"job_id": self.id, "status": "failed", "error": "Job not found"}
+
+    async def stream(self, last_event_id: int = -1) -> AsyncIterator[str]:
+        """Yield the job's events as Server-Sent Events, polling the shared state for new ones"""
+        while True:
+            # Read the status first so events saved with the final status are not missed
+            finished = self.finished
+            for seq, event in shared_state.job_events(self.id, after=last_event_id):
+                yield format_sse(event['event'], event['data'], event_id=seq)
+                last_event_id = seq
+            if finished:
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+
+class JobManager:
+    """Registry of background analysis jobs"""
+
+    def __init__(self):
+        self.jobs: dict[str, AnalysisJob] = {}
+
+    def create(
+        self,
+        total_rows: int,
+        dataset_id: str = "",
+        params: dict[str, Any] | None = None,
+        job_id: str | None = None,
+    ) -> AnalysisJob:
+        """New job, or with `job_id` one taken over from another worker's shared state"""
+        self.prune()
+        job = AnalysisJob(total_rows=total_rows, job_id=job_id)
+        if shared_state.enabled:
+            job.shared = True
+            if job_id is None:
+                shared_state.create_job(job.id, dataset_id, params or {}, job.progress())
+            else:
+                # Continue the event log and counters where the previous worker left them;
+                # its failed rows are classified again
+                job.events = [{"seq": seq, **event} for seq, event in shared_state.job_events(job_id)]
+                job.next_seq = job.events[-1]["seq"] + 1 if job.events else 0
+                job._row_events = sum(event["event"] == "row" for event in job.events)
+                previous = shared_state.job(job_id)["progress"]
+                job.done_rows = previous.get("done_rows", 0)
+                job.total_cost = previous.get("total_cost", 0.0)
+        self.jobs[job.id] = job
+        return job
+
+    def prune(self) -> None:
+        """Forget jobs that finished more than JOB_TTL_SECONDS ago"""
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+        if shared_state.enabled:
+            shared_state.delete_finished_jobs(cutoff)
+
+    def find(self, job_id: str) -> AnalysisJob | RemoteJob | None:
+        job = self.jobs.get(job_id)
+        if job is None and shared_state.enabled and shared_state.job(job_id) is not None:
+            return RemoteJob(job_id)
+        return job
+
+    def get(self, job_id: str) -> AnalysisJob | RemoteJob:
+        job = self.find(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Analysis job {job_id} not found")
+        return job
+
+
+job_manager = JobManager()
@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+
+import numpy as np
+from botocore.exceptions import ClientError
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.usage import Usage
+
+# Which LLM serves the analysis and reports: "bedrock", or "fake" for the local stand-in
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'bedrock')
+
+# Behaviour of the fake backend
+FAKE_LLM_LATENCY_MS = float(os.getenv('FAKE_LLM_LATENCY_MS', '800'))
+FAKE_LLM_LATENCY_P99_MS = float(os.getenv('FAKE_LLM_LATENCY_P99_MS', '3000'))
+FAKE_LLM_MS_PER_OUTPUT_TOKEN = float(os.getenv('FAKE_LLM_MS_PER_OUTPUT_TOKEN', '2'))
+FAKE_LLM_THROTTLE_RATE = float(os.getenv('FAKE_LLM_THROTTLE_RATE', '0.01'))
+FAKE_LLM_MALFORMED_RATE = float(os.getenv('FAKE_LLM_MALFORMED_RATE', '0.02'))
+# Requests in flight beyond this are throttled, like an account quota (0 = unlimited)
+FAKE_LLM_CAPACITY = int(os.getenv('FAKE_LLM_CAPACITY', '0'))
+FAKE_LLM_SEED = int(os.getenv('FAKE_LLM_SEED', '0'))
+
+_ROW_ID = re.compile(r"\[id: (\d+)\]")
+_Z_99 = 2.326
+
+
+class FakeLLM:
+    """Deterministic local stand-in for Bedrock, for load tests without AWS credentials
+
+    Labels are derived from a hash of the prompt, so repeated runs classify the same
+    comment the same way. Latency follows a log-normal distribution, and requests can
+    be throttled (as botocore ThrottlingException) or return malformed output. Token
+    usage is reported from the prompt and output sizes.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency_ms: float,
+        latency_p99_ms: float,
+        ms_per_output_token: float,
+        throttle_rate: float,
+        malformed_rate: float,
+        capacity: int,
+        seed: int,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = math.log(max(latency_p99_ms, latency_ms) / latency_ms) / _Z_99 if latency_ms > 0 else 0
+        self.ms_per_output_token = ms_per_output_token
+        self.throttle_rate = throttle_rate
+        self.malformed_rate = malformed_rate
+        self.capacity = capacity
+        self.seed = seed
+        self.reset()
+
+    @classmethod
+    def from_env(cls) -> "FakeLLM":
+        return cls(
+            latency_ms=FAKE_LLM_LATENCY_MS,
+            latency_p99_ms=FAKE_LLM_LATENCY_P99_MS,
+            ms_per_output_token=FAKE_LLM_MS_PER_OUTPUT_TOKEN,
+            throttle_rate=FAKE_LLM_THROTTLE_RATE,
+            malformed_rate=FAKE_LLM_MALFORMED_RATE,
+            capacity=FAKE_LLM_CAPACITY,
+            seed=FAKE_LLM_SEED,
+        )
+
+    def reset(self) -> None:
+        """Forget recorded requests and restart the random sequence"""
+        self._random = random.Random(self.seed)  # noqa: S311
+        self.in_flight = 0
+        self.latencies: list[float] = []
+        self.requests = 0
+        self.throttled = 0
+        self.malformed = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def agent_factory(self, system_prompt: str) -> Callable[..., Agent]:
+        """Agent factory with the same signature as the Bedrock one"""
+
+        def generate_fake_agent(  # noqa: PLR0917
+            model_id: str,
+            output_type: Any | None = None,
+            retries: int = 5,
+            temperature: float = 0.2,
+            max_tokens: int = 20000,
+            timeout: int = 60,
+            bedrock_client: Any = None,
+            system_prompt: str = system_prompt,
+        ) -> Agent:
+            return Agent(
+                FunctionModel(self.respond, stream_function=self.stream, model_name=model_id),
+                retries=retries,
+                output_type=output_type or str,
+                system_prompt=system_prompt,
+            )
+
+        return generate_fake_agent
+
+    async def respond(self, messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        prompt = _prompt_text(messages)
+        input_tokens = _request_size(messages, info)
+        self._admit()
+        try:
+            if info.output_tools:
+                tool = info.output_tools[0]
+                args = self._structured_output(prompt, tool.parameters_json_schema)
+                part = ToolCallPart(tool.name, args)
+                output_tokens = len(json.dumps(args, ensure_ascii=False))
+            else:
+                text = self._text_output(prompt)
+                part = TextPart(text)
+                output_tokens = len(text)
+            await self._wait(output_tokens)
+        finally:
+            self.in_flight -= 1
+        return ModelResponse(parts=[part], usage=self._usage(input_tokens, output_tokens))
+
+    async def stream(self, messages: list[ModelMessage], info: AgentInfo) -> AsyncIterator[str]:
+        prompt = _prompt_text(messages)
+        input_tokens = _request_size(messages, info)
+        self._admit()
+        try:
+            text = self._text_output(prompt)
+            # Time to first token, then the rest of the text at the per-token rate
+            await self._wait(0)
+            for start in range(0, len(text), 16):
+                await asyncio.sleep(16 * self.ms_per_output_token / 1000)
+                yield text[start:start + 16]
+            self._usage(input_tokens, len(text))
+        finally:
+            self.in_flight -= 1
+
+    def _admit(self) -> None:
+        self.requests += 1
+        over_capacity = self.capacity and self.in_flight >= self.capacity
+        if over_capacity or self._random.random() < self.throttle_rate:
+            self.throttled += 1
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests (fake backend)"}},
+                "Converse",
+            )
+        self.in_flight += 1
+
+    async def _wait(self, output_tokens: int) -> None:
+        latency = self.latency_ms * math.exp(self._random.gauss(0, self.latency_sigma)) if self.latency_ms else 0
+        latency += output_tokens * self.ms_per_output_token
+        self.latencies.append(latency / 1000)
+        await asyncio.sleep(latency / 1000)
+
+    def _usage(self, input_tokens: int, output_tokens: int) -> Usage:
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        return Usage(
+            requests=1,
+            request_tokens=input_tokens,
+            response_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+        )
+
+    def _structured_output(self, prompt: str, schema: dict[str, Any]) -> dict[str, Any]:
+        malformed = self._random.random() < self.malformed_rate
+        if malformed:
+            self.malformed += 1
+        row_ids = [int(row_id) for row_id in _ROW_ID.findall(prompt)]
+        lines = dict(zip(row_ids, re.split(r"\[id: \d+\]", prompt)[1:]))
+        args = _fake_value(schema, schema.get("$defs", {}), prompt, lines)
+        if malformed:
+            # Drop half of a batch's rows, or break a single result so validation retries it
+            for key, value in args.items():
+                if isinstance(value, list):
+                    args[key] = value[:len(value) // 2]
+                    break
+            else:
+                args = dict.fromkeys(args, "???")
+        return args
+
+    def _text_output(self, prompt: str) -> str:
+        seed = _digest(prompt)
+        if "[[POSITIVE]]" in prompt:
+            return (
+                f"[[POSITIVE]]\n講義内容の分かりやすさが評価されています。（fake {seed % 1000}）\n\n"
+                f"[[NEGATIVE]]\n資料の量と進行の速さに改善要望があります。\n\n"
+                f"[[INSIGHTS]]\n全体として満足度は高く、資料の整理が次の改善点です。"
+            )
+        return "\n".join(f"- 要約項目 {(seed >> i) % 100}（約{(seed >> i) % 20 + 1}件）" for i in range(5))
+
+    def stats(self) -> dict[str, Any]:
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "malformed": self.malformed,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "latency_p50": round(float(np.percentile(latencies, 50)), 4),
+            "latency_p99": round(float(np.percentile(latencies, 99)), 4),
+        }
+
+
+def _prompt_text(messages: list[ModelMessage]) -> str:
+    """Text of the latest request (the user prompt, or a retry prompt after invalid output)"""
+    content = messages[-1].parts[-1].content
+    if isinstance(content, (list, tuple)):
+        return "\n".join(str(item) for item in content)
+    return str(content)
+
+
+def _request_size(messages: list[ModelMessage], info: AgentInfo) -> int:
+    """Input tokens of a request: every message part plus the output tool schemas
+
+    Japanese text is roughly one token per character.
+    """
+    size = sum(len(str(getattr(part, "content", ""))) for message in messages for part in message.parts)
+    size += sum(len(json.dumps(tool.parameters_json_schema, ensure_ascii=False)) for tool in info.output_tools)
+    return size
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _fake_value(schema: dict[str, Any], defs: dict[str, Any], seed_text: str, rows: dict[int, str]) -> Any:
+    """Deterministic instance of a JSON schema; arrays of row results get one item per row id"""
+    if "$ref" in schema:
+        return _fake_value(defs[schema["$ref"].split("/")[-1]], defs, seed_text, rows)
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][_digest(seed_text) % len(schema["enum"])]
+    if schema.get("type") == "object":
+        return {
+            name: _fake_value(prop, defs, f"{name}:{seed_text}", rows)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if schema.get("type") == "array":
+        items = schema.get("items", {})
+        if "$ref" in items:
+            items = defs[items["$ref"].split("/")[-1]]
+        # The integer field of a row result (row_id, id) holds the row id
+        id_field = next(
+            (name for name, prop in items.get("properties", {}).items() if prop.get("type") == "integer"), "row_id"
+        )
+        return [{**_fake_value(items, defs, text, {}), id_field: row_id} for row_id, text in rows.items()]
+    return 0 if schema.get("type") == "integer" else "fake"
+
+
+fake_llm = FakeLLM.from_env()
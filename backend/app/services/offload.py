@@ -0,0 +1,170 @@
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import AbstractContextManager
+from typing import Any, BinaryIO
+
+import pandas as pd
+from fastapi import HTTPException
+
+from .ingest import read_upload, read_upload_path
+from .telemetry import registry
+
+# Where CPU-bound pandas work (parsing, statistics, ranking, export) runs: "thread" (a pool separate from
+# the threads of the LLM calls), "process" (uploads are also parsed in worker processes) or "inline"
+OFFLOAD_EXECUTOR = os.getenv('OFFLOAD_EXECUTOR', 'thread')
+OFFLOAD_WORKERS = int(os.getenv('OFFLOAD_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Tasks that may wait for a free worker; further requests are rejected with 503 until the queue drains
+OFFLOAD_MAX_QUEUED = int(os.getenv('OFFLOAD_MAX_QUEUED', '32'))
+
+OFFLOAD_MODES = ("thread", "process", "inline")
+
+_DONE = object()
+
+
+def _locked(lock: AbstractContextManager, call: Callable[[], Any]) -> Any:
+    with lock:
+        return call()
+
+
+def _save_to_temp(file: BinaryIO) -> str:
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="upload-", delete=False) as f:
+        shutil.copyfileobj(file, f)
+        return f.name
+
+
+class Offloader:
+    """Runs CPU-bound work in a bounded pool so the event loop keeps serving requests
+
+    At most `workers` tasks run at once and `max_queued` more wait; beyond that, new work
+    is rejected with 503 (back-pressure). A cancelled caller drops its task if it has not
+    started yet; streamed work stops at the next chunk.
+    """
+
+    def __init__(self, mode: str, workers: int, max_queued: int):
+        if mode not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown OFFLOAD_EXECUTOR: {mode}")
+        self.mode = mode
+        self.workers = max(workers, 1)
+        self.max_queued = max_queued
+        self.pending = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+        self._threads: concurrent.futures.ThreadPoolExecutor | None = None
+        self._processes: concurrent.futures.ProcessPoolExecutor | None = None
+
+    def _thread_pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="offload")
+        return self._threads
+
+    def _process_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._processes is None:
+            # Forking a process that runs threads can deadlock; start clean interpreters instead
+            self._processes = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._processes
+
+    def _finished(self, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    async def _submit(self, executor: concurrent.futures.Executor, func: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            if self.pending >= self.workers + self.max_queued:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503, detail="Server is busy. Please try again later.", headers={"Retry-After": "1"}
+                )
+            self.pending += 1
+        future = executor.submit(func, *args)
+        # Counted until the work really ends, even if the caller stopped waiting for it
+        future.add_done_callback(self._finished)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Work that has not started yet is dropped; running work cannot be interrupted
+            if future.cancel():
+                self.cancelled += 1
+            raise
+
+    async def run(
+        self, func: Callable[..., Any], *args: Any, lock: AbstractContextManager | None = None, **kwargs: Any
+    ) -> Any:
+        """Result of func(*args, **kwargs) computed in the thread pool, holding `lock` if given"""
+        call = functools.partial(func, *args, **kwargs)
+        if lock is not None:
+            call = functools.partial(_locked, lock, call)
+        if self.mode == "inline":
+            return call()
+        return await self._submit(self._thread_pool(), call)
+
+    async def iterate(self, chunks: Iterator[Any], lock: AbstractContextManager | None = None) -> AsyncIterator[Any]:
+        """Produce each item of a synchronous iterator in the thread pool
+
+        When the consumer stops early (e.g. the client disconnected) the iterator is closed
+        after the chunk in progress.
+        """
+        if self.mode == "inline":
+            for chunk in chunks:
+                yield chunk
+            return
+        # Also serializes closing the iterator with a next() that may still be running
+        guard = threading.Lock()
+        step = functools.partial(next, chunks, _DONE)
+        if lock is not None:
+            step = functools.partial(_locked, lock, step)
+        try:
+            while True:
+                chunk = await self._submit(self._thread_pool(), _locked, guard, step)
+                if chunk is _DONE:
+                    return
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                self._thread_pool().submit(_locked, guard, close)
+
+    async def read_upload(self, file: BinaryIO, filename: str) -> pd.DataFrame:
+        """Parse a CSV or XLSX upload (in a worker process when OFFLOAD_EXECUTOR is "process")"""
+        if self.mode != "process":
+            return await self.run(read_upload, file, filename)
+        path = await self.run(_save_to_temp, file)
+        try:
+            return await self._submit(self._process_pool(), read_upload_path, path, filename)
+        except concurrent.futures.BrokenExecutor:
+            # A worker died (e.g. out of memory); start a new pool for the next upload
+            self._processes = None
+            raise
+        finally:
+            os.remove(path)
+
+    def shutdown(self) -> None:
+        for pool in (self._threads, self._processes):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._threads = self._processes = None
+
+
+offloader = Offloader(OFFLOAD_EXECUTOR, OFFLOAD_WORKERS, OFFLOAD_MAX_QUEUED)
+
+registry.callback(
+    "offload_pending_tasks", "CPU-bound tasks running or queued in the offload pool", lambda: offloader.pending
+)
+registry.callback(
+    "offload_rejected_total", "CPU-bound tasks rejected because the offload queue was full",
+    lambda: offloader.rejected, kind="counter",
+)
+registry.callback(
+    "offload_cancelled_total", "Queued CPU-bound tasks dropped because their caller went away",
+    lambda: offloader.cancelled, kind="counter",
+)
@@ -0,0 +1,69 @@
+
+import numpy as np
+from fastapi import HTTPException
+
+
+class RankingIndex:
+    """Row positions pre-sorted by score, overall and for every category/sentiment filter
+
+    Orders are stable (ties keep row order), matching `nlargest(keep='first')`, so the
+    top k of any filter is a slice of a precomputed array.
+    """
+
+    def __init__(
+        self,
+        scores: np.ndarray,
+        category_codes: np.ndarray,
+        sentiment_codes: np.ndarray,
+        categories: list[str],
+        sentiments: list[str],
+    ):
+        order = np.argsort(-scores.astype(np.int16), kind='stable').astype(np.int32)
+        ranked_categories = category_codes[order]
+        ranked_sentiments = sentiment_codes[order]
+
+        self._orders: dict[tuple[str | None, str | None], np.ndarray] = {(None, None): order}
+        for i, category in enumerate(categories):
+            self._orders[(category, None)] = order[ranked_categories == i]
+        for j, sentiment in enumerate(sentiments):
+            in_sentiment = ranked_sentiments == j
+            self._orders[(None, sentiment)] = order[in_sentiment]
+            for i, category in enumerate(categories):
+                self._orders[(category, sentiment)] = order[in_sentiment & (ranked_categories == i)]
+
+        # Categories that occur, in order of first appearance in the data (one scan per category
+        # instead of sorting every row's code)
+        first_rows = {
+            category: int(np.argmax(category_codes == i))
+            for i, category in enumerate(categories)
+            if len(self._orders[(category, None)])
+        }
+        self.categories_in_order = sorted(first_rows, key=first_rows.get)
+
+    def ranked(self, category: str | None = None, sentiment: str | None = None) -> np.ndarray:
+        """All row positions matching the filters, best first"""
+        order = self._orders.get((category, sentiment))
+        if order is None:
+            raise HTTPException(status_code=400, detail="Unknown category or sentiment filter")
+        return order
+
+    def top(self, k: int, category: str | None = None, sentiment: str | None = None) -> np.ndarray:
+        """Positions of the k best rows matching the filters"""
+        return self.ranked(category, sentiment)[:k]
+
+
+def encode_cursor(version: int, offset: int) -> str:
+    return f"{version}.{offset}"
+
+
+def decode_cursor(cursor: str, version: int) -> int:
+    """Offset stored in a cursor, rejecting cursors issued for an older version of the dataset"""
+    try:
+        cursor_version, offset = (int(part) for part in cursor.split("."))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+    if cursor_version != version or offset < 0:
+        raise HTTPException(
+            status_code=409, detail="Cursor has expired because the dataset changed. Please start over."
+        )
+    return offset
@@ -0,0 +1,284 @@
+import asyncio
+import contextlib
+import random
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from typing import Any, TypeVar
+
+from .telemetry import LLM_REQUEST_SECONDS, LLM_WAIT_SECONDS, span
+
+T = TypeVar('T')
+
+HTTP_TOO_MANY_REQUESTS = 429
+
+# Error codes Bedrock (botocore) uses when a request is rejected for quota reasons
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+}
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """Whether an exception raised by an LLM call means the request was throttled"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+        if code in THROTTLING_ERROR_CODES:
+            return True
+    if getattr(error, 'status_code', None) == HTTP_TOO_MANY_REQUESTS:
+        return True
+    return any(code in str(error) for code in THROTTLING_ERROR_CODES)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second
+
+    A non-positive rate disables the limit.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """Wait until `amount` tokens are available and take them"""
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Take (or give back, if negative) tokens once the real cost of a request is known"""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit with additive increase / multiplicative decrease (AIMD)
+
+    Every successful request grows the limit by 1/limit (about +1 per round trip of
+    requests); a throttled request halves it, at most once per cooldown period.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, cooldown: float = 2.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self) -> None:
+        """Wait for a free concurrency slot"""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self) -> None:
+        """Give a slot back"""
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self) -> None:
+        """Additive increase after a healthy request"""
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_throttle(self) -> None:
+        """Multiplicative decrease after a throttled request"""
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class RequestScheduler:
+    """Rate limiter for LLM requests
+
+    Combines a requests/sec token bucket, a tokens/min token bucket and an adaptive
+    concurrency limit, and retries throttled requests with jittered exponential backoff.
+    Every attempt is timed into the LLM metrics under the `model` it is run for.
+    """
+
+    def __init__(
+        self,
+        *,
+        requests_per_second: float,
+        tokens_per_minute: float,
+        initial_concurrency: int,
+        max_concurrency: int,
+        max_retries: int = 6,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+    ):
+        self.requests = TokenBucket(rate=requests_per_second, capacity=requests_per_second)
+        self.tokens = TokenBucket(rate=tokens_per_minute / 60, capacity=tokens_per_minute / 6)
+        self.concurrency = AdaptiveConcurrency(initial=initial_concurrency, minimum=1, maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.throttle_count = 0
+        self.retry_count = 0
+        # Requests waiting for a rate limit or a concurrency slot
+        self.waiting = 0
+
+    async def _acquire(self, estimated_tokens: int, model: str) -> None:
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+            await self.concurrency.acquire()
+        finally:
+            self.waiting -= 1
+        LLM_WAIT_SECONDS.observe(time.monotonic() - started, model=model)
+
+    async def run(self, call: Callable[[], Awaitable[T]], estimated_tokens: int = 0, model: str = '') -> T:
+        """Run an LLM call under the rate limits, retrying it while it is throttled"""
+        attempt = 0
+        while True:
+            await self._acquire(estimated_tokens, model)
+            started = time.monotonic()
+            outcome = 'error'
+            try:
+                with span('llm.request', model=model, attempt=attempt, estimated_tokens=estimated_tokens):
+                    result = await call()
+                outcome = 'ok'
+            except Exception as e:
+                if not is_throttling_error(e):
+                    raise
+                outcome = 'throttled'
+                self.throttle_count += 1
+                self.concurrency.on_throttle()
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                self.concurrency.on_success()
+                self._settle_tokens(result, estimated_tokens)
+                return result
+            finally:
+                LLM_REQUEST_SECONDS.observe(time.monotonic() - started, model=model, outcome=outcome)
+                self.concurrency.release()
+
+            attempt += 1
+            self.retry_count += 1
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))  # noqa: S311
+
+    @contextlib.asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0, model: str = '') -> AsyncIterator[Callable[[Any], None]]:
+        """Hold one request slot for the duration of a streamed response
+
+        Streams are not retried, since their output may already have been forwarded;
+        call the yielded function with the finished result to account its actual usage.
+        """
+        await self._acquire(estimated_tokens, model)
+        started = time.monotonic()
+        outcome = 'error'
+        try:
+            with span('llm.stream', model=model, estimated_tokens=estimated_tokens):
+                yield lambda result: self._settle_tokens(result, estimated_tokens)
+        except Exception as e:
+            if is_throttling_error(e):
+                outcome = 'throttled'
+                self.throttle_count += 1
+                self.concurrency.on_throttle()
+            raise
+        else:
+            outcome = 'ok'
+            self.concurrency.on_success()
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, model=model, outcome=outcome)
+            self.concurrency.release()
+
+    def _settle_tokens(self, result: Any, estimated_tokens: int) -> None:
+        # Replace the estimate with the actual usage reported by the model
+        usage = getattr(result, 'usage', None)
+        if callable(usage):
+            total_tokens = usage().total_tokens or 0
+            self.tokens.adjust(total_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        """Current limiter state"""
+        return {
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "waiting": self.waiting,
+            "throttle_count": self.throttle_count,
+            "retry_count": self.retry_count,
+        }
+
+
+async def run_bounded(
+    items: Iterable[Any],
+    worker: Callable[[Any], Awaitable[Any]],
+    num_workers: int,
+    queue_size: int | None = None,
+) -> list[Any]:
+    """Apply `worker` to every item using a fixed set of tasks fed by a bounded queue
+
+    Results keep the order of `items`; an exception raised for an item is returned in
+    its place, like `asyncio.gather(..., return_exceptions=True)`.
+    """
+    items = list(items)
+    results: list[Any] = [None] * len(items)
+    if not items:
+        return results
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or num_workers * 2)
+
+    async def consume() -> None:
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            i, item = entry
+            try:
+                results[i] = await worker(item)
+            except Exception as e:  # noqa: BLE001
+                results[i] = e
+
+    consumers = [asyncio.create_task(consume()) for _ in range(max(1, min(num_workers, len(items))))]
+    try:
+        for entry in enumerate(items):
+            await queue.put(entry)
+        for _ in consumers:
+            await queue.put(None)
+        await asyncio.gather(*consumers)
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+
+    return results
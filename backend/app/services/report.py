@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any
+
+from .dedup import group_duplicate_comments, normalize_comment
+
+# Approximate size (characters) of the comments sent in one map (chunk summary) request
+REPORT_CHUNK_TOKENS = int(os.getenv('REPORT_CHUNK_TOKENS', '6000'))
+# Largest set of summaries sent to the final Nova Pro request; larger sets are merged first
+REPORT_REDUCE_TOKENS = int(os.getenv('REPORT_REDUCE_TOKENS', '24000'))
+# Maximum concurrent chunk summary requests
+REPORT_MAP_CONCURRENCY = int(os.getenv('REPORT_MAP_CONCURRENCY', '16'))
+
+REPORT_MAP_MODEL_ID = "amazon.nova-lite-v1:0"
+REPORT_REDUCE_MODEL_ID = "amazon.nova-pro-v1:0"
+
+# Marker line starting each report section, and the response field it fills
+SECTION_MARKERS = {
+    '[[POSITIVE]]': 'positive_summary',
+    '[[NEGATIVE]]': 'negative_summary',
+    '[[INSIGHTS]]': 'overall_insights',
+}
+
+REPORT_SECTIONS_INSTRUCTIONS = """以下の形式でレポートを作成してください。\
+各セクションは、指定された見出し行（[[POSITIVE]] など）だけの行から始めてください：
+
+[[POSITIVE]]
+ポジティブな意見のまとめ：受講者から評価されている点を具体的にまとめてください。共通するテーマや特に評価の高い要素を抽出し、講義の強みを明確にしてください。
+
+[[NEGATIVE]]
+ネガティブな意見のまとめ：受講者が改善を求めている点を具体的にまとめてください。共通する課題や問題点を抽出し、優先度の高い改善項目を明確にしてください。
+
+[[INSIGHTS]]
+総合的な洞察：ポジティブとネガティブな意見を総合して、講義全体の評価と今後の改善方向性について洞察を提供してください。具体的な改善提案も含めてください。
+
+各セクションは段落形式で、読みやすく構造化してください。
+"""
+
+TOP_REPORT_TEMPLATE = """
+以下は講義に関するフィードバックコメントのトップ50件です。これらのコメントを分析して、包括的なレポートを作成してください。
+
+ポジティブなコメント（{positive_count}件）:
+{positive_comments}
+
+ネガティブなコメント（{negative_count}件）:
+{negative_comments}
+
+{instructions}"""
+
+MAP_TEMPLATE = """
+以下は講義に関するフィードバックのうち、カテゴリ「{category}」・感情「{sentiment}」のコメントです。
+（×N は同じ内容のコメントがN件あることを示します）
+
+{comments}
+
+これらのコメントに含まれる主な意見・具体的な要望・繰り返し現れるテーマを、件数の多いものから順に箇条書きで簡潔に要約してください。
+各項目にはおおよその件数を添えてください。
+"""
+
+MERGE_TEMPLATE = """
+以下は講義に関するフィードバックコメントの部分要約です。
+
+{summaries}
+
+これらの要約を統合し、重複する意見をまとめた一つの要約を箇条書きで作成してください。
+各項目のおおよその件数とカテゴリ・感情は保持してください。
+"""
+
+REDUCE_TEMPLATE = """
+以下は講義に関するフィードバックコメント全{total_comments}件（{counts}）を、カテゴリと感情ごとに要約したものです。これらの要約を分析して、包括的なレポートを作成してください。
+
+{summaries}
+
+{instructions}"""
+
+_MARKER_PATTERN = re.compile(r"\[\[(POSITIVE|NEGATIVE|INSIGHTS)\]\]")
+
+# Cached reports are invalidated whenever any report prompt changes
+REPORT_PROMPT_VERSION = hashlib.sha256(
+    f"{REPORT_SECTIONS_INSTRUCTIONS}\x1f{TOP_REPORT_TEMPLATE}\x1f{MAP_TEMPLATE}\x1f{MERGE_TEMPLATE}\x1f"
+    f"{REDUCE_TEMPLATE}\x1f{REPORT_MAP_MODEL_ID}\x1f{REPORT_REDUCE_MODEL_ID}".encode()
+).hexdigest()[:12]
+
+
+def comment_text(comment: str) -> str:
+    """Answers of a row's combined comment JSON joined into one line"""
+    try:
+        fields = json.loads(comment)
+    except (TypeError, ValueError):
+        return str(comment)
+    if not isinstance(fields, dict):
+        return str(comment)
+    return " / ".join(str(value).replace("\n", " ") for value in fields.values())
+
+
+def chunk_comments(entries: list[dict[str, Any]], budget: int = REPORT_CHUNK_TOKENS) -> list[dict[str, Any]]:
+    """Split comments into chunks of one category and sentiment, each within `budget` characters
+
+    `entries` are expected best-first (ranking order). Duplicate comments are sent once
+    with their count, and rows without content are skipped.
+    """
+    groups: dict[tuple, list[dict[str, Any]]] = {}
+    for entry in entries:
+        groups.setdefault((entry["category"], entry["sentiment"]), []).append(entry)
+
+    chunks = []
+    for (category, sentiment), members in groups.items():
+        lines = []
+        for duplicates in group_duplicate_comments([entry["comment"] for entry in members]):
+            first = members[duplicates[0]]["comment"]
+            if normalize_comment(first) == "{}":
+                continue
+            text = comment_text(first)[:budget]
+            lines.append(f"- {text}" + (f" (×{len(duplicates)})" if len(duplicates) > 1 else ""))
+
+        current: list[str] = []
+        size = 0
+        for line in lines:
+            if current and size + len(line) > budget:
+                chunks.append({"category": category, "sentiment": sentiment, "lines": current})
+                current, size = [], 0
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            chunks.append({"category": category, "sentiment": sentiment, "lines": current})
+    return chunks
+
+
+def top_report_prompt(positive_comments: list[str], negative_comments: list[str]) -> str:
+    return TOP_REPORT_TEMPLATE.format(
+        positive_count=len(positive_comments),
+        positive_comments=chr(10).join(f"- {comment}" for comment in positive_comments[:25]),
+        negative_count=len(negative_comments),
+        negative_comments=chr(10).join(f"- {comment}" for comment in negative_comments[:25]),
+        instructions=REPORT_SECTIONS_INSTRUCTIONS,
+    )
+
+
+def map_prompt(chunk: dict[str, Any]) -> str:
+    return MAP_TEMPLATE.format(
+        category=chunk['category'], sentiment=chunk['sentiment'], comments=chr(10).join(chunk['lines'])
+    )
+
+
+def merge_prompt(summaries: list[str]) -> str:
+    return MERGE_TEMPLATE.format(summaries=chr(10).join(summaries))
+
+
+def reduce_prompt(summaries: list[str], total_comments: int, sentiment_counts: dict[str, int]) -> str:
+    return REDUCE_TEMPLATE.format(
+        total_comments=total_comments,
+        counts="、".join(f"{sentiment} {count}件" for sentiment, count in sentiment_counts.items()),
+        summaries=chr(10).join(summaries),
+        instructions=REPORT_SECTIONS_INSTRUCTIONS,
+    )
+
+
+def pack_summaries(summaries: list[str], budget: int) -> list[list[str]]:
+    """Group summaries into batches of at most `budget` characters"""
+    batches: list[list[str]] = []
+    size = 0
+    for summary in summaries:
+        if not batches or (batches[-1] and size + len(summary) > budget):
+            batches.append([])
+            size = 0
+        batches[-1].append(summary)
+        size += len(summary)
+    return batches
+
+
+def parse_report_sections(report_text: str) -> dict[str, str]:
+    """Split the model's report into its positive, negative and insights sections"""
+    sections = dict.fromkeys(SECTION_MARKERS.values(), "")
+    parts = _MARKER_PATTERN.split(report_text)
+    if len(parts) == 1:
+        return _parse_numbered_sections(report_text)
+
+    # parts alternates text and marker names: [preamble, marker, text, marker, text, ...]
+    for marker, text in zip(parts[1::2], parts[2::2]):
+        field = SECTION_MARKERS[f"[[{marker}]]"]
+        sections[field] = (sections[field] + "\n\n" + text.strip()).strip()
+    return sections
+
+
+def _parse_numbered_sections(report_text: str) -> dict[str, str]:
+    # Fallback for reports written without section markers ("1. ポジティブな意見のまとめ：" ...)
+    sections = report_text.split('\n\n')
+
+    positive_summary = ""
+    negative_summary = ""
+    overall_insights = ""
+
+    current_section = ""
+    for section in sections:
+        if "ポジティブな意見" in section or "1." in section:
+            current_section = "positive"
+            positive_summary += section.replace("1. ポジティブな意見のまとめ：", "").strip() + "\n\n"
+        elif "ネガティブな意見" in section or "2." in section:
+            current_section = "negative"
+            negative_summary += section.replace("2. ネガティブな意見のまとめ：", "").strip() + "\n\n"
+        elif "総合的な洞察" in section or "3." in section:
+            current_section = "insights"
+            overall_insights += section.replace("3. 総合的な洞察：", "").strip() + "\n\n"
+        elif current_section == "positive":
+            positive_summary += section + "\n\n"
+        elif current_section == "negative":
+            negative_summary += section + "\n\n"
+        elif current_section == "insights":
+            overall_insights += section + "\n\n"
+
+    return {
+        "positive_summary": positive_summary.strip(),
+        "negative_summary": negative_summary.strip(),
+        "overall_insights": overall_insights.strip(),
+    }
+
+
+class SectionStream:
+    """Splits streamed report text into section changes and text deltas as it arrives
+
+    A marker may be split across chunks, so text that could be the start of one is
+    held back until the next chunk decides it.
+    """
+
+    def __init__(self):
+        self.section: str | None = None
+        self._pending = ""
+        self._section_start = False
+
+    def feed(self, text: str) -> list[dict[str, Any]]:
+        """Events ({"event": "section"|"delta", "data": ...}) for the next chunk of text"""
+        buffer = self._pending + text
+        self._pending = ""
+        events: list[dict[str, Any]] = []
+        while buffer:
+            start = buffer.find("[[")
+            if start < 0:
+                # A trailing "[" may be the first half of a marker
+                keep = 1 if buffer.endswith("[") else 0
+                self._emit(events, buffer[:len(buffer) - keep])
+                self._pending = buffer[len(buffer) - keep:]
+                break
+
+            self._emit(events, buffer[:start])
+            rest = buffer[start:]
+            marker = next((marker for marker in SECTION_MARKERS if rest.startswith(marker)), None)
+            if marker is not None:
+                self.section = SECTION_MARKERS[marker]
+                self._section_start = True
+                events.append({"event": "section", "data": {"section": self.section}})
+                buffer = rest[len(marker):]
+            elif any(marker.startswith(rest) for marker in SECTION_MARKERS):
+                self._pending = rest
+                break
+            else:
+                self._emit(events, "[[")
+                buffer = rest[2:]
+        return events
+
+    def flush(self) -> list[dict[str, Any]]:
+        """Events for text held back at the end of the stream"""
+        events: list[dict[str, Any]] = []
+        self._emit(events, self._pending)
+        self._pending = ""
+        return events
+
+    def _emit(self, events: list[dict[str, Any]], text: str) -> None:
+        if self._section_start:
+            # Drop the line break after a marker
+            text = text.lstrip()
+            self._section_start = not text
+        if text:
+            events.append({"event": "delta", "data": {"section": self.section, "text": text}})
@@ -0,0 +1,321 @@
+import json
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any
+
+# Directory on a volume shared by all workers; '' keeps datasets and jobs in each process (single worker)
+SHARED_STATE_DIR = os.getenv('SHARED_STATE_DIR', '')
+# Leases on datasets and jobs not renewed for this long are taken over by other workers
+SHARED_LEASE_SECONDS = float(os.getenv('SHARED_LEASE_SECONDS', '30'))
+
+# Identifies this process as the holder of leases and the owner of jobs
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+ACTIVE_JOB_STATUSES = ("queued", "running")
+# "?, ?" for binding ACTIVE_JOB_STATUSES in an IN (...) clause
+_ACTIVE_STATUS_PLACEHOLDERS = ", ".join("?" * len(ACTIVE_JOB_STATUSES))
+
+
+class SharedState:
+    """Datasets, leases and analysis jobs shared by the workers serving the API
+
+    Dataset snapshots are pickled next to a SQLite database (WAL) holding their versions,
+    the leases that serialize mutations across workers and each job's progress and events.
+    """
+
+    def __init__(self, directory: str, lease_seconds: float):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.join(self.directory, "datasets"), exist_ok=True)
+            self._conn = sqlite3.connect(
+                os.path.join(self.directory, "state.sqlite3"), timeout=30, check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS datasets ("
+                " dataset_id TEXT PRIMARY KEY,"
+                " upload_id TEXT NOT NULL,"
+                " version INTEGER NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " total_rows INTEGER NOT NULL,"
+                " analyzed INTEGER NOT NULL,"
+                " updated_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " name TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " expires_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " dataset_id TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " progress TEXT NOT NULL,"
+                " owner TEXT NOT NULL,"
+                " lease_expires REAL NOT NULL,"
+                " finished_at REAL);"
+                "CREATE INDEX IF NOT EXISTS jobs_dataset ON jobs (dataset_id, status);"
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                " job_id TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " event TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (job_id, seq));"
+                "CREATE TABLE IF NOT EXISTS alert_rules ("
+                " rule_id TEXT PRIMARY KEY,"
+                " rule TEXT NOT NULL);"
+            )
+            # When the job completed or failed, so finished jobs can be pruned
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "finished_at" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN finished_at REAL")
+        return self._conn
+
+    def _snapshot_path(self, dataset_id: str) -> str:
+        return os.path.join(self.directory, "datasets", f"{dataset_id}.pkl")
+
+    # Datasets
+
+    def save_dataset(self, dataset_id: str, service: Any) -> None:
+        """Publish a dataset's current state to the other workers"""
+        path = self._snapshot_path(dataset_id)
+        self._connection()
+        # Written under a temporary name and renamed so readers never see a partial file
+        temp_path = f"{path}.{WORKER_ID}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(service, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO datasets"
+                " (dataset_id, upload_id, version, filename, total_rows, analyzed, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    dataset_id, service.upload_id, service.version, service.filename,
+                    len(service.csv_data), int(service.analyzed), time.time(),
+                ),
+            )
+            conn.commit()
+
+    def dataset_version(self, dataset_id: str) -> tuple[str, int] | None:
+        """(upload id, version) of the latest saved state of a dataset, or None if there is none"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT upload_id, version FROM datasets WHERE dataset_id = ?", (dataset_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def load_dataset(self, dataset_id: str, unless: tuple[str, int] | None = None) -> Any | None:
+        """Latest saved state of a dataset; None if there is none or it is still at version `unless`"""
+        saved = self.dataset_version(dataset_id)
+        if saved is None or saved == unless:
+            return None
+        try:
+            # Only files written by save_dataset live here
+            with open(self._snapshot_path(dataset_id), "rb") as f:
+                return pickle.load(f)  # noqa: S301
+        except FileNotFoundError:
+            return None
+
+    def delete_dataset(self, dataset_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM datasets WHERE dataset_id = ?", (dataset_id,))
+            conn.commit()
+        try:
+            os.remove(self._snapshot_path(dataset_id))
+        except FileNotFoundError:
+            pass
+
+    def list_datasets(self) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT dataset_id, filename, total_rows, analyzed, updated_at FROM datasets ORDER BY dataset_id"
+            ).fetchall()
+        return [
+            {"dataset_id": dataset_id, "filename": filename, "total_rows": total_rows,
+             "analyzed": bool(analyzed), "updated_at": updated_at}
+            for dataset_id, filename, total_rows, analyzed, updated_at in rows
+        ]
+
+    # Leases
+
+    def acquire(self, name: str) -> bool:
+        """Take the lease `name` unless another worker holds it"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+                (name, WORKER_ID, now + self.lease_seconds, now),
+            )
+            conn.commit()
+        return cursor.rowcount == 1
+
+    def held_elsewhere(self, name: str) -> bool:
+        """Whether another worker currently holds the lease `name`"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT 1 FROM leases WHERE name = ? AND owner != ? AND expires_at >= ?",
+                (name, WORKER_ID, time.time()),
+            ).fetchone()
+        return row is not None
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, WORKER_ID))
+            conn.commit()
+
+    def renew(self) -> None:
+        """Extend the leases and active jobs of this worker; called periodically while it is alive"""
+        expires_at = time.time() + self.lease_seconds
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE leases SET expires_at = ? WHERE owner = ?", (expires_at, WORKER_ID))
+            conn.execute(
+                f"UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status IN ({_ACTIVE_STATUS_PLACEHOLDERS})",  # noqa: S608
+                (expires_at, WORKER_ID, *ACTIVE_JOB_STATUSES),
+            )
+            conn.commit()
+
+    # Jobs
+
+    def create_job(self, job_id: str, dataset_id: str, params: dict[str, Any], progress: dict[str, Any]) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO jobs (job_id, dataset_id, status, params, progress, owner, lease_expires)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, dataset_id, progress["status"], json.dumps(params), json.dumps(progress),
+                    WORKER_ID, time.time() + self.lease_seconds,
+                ),
+            )
+            conn.commit()
+
+    def save_job(self, job_id: str, progress: dict[str, Any], events: list[dict[str, Any]]) -> None:
+        """Record a job's progress and the events ({"seq", "event", "data"}) published since the last save"""
+        finished_at = None if progress["status"] in ACTIVE_JOB_STATUSES else time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_events (job_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                [
+                    (job_id, event["seq"], event["event"], json.dumps(event["data"], ensure_ascii=False))
+                    for event in events
+                ],
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, finished_at = ? WHERE job_id = ?",
+                (progress["status"], json.dumps(progress, ensure_ascii=False), finished_at, job_id),
+            )
+            conn.commit()
+
+    def delete_job_events(self, job_id: str, event: str, before: int) -> None:
+        """Remove a job's events of one type numbered below `before` (e.g. row events no longer replayed)"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM job_events WHERE job_id = ? AND event = ? AND seq < ?", (job_id, event, before))
+            conn.commit()
+
+    def delete_finished_jobs(self, before: float) -> None:
+        """Remove jobs that finished before `before`, with their events"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT job_id FROM jobs WHERE finished_at < ?)", (before,)
+            )
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (before,))
+            conn.commit()
+
+    def job(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT dataset_id, status, params, progress, owner FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        dataset_id, status, params, progress, owner = row
+        return {
+            "job_id": job_id, "dataset_id": dataset_id, "status": status,
+            "params": json.loads(params), "progress": json.loads(progress), "owner": owner,
+        }
+
+    def active_job(self, dataset_id: str) -> str | None:
+        """Id of the queued or running job of a dataset, if any"""
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT job_id FROM jobs WHERE dataset_id = ? AND status IN ({_ACTIVE_STATUS_PLACEHOLDERS})",  # noqa: S608
+                (dataset_id, *ACTIVE_JOB_STATUSES),
+            ).fetchone()
+        return row[0] if row else None
+
+    def job_events(self, job_id: str, after: int = -1) -> list[tuple[int, dict[str, Any]]]:
+        """(seq, event) of a job's events after sequence number `after`"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+        return [(seq, {"event": event, "data": json.loads(data)}) for seq, event, data in rows]
+
+    def claim_orphaned_jobs(self) -> list[dict[str, Any]]:
+        """Take over active jobs whose worker stopped renewing them (and their dataset's lease)"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            candidates = conn.execute(
+                f"SELECT job_id, owner FROM jobs WHERE status IN ({_ACTIVE_STATUS_PLACEHOLDERS}) AND lease_expires < ?"  # noqa: S608
+                " AND NOT EXISTS (SELECT 1 FROM leases WHERE leases.name = jobs.dataset_id AND expires_at >= ?)",
+                (*ACTIVE_JOB_STATUSES, now, now),
+            ).fetchall()
+            claimed = []
+            for job_id, owner in candidates:
+                # Only one worker wins the compare-and-swap on the previous owner
+                cursor = conn.execute(
+                    "UPDATE jobs SET owner = ?, lease_expires = ? WHERE job_id = ? AND owner = ?",
+                    (WORKER_ID, now + self.lease_seconds, job_id, owner),
+                )
+                if cursor.rowcount == 1:
+                    claimed.append(job_id)
+            conn.commit()
+        return [self.job(job_id) for job_id in claimed]
+
+    # Alert rules
+
+    def alert_rules(self) -> list[tuple[str, str]]:
+        """(rule id, rule JSON) of every saved alert rule"""
+        with self._lock:
+            return self._connection().execute("SELECT rule_id, rule FROM alert_rules ORDER BY rowid").fetchall()
+
+    def save_alert_rule(self, rule_id: str, rule: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO alert_rules (rule_id, rule) VALUES (?, ?)", (rule_id, rule))
+            conn.commit()
+
+    def delete_alert_rule(self, rule_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM alert_rules WHERE rule_id = ?", (rule_id,))
+            conn.commit()
+
+
+shared_state = SharedState(SHARED_STATE_DIR, SHARED_LEASE_SECONDS)
@@ -0,0 +1,250 @@
+import contextlib
+import functools
+import logging
+import math
+import os
+import threading
+from collections.abc import Callable, Iterator, Sequence
+from typing import Any
+
+# Where OpenTelemetry spans go: "none", "console", "memory" (kept in process, for tests) or "otlp"
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+# Level of the application's log messages (DEBUG, INFO, WARNING, ...)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Histogram buckets (seconds) wide enough for both pandas handlers and slow LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelValues = tuple[str, ...]
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base of the metric types: a name, help text and values per label combination"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        """(suffix, formatted labels, value) of every sample"""
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        with self._lock:
+            return [("", _format_labels(self.label_names, key), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: count of observations in each bucket (plus +Inf), and their sum
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels: Any) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        samples = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                cumulative = 0
+                for bound, count in zip((*self.buckets, math.inf), counts):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    samples.append(("_bucket", _format_labels(self.label_names, key, le), cumulative))
+                samples.append(("_sum", _format_labels(self.label_names, key), self._sums[key]))
+                samples.append(("_count", _format_labels(self.label_names, key), cumulative))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """Gauge or counter read from a function at scrape time (e.g. the rate limiter's state)"""
+
+    def __init__(self, name: str, help_text: str, kind: str, read: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.kind = kind
+        self.read = read
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        return [("", "", float(self.read()))]
+
+
+class Registry:
+    """Metrics exposed on /metrics in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Histogram:
+        return self.register(Histogram(name, help_text, labels))
+
+    def callback(self, name: str, help_text: str, read: Callable[[], float], kind: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help_text, kind, read))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+LLM_REQUEST_SECONDS = registry.histogram(
+    "llm_request_duration_seconds", "Duration of each LLM request attempt", labels=("model", "outcome")
+)
+LLM_WAIT_SECONDS = registry.histogram(
+    "llm_rate_limit_wait_seconds", "Time LLM requests waited for the rate limiter", labels=("model",)
+)
+LLM_TOKENS = registry.counter("llm_tokens_total", "Tokens used by LLM requests", labels=("model", "direction"))
+LLM_COST = registry.counter("llm_cost_dollars_total", "Estimated LLM cost in USD", labels=("model",))
+ANALYSIS_ROWS = registry.counter(
+    "analysis_rows_total", "Rows labeled by the analysis, by where the labels came from", labels=("source",)
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests until the response starts",
+    labels=("method", "route", "status"),
+)
+ERRORS = registry.counter(
+    "errors_total", "Errors logged and recovered from (failed rows, background tasks), by component",
+    labels=("component",),
+)
+
+
+def record_llm_usage(model: str, input_tokens: int, output_tokens: int, cost: float) -> None:
+    LLM_TOKENS.inc(input_tokens, model=model, direction="input")
+    LLM_TOKENS.inc(output_tokens, model=model, direction="output")
+    LLM_COST.inc(cost, model=model)
+
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+    """Send the application's log messages to stderr (uvicorn only configures its own loggers)"""
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+_tracer: Any | None = None
+span_exporter: Any | None = None
+
+
+def configure_tracing(exporter: str = TRACING_EXPORTER) -> None:
+    """Send spans to the configured exporter; tracing stays off without opentelemetry-sdk"""
+    global _tracer, span_exporter  # noqa: PLW0603
+    if exporter == 'none':
+        return
+    # opentelemetry is optional, so it is only imported when tracing is configured
+    try:
+        from opentelemetry.sdk.resources import Resource  # noqa: PLC0415
+        from opentelemetry.sdk.trace import TracerProvider  # noqa: PLC0415
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor  # noqa: PLC0415
+    except ImportError:
+        logger.warning("TRACING_EXPORTER is set but opentelemetry-sdk is not installed; tracing is disabled")
+        return
+
+    if exporter == 'console':
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter  # noqa: PLC0415
+        span_exporter, processor = ConsoleSpanExporter(), SimpleSpanProcessor
+    elif exporter == 'memory':
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter  # noqa: PLC0415
+        span_exporter, processor = InMemorySpanExporter(), SimpleSpanProcessor
+    elif exporter == 'otlp':
+        # Endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* variables
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter  # noqa: PLC0415
+        span_exporter, processor = OTLPSpanExporter(), BatchSpanProcessor
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER: {exporter}")
+
+    provider = TracerProvider(resource=Resource.create({"service.name": "comment-picker-backend"}))
+    provider.add_span_processor(processor(span_exporter))
+    _tracer = provider.get_tracer("app")
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any | None]:
+    """OpenTelemetry span around a block, or nothing when tracing is off"""
+    if _tracer is None:
+        yield None
+        return
+    attributes = {k: v for k, v in attributes.items() if v is not None}
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def traced(name: str):
+    """Decorator running a coroutine inside a span"""
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await method(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,209 @@
+"""Latency and peak memory of the pandas data paths (no LLM calls)
+
+    python -m benchmarks.data_paths --rows 1000 10000 100000 1000000 --output data_paths.json
+    python -m benchmarks.data_paths --rows 1000 10000 --compare data_paths.json
+
+Each case runs on a synthetic survey: upload (CSV parse and preprocessing, of which the
+comment clustering is also timed on its own), pagination, statistics, top comments and
+the streamed export. Latency is the median of `--repeat`
+runs; peak memory is the largest traced allocation of a separate run. Results are
+saved as JSON together with the commit they were measured on.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import inspect
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from fastapi import UploadFile
+
+from .synthetic import survey_file, synthetic_comments, synthetic_labels
+
+# Slower than the baseline by more than this share (and by at least a millisecond) is flagged by --compare
+REGRESSION_THRESHOLD = 0.2
+# From this size on, uploads and clustering are timed once instead of --repeat times
+SINGLE_RUN_ROWS = 100_000
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--upload-format", default="csv", choices=["csv", "xlsx"])
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    return parser.parse_args()
+
+
+async def call(run: Callable[[], Any]) -> Any:
+    result = run()
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def measure(run: Callable[[], Any], repeat: int) -> dict[str, Any]:
+    """Median/min latency over `repeat` runs, then peak traced memory of one more run"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await call(run)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        await call(run)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+async def consume(response: Any) -> int:
+    """Read a streaming response body to the end, returning its size"""
+    size = 0
+    async for chunk in response.body_iterator:
+        size += len(chunk)
+    return size
+
+
+async def run_size(rows: int, args: argparse.Namespace) -> dict[str, Any]:
+    # Imported once __main__ has configured the service through the environment
+    from app.services.csv_service import (  # noqa: PLC0415
+        CSVService,
+        answer_texts,
+        cluster_comments,
+        is_comment_column,
+    )
+
+    data = synthetic_comments(rows, duplicate_rate=args.duplicate_rate, seed=args.seed)
+    content = survey_file(data, args.upload_format)
+    labels = synthetic_labels(rows, seed=args.seed)
+    filename = f"synthetic-{rows}.{args.upload_format}"
+    service = CSVService()
+
+    async def upload() -> None:
+        await service.upload_csv(UploadFile(io.BytesIO(content), filename=filename))
+
+    def analyze() -> None:
+        # Stores the labels the way a finished analysis does, building the cube from scratch
+        service.label_cube = None
+        service.set_labels(labels)
+        service.analyzed = True
+
+    def statistics_cold() -> None:
+        # Drop the memoized statistics so every run computes them
+        service._statistics = None
+        service.get_analysis_statistics()
+
+    texts = answer_texts(data, [column for column in data.columns if is_comment_column(column)])
+
+    last_page = max((rows + 99) // 100, 1)
+    cases: dict[str, Callable[[], Any]] = {
+        "upload_csv": upload,
+        "answer_texts": lambda: answer_texts(data, service.comment_columns),
+        "cluster_comments": lambda: cluster_comments(texts),
+        "set_labels": analyze,
+        "get_paginated_data.first_page": lambda: service.get_paginated_data(1, 100),
+        "get_paginated_data.last_page": lambda: service.get_paginated_data(last_page, 100),
+        "get_paginated_data.filtered": lambda: service.get_paginated_data(
+            1, 100, filters={"感情": "ネガティブ", "重要性": "高"}
+        ),
+        "get_analysis_statistics": statistics_cold,
+        "get_top_comments": lambda: service.get_top_comments(5),
+        "download_analyzed_csv": lambda: consume(service.download_analyzed_csv()),
+        "download_analyzed_csv.gzip": lambda: consume(service.download_analyzed_csv(compress=True)),
+    }
+
+    results: dict[str, Any] = {"rows": rows, "upload_bytes": len(content), "cases": {}}
+    for name, run in cases.items():
+        # Uploads (and the clustering they include) are slow at a million rows; a single timed run
+        # is representative there
+        repeat = 1 if name in ("upload_csv", "cluster_comments") and rows >= SINGLE_RUN_ROWS else args.repeat
+        results["cases"][name] = await measure(run, repeat)
+        if name == "set_labels":
+            results["dataset_memory_mb"] = round(service.memory_usage() / 1024 / 1024, 2)
+    return results
+
+
+def environment() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True  # noqa: S607
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "measured_at": dt.datetime.now().astimezone().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: list[dict[str, Any]], baseline: dict[str, Any]) -> None:
+    """Print each case's latency change (fastest run) against the baseline results"""
+    baseline_cases = {entry["rows"]: entry["cases"] for entry in baseline["results"]}
+    print(f"\nCompared with {baseline['environment'].get('commit')} ({baseline['environment'].get('measured_at')}):")
+    for entry in results:
+        for name, case in entry["cases"].items():
+            before: dict[str, Any] | None = baseline_cases.get(entry["rows"], {}).get(name)
+            if not before:
+                continue
+            change = case["min_ms"] / before["min_ms"] - 1 if before["min_ms"] else 0.0
+            regressed = change > REGRESSION_THRESHOLD and case["min_ms"] - before["min_ms"] >= 1
+            flag = "  REGRESSION" if regressed else ""
+            print(
+                f"{entry['rows']:>8} {name:<34} {before['min_ms']:>10.1f} -> {case['min_ms']:>10.1f} ms "
+                f"({change:+.0%}){flag}"
+            )
+
+
+async def main(args: argparse.Namespace) -> list[dict[str, Any]]:
+    results = []
+    for rows in args.rows:
+        result = await run_size(rows, args)
+        for name, case in result["cases"].items():
+            print(f"{rows:>8} {name:<34} {case['median_ms']:>10.1f} ms {case['peak_memory_mb']:>9.1f} MB peak")
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Allow million-row uploads; the service reads its settings at import time
+    os.environ["UPLOAD_MAX_BYTES"] = str(16 * 1024 ** 3)
+
+    results = asyncio.run(main(args))
+    report = {
+        "environment": environment(),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
@@ -0,0 +1,127 @@
+"""Load test of the analysis and report pipelines against the fake LLM backend
+
+    python -m benchmarks.llm_pipeline --rows 1000 10000 50000 --output results.json
+
+Runs with LLM_BACKEND=fake, fresh analysis cache and checkpoint files, and the cascade
+disabled, so every run measures the same work. The fake backend is tuned with the
+FAKE_LLM_* variables (see .env.example); rate limits come from the usual LLM_* settings.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any
+
+import numpy as np
+
+from .synthetic import synthetic_comments
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument(
+        "--batch-size", type=int, default=None, help="comments per request (default: ANALYSIS_BATCH_SIZE)"
+    )
+    parser.add_argument("--reports", nargs="*", default=["top", "map_reduce"], choices=["top", "map_reduce"])
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cascade", action="store_true", help="keep the cascade classifier enabled")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def percentile(values: list[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 4) if values else 0.0
+
+
+async def run_size(rows: int, args: argparse.Namespace) -> dict[str, Any]:
+    # Imported once __main__ has configured the service through the environment
+    from app.services.csv_service import CSVService, llm_scheduler  # noqa: PLC0415
+    from app.services.llm_backends import fake_llm  # noqa: PLC0415
+
+    service = CSVService()
+    data = synthetic_comments(rows, duplicate_rate=args.duplicate_rate, seed=args.seed)
+    service.set_data(data, f"synthetic-{rows}.csv")
+
+    fake_llm.reset()
+    throttles = llm_scheduler.throttle_count
+    started = time.perf_counter()
+    # Time at which each row got its labels, for the row latency percentiles
+    completed_at: list[float] = []
+
+    def on_progress(progress_rows: list[dict[str, Any]]) -> None:
+        completed_at.extend([time.perf_counter() - started] * len(progress_rows))
+
+    analysis = await service.analyze_comments(batch_size=args.batch_size, on_progress=on_progress)
+    elapsed = time.perf_counter() - started
+    fake_stats = fake_llm.stats()
+
+    result: dict[str, Any] = {
+        "rows": rows,
+        "analysis": {
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(rows / elapsed, 1),
+            "requests": fake_stats["requests"],
+            "requests_per_second": round(fake_stats["requests"] / elapsed, 1),
+            "request_latency_p50": fake_stats["latency_p50"],
+            "request_latency_p99": fake_stats["latency_p99"],
+            "row_latency_p50": percentile(completed_at, 50),
+            "row_latency_p99": percentile(completed_at, 99),
+            "error_rate": round(analysis["error_count"] / rows, 4),
+            "throttled_requests": llm_scheduler.throttle_count - throttles,
+            "malformed_responses": fake_stats["malformed"],
+            "unique_comments": analysis["deduplication"]["unique_comments"],
+            "input_tokens": fake_stats["input_tokens"],
+            "output_tokens": fake_stats["output_tokens"],
+            "simulated_cost": analysis["total_cost"],
+        },
+        "reports": {},
+    }
+
+    for mode in args.reports:
+        fake_llm.reset()
+        started = time.perf_counter()
+        report = await service.generate_comment_report(mode)
+        fake_stats = fake_llm.stats()
+        result["reports"][mode] = {
+            "seconds": round(time.perf_counter() - started, 3),
+            "requests": fake_stats["requests"],
+            "request_latency_p50": fake_stats["latency_p50"],
+            "request_latency_p99": fake_stats["latency_p99"],
+            "input_tokens": fake_stats["input_tokens"],
+            "simulated_cost": report["total_cost"],
+        }
+    return result
+
+
+async def main(args: argparse.Namespace) -> list[dict[str, Any]]:
+    results = []
+    for rows in args.rows:
+        result = await run_size(rows, args)
+        analysis = result["analysis"]
+        print(
+            f"{rows:>7} rows: {analysis['seconds']:.1f}s, {analysis['rows_per_second']:.0f} rows/s, "
+            f"p50 {analysis['request_latency_p50']:.2f}s p99 {analysis['request_latency_p99']:.2f}s per request, "
+            f"errors {analysis['error_rate']:.2%}, cost ${analysis['simulated_cost']:.4f}"
+        )
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Configure the service before it is imported: it reads its settings at import time
+    workdir = tempfile.mkdtemp(prefix="llm-bench-")
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["ANALYSIS_CACHE_PATH"] = os.path.join(workdir, "analysis_cache.sqlite3")
+    os.environ["ANALYSIS_CHECKPOINT_PATH"] = os.path.join(workdir, "analysis_checkpoints.sqlite3")
+    if not args.cascade:
+        os.environ["CASCADE_ENABLED"] = "false"
+
+    results = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,145 @@
+"""A/B comparison of the full and compact classification request formats
+
+    python -m benchmarks.prompt_ab --input survey.xlsx --rows 500 --output prompt_ab.json
+
+Classifies the same comments with both formats through the configured LLM backend
+(Bedrock unless LLM_BACKEND=fake, so this spends real tokens), bypassing the analysis
+cache and cascade, and reports tokens, cost, time and how often the two formats agree
+on each label. Without --input a synthetic survey is used. The fake backend derives
+labels from a hash of the prompt, so only its token and cost figures are meaningful.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any
+
+from app.services.csv_service import (
+    ANALYSIS_BATCH_SIZE,
+    ANALYSIS_CONCURRENCY,
+    ANALYSIS_MODEL_ID,
+    CLASSIFIED_FIELDS,
+    LLM_BACKEND,
+    analyze_comment_with_llm,
+    analyze_comments_in_batch,
+    combine_comments,
+    estimate_classification_tokens,
+)
+from app.services.dedup import group_duplicate_comments
+from app.services.ingest import is_comment_column, read_upload_path
+from app.services.rate_limiter import run_bounded
+from app.services.telemetry import LLM_TOKENS
+
+from .synthetic import synthetic_comments
+
+FORMATS = ["full", "compact"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", help="CSV or xlsx survey export (default: synthetic comments)")
+    parser.add_argument("--rows", type=int, default=200, help="distinct comments to classify")
+    parser.add_argument(
+        "--batch-size", type=int, default=None, help="comments per request (default: ANALYSIS_BATCH_SIZE)"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def load_comments(args: argparse.Namespace) -> list[str]:
+    """Distinct combined comments of the survey, sampled down to --rows"""
+    if args.input:
+        data = read_upload_path(args.input, args.input)
+    else:
+        data = synthetic_comments(args.rows * 2, seed=args.seed)
+    comments = combine_comments(data, [col for col in data.columns if is_comment_column(col)]).tolist()
+    distinct = [comments[members[0]] for members in group_duplicate_comments(comments)]
+    random.Random(args.seed).shuffle(distinct)  # noqa: S311
+    return distinct[:args.rows]
+
+
+async def classify(comments: list[str], batch_size: int, prompt_format: str) -> dict[str, Any]:
+    tokens_before = {d: LLM_TOKENS.value(model=ANALYSIS_MODEL_ID, direction=d) for d in ("input", "output")}
+    started = time.perf_counter()
+    if batch_size > 1:
+        batches = [
+            dict(enumerate(comments[start:start + batch_size], start))
+            for start in range(0, len(comments), batch_size)
+        ]
+        outcomes = await run_bounded(
+            batches, lambda batch: analyze_comments_in_batch(batch, prompt_format), num_workers=ANALYSIS_CONCURRENCY
+        )
+        labels = {row: result for outcome in outcomes if isinstance(outcome, dict) for row, result in outcome.items()}
+    else:
+        outcomes = await run_bounded(
+            comments, lambda comment: analyze_comment_with_llm(comment, prompt_format), num_workers=ANALYSIS_CONCURRENCY
+        )
+        labels = {row: result for row, result in enumerate(outcomes) if isinstance(result, dict)}
+    elapsed = time.perf_counter() - started
+
+    succeeded = {row: result for row, result in labels.items() if not result.get("is_error")}
+    return {
+        "labels": succeeded,
+        "summary": {
+            "seconds": round(elapsed, 3),
+            "classified": len(succeeded),
+            "errors": len(comments) - len(succeeded),
+            "estimated_input_tokens": estimate_classification_tokens(comments, batch_size, prompt_format),
+            "input_tokens": int(
+                LLM_TOKENS.value(model=ANALYSIS_MODEL_ID, direction="input") - tokens_before["input"]
+            ),
+            "output_tokens": int(
+                LLM_TOKENS.value(model=ANALYSIS_MODEL_ID, direction="output") - tokens_before["output"]
+            ),
+            "cost": round(sum(result.get("total_cost", 0.0) for result in succeeded.values()), 6),
+        },
+    }
+
+
+def agreement(a: dict[int, dict[str, Any]], b: dict[int, dict[str, Any]]) -> dict[str, Any]:
+    """Share of rows classified by both formats that got the same label, per field and overall"""
+    rows = sorted(set(a) & set(b))
+    fields = CLASSIFIED_FIELDS
+    if not rows:
+        return {"compared_rows": 0}
+    result: dict[str, Any] = {"compared_rows": len(rows)}
+    for field in fields:
+        result[field] = round(sum(a[row][field] == b[row][field] for row in rows) / len(rows), 4)
+    result["all_labels"] = round(sum(all(a[row][f] == b[row][f] for f in fields) for row in rows) / len(rows), 4)
+    return result
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    comments = load_comments(args)
+    batch_size = args.batch_size or ANALYSIS_BATCH_SIZE
+    runs = {prompt_format: await classify(comments, batch_size, prompt_format) for prompt_format in FORMATS}
+
+    full, compact = runs["full"]["summary"], runs["compact"]["summary"]
+    report = {
+        "backend": LLM_BACKEND,
+        "comments": len(comments),
+        "batch_size": batch_size,
+        "formats": {prompt_format: run["summary"] for prompt_format, run in runs.items()},
+        "input_token_reduction": (
+            round(1 - compact["input_tokens"] / full["input_tokens"], 4) if full["input_tokens"] else None
+        ),
+        "agreement": agreement(runs["full"]["labels"], runs["compact"]["labels"]),
+    }
+    for prompt_format, summary in report["formats"].items():
+        print(
+            f"{prompt_format:>8}: {summary['input_tokens']} input / {summary['output_tokens']} output tokens, "
+            f"${summary['cost']:.4f}, {summary['seconds']:.1f}s, {summary['errors']} errors"
+        )
+    print(f"input token reduction: {report['input_token_reduction']}")
+    print(f"agreement: {report['agreement']}")
+    return report
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
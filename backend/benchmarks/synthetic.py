@@ -0,0 +1,96 @@
+"""Synthetic survey exports shaped like the uploads the service receives"""
+import io
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+COMMENT_COLUMNS = ["講義の良かった点（必須）", "講義の改善点（必須）", "その他のご意見（任意）"]
+
+_SUBJECTS = [
+    "講義の説明", "スライド", "演習", "質疑応答", "配布資料",
+    "講義の進行", "会場の設備", "事前案内", "グループワーク", "動画教材",
+]
+_PREDICATES = [
+    "がとても分かりやすかった", "が丁寧で良かった", "が実務に役立つと感じた", "の量が多すぎた", "が少し速すぎた",
+    "がもう少し詳しいと嬉しい", "が聞き取りにくかった", "の時間が足りなかった", "が見づらかった", "は特に問題なかった",
+]
+_DETAILS = [
+    "", "。", "と思います。", "ので改善してほしいです。", "。次回も参加したいです。", "。具体例がもっと欲しいです。",
+]
+# Short answers many respondents give word for word
+_STOCK_ANSWERS = ["特になし", "なし", "とても良かった", "ありがとうございました", "分かりやすかったです"]
+_DEPARTMENTS = ["営業部", "開発部", "人事部", "総務部", "企画部", "経理部"]
+# Share of respondents who leave an optional question blank
+_BLANK_RATE = 0.4
+
+# Label shares seen in analyzed surveys
+LABEL_DISTRIBUTIONS = {
+    "sentiment": {"ポジティブ": 0.45, "中立": 0.30, "ネガティブ": 0.25},
+    "category": {"講義内容": 0.45, "講義資料": 0.20, "運営": 0.20, "その他": 0.15},
+    "importance": {"高": 0.20, "中": 0.50, "低": 0.30},
+}
+
+
+def _answers(rng: np.random.Generator, rows: int) -> np.ndarray:
+    # One to several sentences per answer, drawn for all rows at once
+    counts = np.minimum(rng.geometric(0.55, size=rows), 8)
+    total = int(counts.sum())
+    sentences = [
+        f"{_SUBJECTS[s]}{_PREDICATES[p]}（第{n}回）{_DETAILS[d]}"
+        for s, p, n, d in zip(
+            rng.integers(len(_SUBJECTS), size=total).tolist(),
+            rng.integers(len(_PREDICATES), size=total).tolist(),
+            rng.integers(1, 20, size=total).tolist(),
+            rng.integers(len(_DETAILS), size=total).tolist(),
+        )
+    ]
+    ends = np.cumsum(counts).tolist()
+    return np.array(["".join(sentences[end - n:end]) for n, end in zip(counts.tolist(), ends)], dtype=object)
+
+
+def synthetic_comments(rows: int, duplicate_rate: float = 0.2, seed: int = 0) -> pd.DataFrame:
+    """Survey export with `rows` responses; `duplicate_rate` of the answers are stock phrases
+
+    Answers are one to several sentences (mostly 20-60 characters, occasionally over
+    two hundred), optional questions are often blank, and the export carries the usual
+    non-comment columns next to the 必須/任意 ones.
+    """
+    rng = np.random.default_rng(seed)
+    columns: dict[str, Any] = {
+        "回答ID": np.arange(1, rows + 1),
+        "回答日時": pd.Timestamp("2025-04-01") + pd.to_timedelta(rng.integers(0, 90 * 86400, size=rows), unit="s"),
+        "所属": np.array(_DEPARTMENTS, dtype=object)[rng.integers(len(_DEPARTMENTS), size=rows)],
+        "満足度": rng.integers(1, 6, size=rows),
+    }
+    for column in COMMENT_COLUMNS:
+        answers = _answers(rng, rows)
+        stock = rng.random(rows) < duplicate_rate
+        stock_answers = np.array(_STOCK_ANSWERS, dtype=object)
+        answers[stock] = stock_answers[rng.integers(len(_STOCK_ANSWERS), size=int(stock.sum()))]
+        if column.endswith("（任意）"):
+            answers[rng.random(rows) < _BLANK_RATE] = None
+        columns[column] = answers
+    return pd.DataFrame(columns)
+
+
+def synthetic_labels(rows: int, seed: int = 0) -> list[dict[str, Any]]:
+    """Classification results, in the shape analyze_comments produces, drawn from LABEL_DISTRIBUTIONS"""
+    rng = np.random.default_rng(seed + 1)
+    drawn = {
+        field: np.array(list(shares), dtype=object)[rng.choice(len(shares), size=rows, p=list(shares.values()))]
+        for field, shares in LABEL_DISTRIBUTIONS.items()
+    }
+    return [
+        {"sentiment": s, "category": c, "importance": i, "total_cost": 0.0, "is_error": False}
+        for s, c, i in zip(drawn["sentiment"], drawn["category"], drawn["importance"])
+    ]
+
+
+def survey_file(data: pd.DataFrame, file_format: str = "csv") -> bytes:
+    """The export as uploaded: UTF-8 CSV with BOM (as Excel saves it) or an xlsx workbook"""
+    if file_format == "xlsx":
+        buffer = io.BytesIO()
+        data.to_excel(buffer, index=False)
+        return buffer.getvalue()
+    return data.to_csv(index=False).encode("utf-8-sig")
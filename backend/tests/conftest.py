@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import pytest
+
+# The app reads its settings at import time: run every test against the fake LLM and throwaway state
+_state_dir = tempfile.mkdtemp(prefix="comment-picker-tests-")
+os.environ.update({
+    "LLM_BACKEND": "fake",
+    "FAKE_LLM_LATENCY_MS": "0",
+    "FAKE_LLM_MS_PER_OUTPUT_TOKEN": "0",
+    "FAKE_LLM_THROTTLE_RATE": "0",
+    "FAKE_LLM_MALFORMED_RATE": "0",
+    "LLM_REQUESTS_PER_SECOND": "0",
+    "LLM_TOKENS_PER_MINUTE": "0",
+    "ANALYSIS_CACHE_PATH": os.path.join(_state_dir, "analysis_cache.sqlite3"),
+    "ANALYSIS_CHECKPOINT_PATH": os.path.join(_state_dir, "analysis_checkpoints.sqlite3"),
+    "CASCADE_MODEL_PATH": os.path.join(_state_dir, "cascade_model.npz"),
+    "DATASET_SPILL_DIR": "",
+    "SHARED_STATE_DIR": "",
+    "TRACING_EXPORTER": "none",
+})
+
+
+@pytest.fixture(scope="session")
+def client():
+    # Imported here, once the settings above are in place
+    from fastapi.testclient import TestClient  # noqa: PLC0415
+
+    from app.main import app  # noqa: PLC0415
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    """The shared state, enabled on a throwaway directory"""
+    from app.services.shared_state import shared_state  # noqa: PLC0415
+
+    monkeypatch.setattr(shared_state, "directory", str(tmp_path))
+    monkeypatch.setattr(shared_state, "_conn", None)
+    return shared_state
@@ -0,0 +1,33 @@
+import numpy as np
+
+from app.services.aggregates import LabelCube
+
+CATEGORIES = {
+    'カテゴリ': ['講義内容', '運営'],
+    '感情': ['ポジティブ', '中立', 'ネガティブ'],
+    '重要性': ['高', '中', '低'],
+    '共通性': ['高', '中', '低'],
+}
+
+
+def test_from_codes_counts_rows_and_skips_missing_labels():
+    codes = np.array([[0, 0, 0, 0], [0, 2, 1, 1], [1, 2, 1, 1], [1, -1, 0, 0]])
+    cube = LabelCube.from_codes(CATEGORIES, codes)
+    assert cube.counts.sum() == 3
+    assert cube.counts_by('カテゴリ').tolist() == [2, 1]
+    assert cube.counts_by('感情').tolist() == [1, 0, 2]
+
+
+def test_counts_by_keeps_the_requested_axis_order():
+    codes = np.array([[0, 2, 0, 0], [1, 0, 0, 0], [1, 2, 0, 0]])
+    cube = LabelCube.from_codes(CATEGORIES, codes)
+    assert cube.counts_by('カテゴリ', '感情').tolist() == [[0, 0, 1], [1, 0, 1]]
+    assert cube.counts_by('感情', 'カテゴリ').tolist() == [[0, 1], [0, 0], [1, 1]]
+
+
+def test_add_and_remove_update_incrementally():
+    cube = LabelCube.from_codes(CATEGORIES, np.array([[0, 0, 0, 0], [1, 1, 1, 1]]))
+    cube.remove(np.array([[0, 0, 0, 0]]))
+    cube.add(np.array([[0, 2, 2, 2]]))
+    expected = LabelCube.from_codes(CATEGORIES, np.array([[1, 1, 1, 1], [0, 2, 2, 2]]))
+    assert np.array_equal(cube.counts, expected.counts)
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.aggregates import LabelCube
+from app.services.alerts import AlertMonitor, AlertRule, AlertRuleStore
+
+CATEGORIES = {
+    'カテゴリ': ['講義内容', '運営'],
+    '感情': ['ポジティブ', '中立', 'ネガティブ'],
+    '重要性': ['高', '中', '低'],
+    '共通性': ['高', '中', '低'],
+}
+
+
+def make_rows(count, sentiment):
+    return [
+        {"category": "運営", "sentiment": sentiment, "importance": "中", "commonality": "低"}
+        for _ in range(count)
+    ]
+
+
+def make_monitor(min_rows, **rule):
+    store = AlertRuleStore(CATEGORIES)
+    store.put(AlertRule(name="negative", target="sentiment", targetValue="ネガティブ", operator="gte", **rule))
+    return AlertMonitor(store, LabelCube(CATEGORIES), min_rows=min_rows)
+
+
+def test_percentage_rules_wait_for_min_rows():
+    monitor = make_monitor(min_rows=10, threshold=30)
+    assert monitor.add_rows(make_rows(3, "ネガティブ")) == []
+    fired = monitor.add_rows(make_rows(7, "中立"))
+    assert [alert["current_value"] for alert in fired] == [30.0]
+
+
+def test_count_rules_fire_before_min_rows():
+    monitor = make_monitor(min_rows=10, type="count", threshold=2)
+    assert len(monitor.add_rows(make_rows(2, "ネガティブ"))) == 1
+
+
+def test_fired_rules_stay_latched():
+    monitor = make_monitor(min_rows=2, threshold=50)
+    assert len(monitor.add_rows(make_rows(2, "ネガティブ"))) == 1
+    assert monitor.add_rows(make_rows(4, "中立")) == []
+    assert monitor.add_rows(make_rows(10, "ネガティブ")) == []
+
+
+def test_compiled_rules_and_matrix_stay_paired_while_rules_change():
+    store = AlertRuleStore(CATEGORIES)
+
+    def churn(n):
+        rule = store.put(
+            AlertRule(name=f"rule {n}", target="sentiment", targetValue="ネガティブ", operator="gte", threshold=n)
+        )
+        rules, matrix = store.compiled()
+        assert len(rules) == len(matrix)
+        store.delete(rule.id)
+        rules, matrix = store.compiled()
+        assert len(rules) == len(matrix)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(churn, range(400)))
+    assert store.compiled()[0] == []
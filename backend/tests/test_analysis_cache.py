@@ -0,0 +1,54 @@
+import itertools
+
+import pytest
+
+from app.services import analysis_cache as analysis_cache_module
+from app.services.analysis_cache import AnalysisCache
+from benchmarks.synthetic import survey_file, synthetic_comments
+
+LABELS = {"sentiment": "中立", "category": "その他", "importance": "中"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Make every cache write and lookup one second later than the previous one"""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(analysis_cache_module.time, "time", lambda: float(next(ticks)))
+
+
+def test_keys_depend_on_comment_model_and_prompt_version():
+    key = AnalysisCache.make_key("良かった", "model-a", "v1")
+    assert key == AnalysisCache.make_key("良かった", "model-a", "v1")
+    assert key != AnalysisCache.make_key("良かった", "model-b", "v1")
+    assert key != AnalysisCache.make_key("良かった", "model-a", "v2")
+    assert key != AnalysisCache.make_key("悪かった", "model-a", "v1")
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.put_many({"a": LABELS}, comments={"a": "comment a"})
+    cache.put_many({"b": LABELS})
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get_many(["a", "missing"]) == {"a": LABELS}
+    cache.put_many({"c": LABELS}, comments={"c": "comment c"})
+    # Only entries stored with their comment are training examples, most recently used first
+    assert cache.examples() == [("comment c", LABELS), ("comment a", LABELS)]
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert cache.size() == 2
+    assert cache.clear() == 2
+    assert cache.get_many(["a"]) == {}
+
+
+def test_analyzing_the_same_comments_again_is_served_from_the_cache(client):
+    content = survey_file(synthetic_comments(30, seed=3))
+
+    def analyze(dataset_id):
+        files = {"file": ("survey.csv", content, "text/csv")}
+        client.post("/csv/upload", params={"dataset_id": dataset_id}, files=files)
+        return client.post("/csv/analyze", params={"dataset_id": dataset_id}).json()
+
+    first = analyze("cache-test-1")
+    second = analyze("cache-test-2")
+    assert first["cache"]["misses"] > 0
+    assert second["cache"]["misses"] == 0
+    assert second["cache"]["hits"] == second["deduplication"]["unique_comments"]
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app.services import csv_service
+from app.services.csv_service import AnalysisRun, CSVService
+from benchmarks.synthetic import synthetic_comments
+
+LABELS = {"sentiment": "中立", "category": "その他", "importance": "中", "total_cost": 0.0, "is_error": False}
+
+
+@pytest.fixture
+def saves(monkeypatch):
+    """Rows of each checkpoint write"""
+    writes = []
+    monkeypatch.setattr(csv_service.analysis_checkpoint, "save", lambda dataset, rows: writes.append(dict(rows)))
+    return writes
+
+
+def complete_one_by_one(rows: int) -> None:
+    service = CSVService()
+    service.set_data(synthetic_comments(rows), "survey.csv")
+    run = AnalysisRun(service, service.comment_texts.tolist(), "checkpoint-test")
+    run.members_of = {i: [i] for i in range(rows)}
+
+    async def analyze():
+        for i in range(rows):
+            run.complete({i: LABELS})
+            await asyncio.sleep(0)
+        await run.save_checkpoint()
+
+    asyncio.run(analyze())
+
+
+def test_rows_completed_within_the_interval_are_written_together(saves, monkeypatch):
+    monkeypatch.setattr(csv_service, "ANALYSIS_CHECKPOINT_INTERVAL_SECONDS", 3600)
+    complete_one_by_one(10)
+    assert len(saves) == 1
+    assert sorted(saves[0]) == list(range(10))
+
+
+def test_every_row_is_written_when_saving_each_batch(saves, monkeypatch):
+    monkeypatch.setattr(csv_service, "ANALYSIS_CHECKPOINT_INTERVAL_SECONDS", 0)
+    complete_one_by_one(10)
+    assert len(saves) > 1
+    assert sorted(row for rows in saves for row in rows) == list(range(10))
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from app.services.csv_service import analyze_comments_in_batch
+from app.services.llm_backends import _ROW_ID, fake_llm
+
+
+@pytest.fixture
+def unparsable_batches(monkeypatch):
+    """Make every request for more than two comments return output that fails validation"""
+    requests = []
+    respond = fake_llm._structured_output
+
+    def structured_output(prompt, schema):
+        row_ids = sorted(int(row_id) for row_id in _ROW_ID.findall(prompt))
+        requests.append(row_ids)
+        args = respond(prompt, schema)
+        return args if len(row_ids) in (1, 2) else dict.fromkeys(args, "???")
+
+    monkeypatch.setattr(fake_llm, "_structured_output", structured_output)
+    return requests
+
+
+def test_failed_batch_is_retried_as_halves(unparsable_batches):
+    comments = {row_id: f"コメント{row_id}" for row_id in range(4)}
+    results = asyncio.run(analyze_comments_in_batch(comments, prompt_format="full"))
+
+    assert unparsable_batches[0] == [0, 1, 2, 3]
+    assert [0, 1] in unparsable_batches
+    assert [2, 3] in unparsable_batches
+    assert sorted(results) == [0, 1, 2, 3]
+    for result in results.values():
+        assert not result["is_error"]
+        assert result["sentiment"] and result["category"] and result["importance"]
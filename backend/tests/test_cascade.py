@@ -0,0 +1,42 @@
+import pytest
+
+from app.services import csv_service
+from app.services.cascade import Cascade, CascadeClassifier
+
+LABELS = {
+    "sentiment": ["ポジティブ", "中立", "ネガティブ"],
+    "category": ["講義内容", "講義資料", "運営", "その他"],
+    "importance": ["高", "中", "低"],
+}
+PRAISE = {"sentiment": "ポジティブ", "category": "講義内容", "importance": "低"}
+COMPLAINT = {"sentiment": "ネガティブ", "category": "運営", "importance": "高"}
+
+
+@pytest.fixture
+def cascade(tmp_path):
+    """A cascade with a model trained on a tiny, clearly separable labelled set"""
+    comments, results = [], []
+    for n in range(30):
+        comments += [f"講義の説明がとても分かりやすかった{n}", f"会場の空調が寒すぎて集中できなかった{n}"]
+        results += [PRAISE, COMPLAINT]
+    path = str(tmp_path / "cascade_model.npz")
+    CascadeClassifier.train(comments, results, LABELS).save(path)
+    return Cascade(path, threshold=0.95, audit_rate=0.0)
+
+
+def test_confident_rows_are_labelled_locally_and_the_rest_go_to_the_llm(cascade):
+    local, audited, remaining = cascade.split({
+        0: "講義の説明がとても分かりやすかった",
+        1: "会場の空調が寒すぎて集中できなかった",
+        2: "天気",
+    })
+    assert local == {0: PRAISE, 1: COMPLAINT}
+    assert audited == {}
+    assert remaining == {2: "天気"}
+
+
+def test_retrain_with_too_few_examples_is_a_bad_request(client, monkeypatch):
+    monkeypatch.setattr(csv_service.analysis_cache, "examples", lambda limit=None: [("よかった", PRAISE)])
+    response = client.post("/csv/cascade/retrain")
+    assert response.status_code == 400
+    assert "Need at least" in response.json()["detail"]
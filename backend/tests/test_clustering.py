@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from app.services.clustering import (
+    _BAND_WEIGHTS,
+    BAND_ROWS,
+    NUM_HASHES,
+    _candidate_pairs,
+    answer_texts,
+    cluster_comments,
+    minhash_signatures,
+)
+from app.services.ingest import is_comment_column
+from benchmarks.synthetic import synthetic_comments
+
+
+def test_near_duplicates_share_a_cluster_and_empty_rows_have_none():
+    texts = [
+        "駐車場が狭くて朝は停められない",
+        "",
+        "駐車場が狭くて朝は停められない。",
+        "食堂のメニューが少ない",
+        "駐車場が狭くて朝は停められない",
+    ]
+    data = pd.DataFrame({"q（必須）": texts})
+    clusters = cluster_comments(answer_texts(data, ["q（必須）"]))
+    assert clusters.labels.tolist() == [0, -1, 0, 1, 0]
+    assert clusters.sizes.tolist() == [3, 1]
+    assert clusters.members(0).tolist() == [0, 2, 4]
+    assert clusters.representatives.tolist() == [0, 3]
+
+
+def test_commonality_follows_cluster_size():
+    texts = ["同じ意見です"] * 6 + ["似た意見です"] * 2 + ["別の話題について"]
+    clusters = cluster_comments(texts)
+    commonality = clusters.commonality().tolist()
+    assert commonality[0] == '高'
+    assert commonality[-1] == '低'
+
+
+def test_answer_texts_drops_no_comment_answers():
+    data = pd.DataFrame({"a": ["特になし", "Ａ！", None], "b": ["なし", "", "x"]})
+    texts = answer_texts(data, ["a", "b"])
+    assert texts[0] == ""
+    assert texts[1] == "a"
+    assert texts[2] == "x"
+
+
+def test_no_rows():
+    assert cluster_comments([]).labels.tolist() == []
+
+
+def test_candidate_pairs_at_survey_scale_pair_every_row_with_its_buckets_first_row():
+    data = synthetic_comments(20000)
+    texts = answer_texts(data, [column for column in data.columns if is_comment_column(column)])
+    signatures = minhash_signatures(sorted({text for text in texts if text}))
+    expected = set()
+    for band in range(NUM_HASHES // BAND_ROWS):
+        values = signatures[:, band * BAND_ROWS:(band + 1) * BAND_ROWS].astype(np.uint64)
+        _, first, inverse = np.unique((values * _BAND_WEIGHTS).sum(axis=1), return_index=True, return_inverse=True)
+        expected.update((row, leader) for row, leader in enumerate(first[inverse].tolist()) if row != leader)
+    pairs = _candidate_pairs(signatures)
+    assert len(pairs) == len(expected)
+    assert set(map(tuple, pairs.tolist())) == expected
@@ -0,0 +1,53 @@
+import json
+
+from app.services.compact_prompt import (
+    NO_ANSWER,
+    CompactEvalOutput,
+    answer_fields,
+    compact_batch_prompt,
+    compact_prompt,
+    expand_labels,
+)
+
+
+def test_expand_labels_decodes_letter_codes():
+    assert expand_labels(CompactEvalOutput(s='N', c='M', i='H')) == {
+        'sentiment': 'ネガティブ', 'category': '講義資料', 'importance': '高',
+    }
+
+
+def test_answer_fields_strips_markers_and_empty_answers():
+    comment = json.dumps({"良かった点（必須）": " 説明が\n丁寧 ", "改善点(任意)": "特になし"}, ensure_ascii=False)
+    assert answer_fields(comment) == {"良かった点": "説明が 丁寧"}
+
+
+def test_answer_fields_keeps_full_headers_of_questions_differing_only_by_marker():
+    comment = json.dumps(
+        {"感想（必須）": "A", "感想（任意）": "B", "改善点（必須）": "C"}, ensure_ascii=False
+    )
+    assert answer_fields(comment) == {"感想（必須）": "A", "感想（任意）": "B", "改善点": "C"}
+    assert compact_prompt(comment).splitlines() == ["感想（必須）: A", "感想（任意）: B", "改善点: C"]
+
+
+def test_answer_fields_accepts_plain_text():
+    assert answer_fields("plain text") == {"": "plain text"}
+    assert answer_fields("なし") == {}
+
+
+def test_compact_batch_prompt_aliases_each_header_once():
+    comments = {
+        4: json.dumps({"良かった点（必須）": "A", "改善点（必須）": "B"}, ensure_ascii=False),
+        7: json.dumps({"改善点（必須）": "C", "良かった点（必須）": "なし"}, ensure_ascii=False),
+        9: json.dumps({"改善点（必須）": "特になし"}, ensure_ascii=False),
+    }
+    assert compact_batch_prompt(comments).splitlines() == [
+        "Q1=良かった点 Q2=改善点",
+        "全行をidごとに分類:",
+        "[id: 4] Q1:A | Q2:B",
+        "[id: 7] Q2:C",
+        f"[id: 9] {NO_ANSWER}",
+    ]
+
+
+def test_compact_prompt_of_a_row_without_answers():
+    assert compact_prompt(json.dumps({"q": ""})) == NO_ANSWER
@@ -0,0 +1,55 @@
+import asyncio
+import copy
+import threading
+
+import pytest
+
+from app.services.dataset_store import DatasetStore
+from benchmarks.synthetic import synthetic_comments
+
+
+@pytest.fixture
+def loads(shared, monkeypatch):
+    """Threads each dataset snapshot was unpickled on"""
+    threads = []
+    load_dataset = shared.load_dataset
+
+    def recording(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return load_dataset(*args, **kwargs)
+
+    monkeypatch.setattr(shared, "load_dataset", recording)
+    return threads
+
+
+def test_get_picks_up_other_workers_changes_off_the_event_loop(shared, loads):
+    store = DatasetStore(memory_budget_bytes=1 << 30, idle_seconds=0, spill_dir="")
+    service = store._new("shared-test")
+    # Another worker uploads into the same dataset
+    other = copy.deepcopy(service)
+    other.set_data(synthetic_comments(20), "survey.csv")
+    shared.save_dataset("shared-test", other)
+
+    async def get_twice():
+        await store.get("shared-test")
+        return await store.get("shared-test")
+
+    assert asyncio.run(get_twice()) is service
+    assert (service.upload_id, service.version) == (other.upload_id, other.version)
+    assert len(service.csv_data) == 20
+    # Unpickled once, in the offload pool; the unchanged second read only compares versions
+    assert len(loads) == 1
+    assert loads[0] is not threading.main_thread()
+
+
+def test_spilled_dataset_is_reloaded_on_access(tmp_path):
+    store = DatasetStore(memory_budget_bytes=1 << 30, idle_seconds=0, spill_dir=str(tmp_path))
+    service = store._new("spill-test")
+    service.set_data(synthetic_comments(20), "survey.csv")
+    store._evict("spill-test")
+    assert not store.list()[0]["in_memory"]
+
+    reloaded = asyncio.run(store.get("spill-test"))
+    assert reloaded.upload_id == service.upload_id
+    assert len(reloaded.csv_data) == 20
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,39 @@
+from benchmarks.synthetic import survey_file, synthetic_comments
+
+
+def upload(client, rows, **params):
+    files = {"file": ("survey.csv", survey_file(synthetic_comments(rows)), "text/csv")}
+    response = client.post("/csv/upload", params=params, files=files)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_requests_are_routed_to_their_dataset(client):
+    first = client.post("/csv/datasets").json()["dataset_id"]
+    second = client.post("/csv/datasets").json()["dataset_id"]
+    upload(client, 12, dataset_id=first)
+    upload(client, 7, dataset_id=second)
+
+    assert client.get("/csv/info", params={"dataset_id": first}).json()["total_rows"] == 12
+    assert client.get("/csv/info", params={"dataset_id": second}).json()["total_rows"] == 7
+    listed = {entry["dataset_id"]: entry for entry in client.get("/csv/datasets").json()}
+    assert listed[first]["total_rows"] == 12
+    assert listed[second]["in_memory"]
+
+
+def test_deleted_and_unknown_datasets_are_not_found(client):
+    dataset_id = upload(client, 5, dataset_id="delete-test")["dataset_id"]
+    assert client.delete(f"/csv/datasets/{dataset_id}").status_code == 200
+    assert client.get("/csv/info", params={"dataset_id": dataset_id}).status_code == 404
+    assert client.delete(f"/csv/datasets/{dataset_id}").status_code == 404
+    assert client.get("/csv/info", params={"dataset_id": "never-created"}).status_code == 404
+
+
+def test_invalid_dataset_ids_are_rejected(client):
+    assert client.get("/csv/info", params={"dataset_id": "../etc"}).status_code == 422
+    assert client.delete("/csv/datasets/bad.id").status_code == 400
+
+
+def test_requests_without_a_dataset_id_share_the_default_dataset(client):
+    assert upload(client, 3)["dataset_id"] == "default"
+    assert client.get("/csv/info").json()["total_rows"] == 3
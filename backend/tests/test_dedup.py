@@ -0,0 +1,27 @@
+import json
+
+from app.services.dedup import group_duplicate_comments, normalize_comment, normalize_text
+
+
+def test_normalize_text_folds_width_case_and_punctuation():
+    assert normalize_text("Ｇｏｏｄ！ Lecture。") == "goodlecture"
+
+
+def test_normalize_text_drops_no_comment_answers():
+    assert normalize_text("特になし。") == ""
+    assert normalize_text(" None ") == ""
+
+
+def test_normalize_comment_ignores_empty_answers():
+    a = json.dumps({"q1": "とても良かった！", "q2": "なし"}, ensure_ascii=False)
+    b = json.dumps({"q1": "とても良かった"}, ensure_ascii=False)
+    assert normalize_comment(a) == normalize_comment(b)
+
+
+def test_normalize_comment_accepts_plain_text():
+    assert normalize_comment("Hello, World") == "helloworld"
+
+
+def test_group_duplicate_comments_keeps_first_appearance_order():
+    comments = ['{"q": "A"}', '{"q": "b"}', '{"q": "a!"}', '{"q": "c"}', '{"q": "B"}']
+    assert group_duplicate_comments(comments) == [[0, 2], [1, 4], [3]]
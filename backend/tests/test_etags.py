@@ -0,0 +1,39 @@
+from benchmarks.synthetic import survey_file, synthetic_comments
+
+DATASET_ID = "etag-test"
+
+
+def get(client, path, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get(path, params={"dataset_id": DATASET_ID}, headers=headers)
+
+
+def upload(client, seed):
+    files = {"file": ("survey.csv", survey_file(synthetic_comments(20, seed=seed)), "text/csv")}
+    assert client.post("/csv/upload", params={"dataset_id": DATASET_ID}, files=files).status_code == 200
+
+
+def test_unchanged_data_is_revalidated_with_304(client):
+    upload(client, seed=1)
+    first = get(client, "/csv/data")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    revalidated = get(client, "/csv/data", etag)
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["ETag"] == etag
+
+
+def test_analysis_and_uploads_change_the_etag(client):
+    upload(client, seed=2)
+    uploaded = get(client, "/csv/data").headers["ETag"]
+    assert client.post("/csv/analyze", params={"dataset_id": DATASET_ID}).status_code == 200
+    analyzed = get(client, "/csv/statistics", uploaded)
+    assert analyzed.status_code == 200
+    assert analyzed.headers["ETag"] != uploaded
+    assert get(client, "/csv/statistics", analyzed.headers["ETag"]).status_code == 304
+
+    upload(client, seed=2)
+    assert get(client, "/csv/data", analyzed.headers["ETag"]).status_code == 200
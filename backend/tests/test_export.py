@@ -0,0 +1,53 @@
+import gzip
+import io
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import survey_file, synthetic_comments
+
+LABEL_COLUMNS = ["感情", "カテゴリ", "重要性", "共通性"]
+
+
+@pytest.fixture(scope="module")
+def analyzed(client):
+    """Dataset id and upload of an analyzed survey"""
+    data = synthetic_comments(60)
+    dataset_id = "export-test"
+    response = client.post(
+        "/csv/upload", params={"dataset_id": dataset_id}, files={"file": ("survey.csv", survey_file(data), "text/csv")}
+    )
+    assert response.status_code == 200
+    assert client.post("/csv/analyze", params={"dataset_id": dataset_id}).status_code == 200
+    return dataset_id, response.json()["columns"]
+
+
+def download(client, dataset_id, **params):
+    response = client.get("/csv/download", params={"dataset_id": dataset_id, **params})
+    assert response.status_code == 200
+    return response.content
+
+
+@pytest.mark.parametrize(
+    ("export_format", "read"),
+    [
+        ("csv", lambda content: pd.read_csv(io.BytesIO(content))),
+        ("parquet", lambda content: pd.read_parquet(io.BytesIO(content))),
+        ("xlsx", lambda content: pd.read_excel(io.BytesIO(content))),
+    ],
+)
+def test_download_each_format(client, analyzed, export_format, read):
+    dataset_id, columns = analyzed
+    exported = read(download(client, dataset_id, format=export_format))
+    assert len(exported) == 60
+    assert list(exported.columns) == columns + LABEL_COLUMNS
+    assert exported["感情"].notna().all()
+
+
+def test_download_gzip_csv_with_selected_columns(client, analyzed):
+    dataset_id, _ = analyzed
+    content = gzip.decompress(download(client, dataset_id, gzip=True, bom=True, columns=["感情", "カテゴリ"]))
+    assert content.startswith(b"\xef\xbb\xbf")
+    exported = pd.read_csv(io.BytesIO(content), encoding="utf-8-sig")
+    assert list(exported.columns) == ["感情", "カテゴリ"]
+    assert len(exported) == 60
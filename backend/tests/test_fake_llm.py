@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.services.compact_prompt import CompactBatchOutput, CompactEvalOutput, compact_batch_prompt
+from app.services.llm_backends import FakeLLM
+from app.services.rate_limiter import is_throttling_error
+
+
+def fake(**overrides):
+    settings = {
+        "latency_ms": 0, "latency_p99_ms": 0, "ms_per_output_token": 0, "throttle_rate": 0,
+        "malformed_rate": 0, "capacity": 0, "seed": 0,
+    }
+    return FakeLLM(**{**settings, **overrides})
+
+
+def classify(llm, prompt, output_type=CompactEvalOutput):
+    agent = llm.agent_factory("system")("fake-model", output_type=output_type)
+    return asyncio.run(agent.run(prompt)).output
+
+
+def test_labels_are_deterministic_per_prompt():
+    llm = fake()
+    assert classify(llm, "講義が分かりやすかった") == classify(fake(), "講義が分かりやすかった")
+    assert llm.stats()["requests"] == 1
+    assert llm.stats()["input_tokens"] > 0
+
+
+def test_batches_get_one_result_per_row_id():
+    prompt = compact_batch_prompt({3: "良かった", 8: "寒かった", 21: "資料が多い"})
+    output = classify(fake(), prompt, CompactBatchOutput)
+    assert [item.id for item in output.r] == [3, 8, 21]
+
+
+def test_malformed_batches_drop_half_of_their_rows():
+    llm = fake(malformed_rate=1)
+    prompt = compact_batch_prompt({1: "a", 2: "b", 3: "c", 4: "d"})
+    args = llm._structured_output(prompt, CompactBatchOutput.model_json_schema())
+    assert [item["id"] for item in args["r"]] == [1, 2]
+    assert llm.stats()["malformed"] == 1
+
+
+def test_requests_over_the_throttle_rate_fail_like_bedrock():
+    llm = fake(throttle_rate=1)
+    with pytest.raises(ClientError) as throttled:
+        classify(llm, "講義が分かりやすかった")
+    assert is_throttling_error(throttled.value)
+    assert llm.stats()["throttled"] == 1
+    assert llm.in_flight == 0
@@ -0,0 +1,39 @@
+import codecs
+import io
+
+import pytest
+from openpyxl import Workbook
+
+from app.services.ingest import candidate_encodings, read_csv_stream, read_xlsx_stream, unique_columns
+
+
+def test_unique_columns_matches_pandas_renaming():
+    assert unique_columns(["a", "a", "a.1", "a"]) == ["a", "a.2", "a.1", "a.3"]
+
+
+def test_read_xlsx_stream_keeps_duplicate_headers():
+    workbook = Workbook()
+    workbook.active.append(["id", "ご意見（任意）", "ご意見（任意）"])
+    workbook.active.append([1, "良い", "悪い"])
+    file = io.BytesIO()
+    workbook.save(file)
+
+    data = read_xlsx_stream(file)
+    assert list(data.columns) == ["id", "ご意見（任意）", "ご意見（任意）.1"]
+    assert data.iloc[0].tolist() == [1, "良い", "悪い"]
+
+
+def test_candidate_encodings_prefers_what_the_sample_decodes_as():
+    assert candidate_encodings("ご意見".encode("cp932")) == ["cp932", "utf-8"]
+    assert candidate_encodings(codecs.BOM_UTF8 + b"id") == ["utf-8-sig"]
+
+
+def test_read_csv_stream_falls_back_past_the_sample():
+    body = ("id,ご意見（任意）\n" + "1,abc\n" * 20000 + "2,日本語です\n").encode("cp932")
+    assert read_csv_stream(io.BytesIO(body))["ご意見（任意）"].iloc[-1] == "日本語です"
+
+
+def test_read_csv_stream_rejects_mixed_encodings():
+    body = ("id,ご意見（任意）\n" + "1,あ\n" * 20000).encode("utf-8") + "2,い\n".encode("cp932")
+    with pytest.raises(ValueError, match="Could not decode"):
+        read_csv_stream(io.BytesIO(body))
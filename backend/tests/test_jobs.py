@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from app.services import jobs
+from app.services.jobs import AnalysisJob, job_manager
+
+
+def row(i):
+    return {
+        "row": i, "id": str(i), "comment": "", "sentiment": "中立", "importance": "中",
+        "total_cost": 0.0, "is_error": False,
+    }
+
+
+def run_job(job, rows, after_row=None):
+    async def analyze():
+        async def run():
+            for i in range(rows):
+                job.record_rows([row(i)])
+                if after_row is not None:
+                    after_row()
+            return {}
+
+        job.start(run)
+        await job._task
+
+    asyncio.run(analyze())
+
+
+def test_row_events_are_compacted_while_running_and_dropped_when_finished(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_ROW_EVENTS_KEPT", 3)
+    job = AnalysisJob(total_rows=10)
+    row_events = []
+    run_job(job, 10, after_row=lambda: row_events.append([event["event"] for event in job.events].count("row")))
+    assert 3 < max(row_events) <= 2 * 3
+    assert [event["event"] for event in job.events].count("row") == 0
+    assert job.events[-1]["event"] == "completed"
+    assert job.progress()["done_rows"] == 10
+
+
+def test_replay_resumes_after_the_last_event_id():
+    job = AnalysisJob(total_rows=2)
+    run_job(job, 2)
+
+    async def replay(last_event_id):
+        return [chunk async for chunk in job.stream(last_event_id)]
+
+    everything = asyncio.run(replay(-1))
+    assert len(everything) == len(job.events)
+    assert asyncio.run(replay(job.events[-2]["seq"])) == everything[-1:]
+
+
+def test_finished_jobs_are_forgotten_after_their_ttl(monkeypatch):
+    finished = job_manager.create(total_rows=1)
+    run_job(finished, 1)
+    running = job_manager.create(total_rows=1)
+    monkeypatch.setattr(jobs, "JOB_TTL_SECONDS", 60)
+    finished.finished_at = time.time() - 61
+    job_manager.prune()
+    assert job_manager.find(finished.id) is None
+    assert job_manager.get(running.id) is running
+
+
+def test_progress_saves_are_throttled_and_the_final_event_is_saved(shared, monkeypatch):
+    saved = []
+    save_job = shared.save_job
+
+    def recording(job_id, progress, events):
+        saved.append(progress["status"])
+        save_job(job_id, progress, events)
+
+    monkeypatch.setattr(shared, "save_job", recording)
+
+    async def analyze():
+        job = job_manager.create(total_rows=20, dataset_id="jobs-test")
+
+        async def run():
+            for i in range(20):
+                job.record_rows([row(i)])
+                await asyncio.sleep(0)
+            return {}
+
+        job.start(run)
+        await job._task
+        return job
+
+    job = asyncio.run(analyze())
+    # The first progress event, then nothing until the job completed
+    assert saved == ["running", "completed"]
+    assert shared.job(job.id)["progress"]["done_rows"] == 20
+    assert [seq for seq, _ in shared.job_events(job.id)] == [event["seq"] for event in job.events]
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.offload import Offloader
+
+
+def test_work_beyond_the_queue_is_rejected_with_503():
+    offloader = Offloader("thread", workers=1, max_queued=1)
+    release = threading.Event()
+
+    async def flood():
+        running = asyncio.ensure_future(offloader.run(release.wait))
+        queued = asyncio.ensure_future(offloader.run(lambda: "queued"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            await offloader.run(lambda: "rejected")
+        release.set()
+        return rejected.value, await running, await queued
+
+    try:
+        rejected, running, queued = asyncio.run(flood())
+    finally:
+        release.set()
+        offloader.shutdown()
+    assert rejected.status_code == 503
+    assert rejected.headers == {"Retry-After": "1"}
+    assert (running, queued) == (True, "queued")
+    assert offloader.rejected == 1
+    assert offloader.pending == 0
+
+
+def test_run_holds_the_given_lock():
+    offloader = Offloader("thread", workers=2, max_queued=0)
+    lock = threading.Lock()
+    try:
+        assert asyncio.run(offloader.run(lock.locked, lock=lock)) is True
+    finally:
+        offloader.shutdown()
+    assert not lock.locked()
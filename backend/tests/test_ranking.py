@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.services.ranking import RankingIndex, decode_cursor, encode_cursor
+
+CATEGORIES = ['講義内容', '運営']
+SENTIMENTS = ['ポジティブ', 'ネガティブ']
+
+
+def make_index():
+    return RankingIndex(
+        scores=np.array([1, 9, 4, 9, 2], dtype=np.int8),
+        category_codes=np.array([1, 0, 1, 1, 0]),
+        sentiment_codes=np.array([0, 1, 1, 0, 0]),
+        categories=CATEGORIES,
+        sentiments=SENTIMENTS,
+    )
+
+
+def test_ranked_orders_by_score_and_keeps_row_order_on_ties():
+    assert make_index().ranked().tolist() == [1, 3, 2, 4, 0]
+
+
+def test_ranked_filters_by_category_and_sentiment():
+    index = make_index()
+    assert index.ranked(category='運営').tolist() == [3, 2, 0]
+    assert index.ranked(category='運営', sentiment='ポジティブ').tolist() == [3, 0]
+    assert index.top(1, sentiment='ネガティブ').tolist() == [1]
+
+
+def test_categories_in_order_of_first_appearance():
+    assert make_index().categories_in_order == ['運営', '講義内容']
+
+
+def test_categories_in_order_skips_absent_and_unlabelled_rows():
+    index = RankingIndex(
+        scores=np.zeros(4, dtype=np.int8),
+        category_codes=np.array([-1, 2, -1, 0]),
+        sentiment_codes=np.zeros(4, dtype=np.int64),
+        categories=['講義内容', '講義資料', '運営'],
+        sentiments=SENTIMENTS,
+    )
+    assert index.categories_in_order == ['運営', '講義内容']
+
+
+def test_unknown_filter_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        make_index().ranked(category='その他')
+    assert error.value.status_code == 400
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(3, 40), 3) == 40
+
+
+@pytest.mark.parametrize(("cursor", "status"), [("x", 400), ("1.2.3", 400), ("2.40", 409), ("3.-1", 409)])
+def test_invalid_or_stale_cursor(cursor, status):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, 3)
+    assert error.value.status_code == status
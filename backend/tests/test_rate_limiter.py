@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from app.services.rate_limiter import AdaptiveConcurrency, RequestScheduler, is_throttling_error
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def test_concurrency_grows_additively_and_halves_on_throttling():
+    concurrency = AdaptiveConcurrency(initial=4, minimum=1, maximum=8, cooldown=60)
+    for _ in range(4):
+        concurrency.on_success()
+    assert 4.9 < concurrency.limit < 5
+    concurrency.on_throttle()
+    halved = concurrency.limit
+    assert 2.4 < halved < 2.5
+    # Further throttles within the cooldown belong to the same overload and are ignored
+    concurrency.on_throttle()
+    assert concurrency.limit == halved
+
+
+def test_concurrency_stays_within_its_bounds():
+    concurrency = AdaptiveConcurrency(initial=2, minimum=1, maximum=3, cooldown=0)
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.limit == 3
+    for _ in range(10):
+        concurrency.on_throttle()
+    assert concurrency.limit == 1
+
+
+def test_throttled_requests_are_retried_with_backoff():
+    scheduler = RequestScheduler(
+        requests_per_second=0, tokens_per_minute=0, initial_concurrency=8, max_concurrency=8, backoff_base=0.001
+    )
+    attempts = []
+
+    async def call():
+        attempts.append(len(attempts))
+        if len(attempts) <= 2:
+            raise Throttled("rate exceeded")
+        return "labels"
+
+    assert asyncio.run(scheduler.run(call)) == "labels"
+    assert len(attempts) == 3
+    assert (scheduler.throttle_count, scheduler.retry_count) == (2, 2)
+    # Halved once: the second throttle fell within the cooldown of the first
+    assert scheduler.stats()["concurrency_limit"] == 4
+
+
+def test_requests_are_given_up_after_max_retries_and_other_errors_are_not_retried():
+    scheduler = RequestScheduler(
+        requests_per_second=0, tokens_per_minute=0, initial_concurrency=1, max_concurrency=1,
+        max_retries=2, backoff_base=0.001,
+    )
+
+    async def throttled():
+        raise Throttled("rate exceeded")
+
+    async def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(Throttled):
+        asyncio.run(scheduler.run(throttled))
+    assert scheduler.throttle_count == 3
+    with pytest.raises(ValueError, match="bad request"):
+        asyncio.run(scheduler.run(broken))
+    assert scheduler.throttle_count == 3
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_throttling_errors_are_recognized_by_code_or_status():
+    error = Exception("boom")
+    error.response = {"Error": {"Code": "ThrottlingException"}}
+    assert is_throttling_error(error)
+    assert is_throttling_error(Throttled())
+    assert not is_throttling_error(ValueError("validation failed"))
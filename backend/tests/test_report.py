@@ -0,0 +1,32 @@
+from app.services.report import SectionStream, pack_summaries, parse_report_sections
+
+
+def test_parse_report_sections_by_markers():
+    text = "前置き\n[[POSITIVE]]\n良い点\n[[NEGATIVE]]\n悪い点\n[[INSIGHTS]]\n洞察"
+    assert parse_report_sections(text) == {
+        "positive_summary": "良い点", "negative_summary": "悪い点", "overall_insights": "洞察",
+    }
+
+
+def test_parse_report_sections_falls_back_to_numbered_headings():
+    text = "1. ポジティブな意見のまとめ：良い\n\n続き\n\n2. ネガティブな意見のまとめ：悪い\n\n3. 総合的な洞察：全体"
+    assert parse_report_sections(text) == {
+        "positive_summary": "良い\n\n続き", "negative_summary": "悪い", "overall_insights": "全体",
+    }
+
+
+def test_section_stream_handles_markers_split_across_chunks():
+    stream = SectionStream()
+    events = []
+    for chunk in ["[[POSI", "TIVE]]\n良", "い [", "[NEGATIVE]]悪い"]:
+        events += stream.feed(chunk)
+    events += stream.flush()
+    sections = [e["data"]["section"] for e in events if e["event"] == "section"]
+    assert sections == ["positive_summary", "negative_summary"]
+    text = "".join(e["data"]["text"] for e in events if e["event"] == "delta")
+    assert "[[" not in text
+    assert "良" in text and "悪い" in text
+
+
+def test_pack_summaries_respects_the_budget():
+    assert pack_summaries(["aaa", "bb", "cccc", "d"], budget=5) == [["aaa", "bb"], ["cccc", "d"]]
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+
+import pytest
+
+from app.services import csv_service
+from app.services.llm_backends import fake_llm
+from app.services.telemetry import ERRORS, Registry
+
+
+def test_metrics_render_in_the_prometheus_text_format():
+    registry = Registry()
+    rows = registry.counter("rows_total", "Rows", labels=("source",))
+    latency = registry.histogram("latency_seconds", "Latency", labels=("route",))
+    registry.callback("queue_depth", "Queued tasks", lambda: 3)
+    rows.inc(2, source='cache "hot"')
+    latency.observe(0.02, route="/csv/data")
+    latency.observe(7, route="/csv/data")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE rows_total counter" in lines
+    assert 'rows_total{source="cache \\"hot\\""} 2' in lines
+    assert 'latency_seconds_bucket{route="/csv/data",le="0.025"} 1' in lines
+    assert 'latency_seconds_bucket{route="/csv/data",le="+Inf"} 2' in lines
+    assert 'latency_seconds_count{route="/csv/data"} 2' in lines
+    assert "queue_depth 3" in lines
+    with pytest.raises(ValueError, match="expects labels"):
+        rows.inc(route="/")
+
+
+def test_metrics_endpoint_counts_requests_by_route(client):
+    assert client.get("/csv/datasets").status_code == 200
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    count = next(
+        line for line in response.text.splitlines()
+        if line.startswith('http_request_duration_seconds_count{method="GET",route="/csv/datasets",status="200"}')
+    )
+    assert int(count.split()[-1]) >= 1
+
+
+def test_recovered_llm_errors_are_logged_and_counted(monkeypatch, caplog):
+    def broken(prompt, schema):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(fake_llm, "_structured_output", broken)
+    before = ERRORS.value(component="llm_batch")
+    with caplog.at_level(logging.WARNING, logger=csv_service.logger.name):
+        results = asyncio.run(csv_service.analyze_comment_batch_with_llm({0: "良かった"}, prompt_format="full"))
+    assert results == {}
+    assert ERRORS.value(component="llm_batch") == before + 1
+    assert "model unavailable" in caplog.text
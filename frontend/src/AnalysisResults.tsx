@@ -35,10 +35,11 @@ interface StatisticsData {
 
 interface AnalysisResultsProps {
   apiUrl: string;
+  datasetId: string;
   analyzed: boolean;
 }
 
-const AnalysisResults: React.FC<AnalysisResultsProps> = ({ apiUrl, analyzed }) => {
+const AnalysisResults: React.FC<AnalysisResultsProps> = ({ apiUrl, datasetId, analyzed }) => {
   const [statistics, setStatistics] = useState<StatisticsData | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -50,7 +51,7 @@ const AnalysisResults: React.FC<AnalysisResultsProps> = ({ apiUrl, analyzed }) =
     setError(null);
 
     try {
-      const response = await fetch(`${apiUrl}/csv/statistics`);
+      const response = await fetch(`${apiUrl}/csv/statistics?dataset_id=${encodeURIComponent(datasetId)}`);
       
       if (!response.ok) {
         const errorData = await response.json();
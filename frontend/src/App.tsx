@@ -74,6 +74,7 @@ const App: React.FC = () => {
           <CSVUploader 
             onUploadSuccess={handleUploadSuccess}
             apiUrl={apiUrl}
+            datasetId={uploadInfo?.dataset_id}
           />
           
           {uploadInfo && (
@@ -119,18 +120,21 @@ const App: React.FC = () => {
                 {activeTab === 'results' && (
                   <AnalysisResults 
                     apiUrl={apiUrl}
+                    datasetId={uploadInfo.dataset_id}
                     analyzed={analyzed}
                   />
                 )}
                 {activeTab === 'top-comments' && (
                   <TopComments 
                     apiUrl={apiUrl}
+                    datasetId={uploadInfo.dataset_id}
                     analyzed={analyzed}
                   />
                 )}
                 {activeTab === 'report' && (
                   <CommentReport 
                     apiUrl={apiUrl}
+                    datasetId={uploadInfo.dataset_id}
                     analyzed={analyzed}
                   />
                 )}
@@ -3,9 +3,11 @@ import React, { useState } from 'react';
 interface CSVUploaderProps {
   onUploadSuccess: (data: any) => void;
   apiUrl: string;
+  // Dataset of the previous upload, replaced by the next one; a new dataset is created when missing
+  datasetId?: string;
 }
 
-const CSVUploader: React.FC<CSVUploaderProps> = ({ onUploadSuccess, apiUrl }) => {
+const CSVUploader: React.FC<CSVUploaderProps> = ({ onUploadSuccess, apiUrl, datasetId }) => {
   const [file, setFile] = useState<File | null>(null);
   const [uploading, setUploading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -33,10 +35,20 @@ const CSVUploader: React.FC<CSVUploaderProps> = ({ onUploadSuccess, apiUrl }) =>
     setError(null);
 
     try {
+      let targetId = datasetId;
+      if (!targetId) {
+        const created = await fetch(`${apiUrl}/csv/datasets`, { method: 'POST' });
+        if (!created.ok) {
+          const errorData = await created.json();
+          throw new Error(errorData.detail || 'Failed to create dataset');
+        }
+        targetId = (await created.json()).dataset_id as string;
+      }
+
       const formData = new FormData();
       formData.append('file', file);
 
-      const response = await fetch(`${apiUrl}/csv/upload`, {
+      const response = await fetch(`${apiUrl}/csv/upload?dataset_id=${encodeURIComponent(targetId)}`, {
         method: 'POST',
         body: formData,
       });
@@ -23,6 +23,7 @@ interface CSVViewerProps {
 }
 
 const CSVViewer: React.FC<CSVViewerProps> = ({ apiUrl, uploadInfo, onAnalysisComplete }) => {
+  const datasetQuery = `dataset_id=${encodeURIComponent(uploadInfo.dataset_id)}`;
   const [csvData, setCsvData] = useState<CSVData | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -37,7 +38,7 @@ const CSVViewer: React.FC<CSVViewerProps> = ({ apiUrl, uploadInfo, onAnalysisCom
 
   const fetchStatistics = async () => {
     try {
-      const response = await fetch(`${apiUrl}/csv/statistics`);
+      const response = await fetch(`${apiUrl}/csv/statistics?${datasetQuery}`);
       if (response.ok) {
         const stats = await response.json();
         setStatistics(stats);
@@ -52,7 +53,7 @@ const CSVViewer: React.FC<CSVViewerProps> = ({ apiUrl, uploadInfo, onAnalysisCom
     setError(null);
 
     try {
-      const response = await fetch(`${apiUrl}/csv/data?page=${page}&page_size=${size}`);
+      const response = await fetch(`${apiUrl}/csv/data?page=${page}&page_size=${size}&${datasetQuery}`);
       
       if (!response.ok) {
         const errorData = await response.json();
@@ -90,7 +91,7 @@ const CSVViewer: React.FC<CSVViewerProps> = ({ apiUrl, uploadInfo, onAnalysisCom
     setError(null);
 
     try {
-      const response = await fetch(`${apiUrl}/csv/analyze`, {
+      const response = await fetch(`${apiUrl}/csv/analyze?${datasetQuery}`, {
         method: 'POST',
       });
 
@@ -134,7 +135,7 @@ const CSVViewer: React.FC<CSVViewerProps> = ({ apiUrl, uploadInfo, onAnalysisCom
 
   const handleDownload = async () => {
     try {
-      const response = await fetch(`${apiUrl}/csv/download`);
+      const response = await fetch(`${apiUrl}/csv/download?${datasetQuery}`);
       
       if (!response.ok) {
         const errorData = await response.json();
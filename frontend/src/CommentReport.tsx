@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 
 interface CommentReportProps {
   apiUrl: string;
+  datasetId: string;
   analyzed: boolean;
 }
 
@@ -13,7 +14,7 @@ interface ReportData {
   total_comments_analyzed: number;
 }
 
-const CommentReport: React.FC<CommentReportProps> = ({ apiUrl, analyzed }) => {
+const CommentReport: React.FC<CommentReportProps> = ({ apiUrl, datasetId, analyzed }) => {
   const [reportData, setReportData] = useState<ReportData | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -24,7 +25,7 @@ const CommentReport: React.FC<CommentReportProps> = ({ apiUrl, analyzed }) => {
     setError(null);
 
     try {
-      const response = await fetch(`${apiUrl}/csv/generate-report`, {
+      const response = await fetch(`${apiUrl}/csv/generate-report?dataset_id=${encodeURIComponent(datasetId)}`, {
         method: 'POST',
       });
 
@@ -18,10 +18,11 @@ interface TopCommentsData {
 
 interface TopCommentsProps {
   apiUrl: string;
+  datasetId: string;
   analyzed: boolean;
 }
 
-const TopComments: React.FC<TopCommentsProps> = ({ apiUrl, analyzed }) => {
+const TopComments: React.FC<TopCommentsProps> = ({ apiUrl, datasetId, analyzed }) => {
   const [topComments, setTopComments] = useState<TopCommentsData | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -35,7 +36,7 @@ const TopComments: React.FC<TopCommentsProps> = ({ apiUrl, analyzed }) => {
     setError(null);
 
     try {
-      const response = await fetch(`${apiUrl}/csv/top-comments?max_count=${count}`);
+      const response = await fetch(`${apiUrl}/csv/top-comments?max_count=${count}&dataset_id=${encodeURIComponent(datasetId)}`);
       
       if (!response.ok) {
         const errorData = await response.json();